@@ -1,37 +1,159 @@
 """
 AI Image Text Editor - Vercel Serverless Version
 100% FREE - Uses Pollinations.ai (no API key needed)
-OCR works locally, graceful fallback in serverless
+OCR is opt-in (ENABLE_OCR=1), manual text mode otherwise
+
+Cold starts only pay for Flask + Pillow: requests, numpy and EasyOCR (torch)
+are imported by the routes that need them, and every import is timed
+(GET /api/debug/imports when DEBUG_ENDPOINTS=1).
 """
 
-from flask import Flask, request, jsonify, Response
-from PIL import Image, ImageDraw, ImageFont, ImageColor, ImageEnhance, ImageFilter
-import io
-import base64
-import requests
-import urllib.parse
-import os
-import numpy as np
+import time
+import sys
+
+_BOOT_STARTED = time.perf_counter()
+
+# label -> {'ms': ..., 'modules': ...} for each (deferred) import
+IMPORT_TIMINGS = {}
+
+
+class _import_timer:
+    """Time an import block and count the modules it pulled in"""
+
+    def __init__(self, label):
+        self.label = label
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.modules_before = len(sys.modules)
+
+    def __exit__(self, *exc):
+        IMPORT_TIMINGS[self.label] = {
+            'ms': round((time.perf_counter() - self.started) * 1000, 2),
+            'modules': len(sys.modules) - self.modules_before,
+            'at_startup': BOOT_MS is None
+        }
+
+
+BOOT_MS = None
+
+with _import_timer('stdlib'):
+    import io
+    import os
+    import base64
+
+with _import_timer('flask'):
+    from flask import Flask, request, jsonify, Response, g
+
+with _import_timer('PIL'):
+    from PIL import Image
 
-# Try to import OCR - works locally, may fail in serverless
+# Shared image pipeline (src/) - same stages as the full server
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+with _import_timer('image pipeline'):
+    import pipeline
+    import cpu_budget
+    import metrics
+    import profiling
+    from rendering import encode_png_base64
+    from storage import FileStorage, MemoryStorage, DecodedImageCache, content_key, is_content_key
+
+# OCR is strictly opt-in: EasyOCR pulls in torch (seconds of import time and
+# most of the function's memory), so it is only loaded when enabled and only
+# by the first request that needs it
+OCR_ENABLED = os.environ.get('ENABLE_OCR', '').lower() in ('1', 'true', 'yes')
 OCR_AVAILABLE = False
 reader = None
-try:
-    import easyocr
-    reader = easyocr.Reader(['en'], gpu=False)
-    OCR_AVAILABLE = True
-    print("✅ OCR (EasyOCR) loaded successfully!")
-except ImportError:
-    print("⚠️ EasyOCR not available - OCR disabled (manual text mode)")
-except Exception as e:
-    print(f"⚠️ OCR initialization failed: {e}")
+_ocr_load_attempted = False
+
+
+def get_requests():
+    """Deferred `requests` import (~80 ms) - only routes calling upstream APIs pay it"""
+    if 'requests' not in IMPORT_TIMINGS:
+        with _import_timer('requests'):
+            import requests
+    return sys.modules['requests']
+
+
+def get_ocr_reader():
+    """Load EasyOCR on first use when ENABLE_OCR is set; returns the reader or None"""
+    global reader, OCR_AVAILABLE, _ocr_load_attempted
+    if not OCR_ENABLED or _ocr_load_attempted:
+        return reader
+    _ocr_load_attempted = True
+    try:
+        with _import_timer('numpy'):
+            import numpy
+        with _import_timer('easyocr'):
+            import easyocr
+        with _import_timer('easyocr.Reader'):
+            reader = easyocr.Reader(['en'], gpu=False)
+        OCR_AVAILABLE = True
+        print("✅ OCR (EasyOCR) loaded successfully!")
+    except ImportError:
+        print("⚠️ EasyOCR not available - OCR disabled (manual text mode)")
+    except Exception as e:
+        print(f"⚠️ OCR initialization failed: {e}")
+    return reader
 
 # Create Flask app
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
 
-# Using Pollinations.ai - 100% FREE, NO API KEY NEEDED!
-POLLINATIONS_API = "https://image.pollinations.ai/prompt/"
+# Per-stage latency histograms and request counters on /metrics
+metrics.instrument_app(app)
+# torch / OpenCV threads per OCR call follow the number of requests in flight
+cpu_budget.budget.track_app(app)
+# Opt-in request profiles (X-Profile admin header or PROFILE_SAMPLE_RATE)
+profiling.register_admin_routes(app)
+
+# Uploaded images are stored once under their content hash (image_ref) and
+# referenced by later calls. BLOB_STORE_DIR selects a filesystem blob store
+# (e.g. /tmp or a shared mount); the default keeps blobs in memory for the
+# life of this (warm) instance. On a miss the client is asked to re-upload.
+BLOB_STORE_DIR = os.environ.get('BLOB_STORE_DIR', '')
+if BLOB_STORE_DIR:
+    upload_storage = FileStorage(BLOB_STORE_DIR)
+else:
+    upload_storage = MemoryStorage(max_items=int(os.environ.get('MEMORY_STORAGE_ITEMS', 32)))
+generated_storage = MemoryStorage(max_items=int(os.environ.get('MEMORY_STORAGE_ITEMS', 32)))
+# Decoded uploads, so generations from the same image skip the PNG/JPEG decode
+decoded_images = DecodedImageCache(max_items=int(os.environ.get('DECODED_IMAGE_CACHE', 4)))
+
+
+def store_blob(data):
+    """Store encoded image bytes once under their content hash; returns (image_ref, newly_stored)"""
+    image_ref = content_key(data)
+    if upload_storage.exists(image_ref):
+        return image_ref, False
+    upload_storage.save_bytes(data, image_ref)
+    return image_ref, True
+
+
+def is_valid_image(data):
+    """Whether the bytes decode as an image (checked before anything is stored)"""
+    try:
+        Image.open(io.BytesIO(data)).verify()
+        return True
+    except Exception:
+        return False
+
+
+def image_mimetype(data):
+    """MIME type of stored image bytes (uploads keep their JPEG/WEBP/... encoding)"""
+    try:
+        return Image.MIME.get(Image.open(io.BytesIO(data)).format, 'application/octet-stream')
+    except Exception:
+        return 'application/octet-stream'
+
+
+def reupload_required(image_ref):
+    return jsonify({
+        'error': 'Image not found on this server - upload it again',
+        'reupload_required': True,
+        'image_ref': image_ref
+    }), 404
 
 # HTML template cached
 HTML_TEMPLATE = None
@@ -49,6 +171,7 @@ def index():
     return Response(get_html_template(), mimetype='text/html')
 
 @app.route('/api/upload', methods=['POST'])
+@profiling.profiled
 def upload_image():
     """Upload and process image - OCR if available, fallback to manual"""
     if 'image' not in request.files:
@@ -59,71 +182,51 @@ def upload_image():
         return jsonify({'error': 'No selected file'}), 400
     
     try:
-        img = Image.open(file.stream)
-        if img.mode != 'RGB':
+        data = file.read()
+        img = Image.open(io.BytesIO(data))
+        img.verify()  # Reject non-images before storing anything
+        img = Image.open(io.BytesIO(data))
+        with metrics.stage('decode'):
+            img.load()
+        with metrics.stage('rgb_convert'):
             img = img.convert('RGB')
         
-        buffered = io.BytesIO()
-        img.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+        # The original bytes are stored as-is under their hash (no re-encode)
+        filename, _ = store_blob(data)
+        decoded_images.put(filename, img)
         
-        detected_texts = []
-        note = 'Add text manually using the + button'
+        # OCR if enabled (loads EasyOCR on the first upload), manual text otherwise
+        ocr_reader = get_ocr_reader()
+        if ocr_reader is not None:
+            # Set OCR_TIME_BUDGET well inside the function timeout to bound it (minus
+            # time already spent on this request); unset, the image is read in one call
+            detected_texts, clean_img, ocr_report = pipeline.run_ocr(
+                ocr_reader, img, pipeline.ocr_budget_left(g.get('metrics_started')))
+        else:
+            detected_texts, clean_img = pipeline.placeholder_text(img), img
+            ocr_report = {'partial': False}
         
-        # Try OCR if available
-        if OCR_AVAILABLE and reader is not None:
-            try:
-                img_array = np.array(img)
-                results = reader.readtext(img_array)
-                
-                for idx, (bbox, text, confidence) in enumerate(results):
-                    if confidence > 0.3 and text.strip():
-                        x_coords = [p[0] for p in bbox]
-                        y_coords = [p[1] for p in bbox]
-                        x = int(min(x_coords))
-                        y = int(min(y_coords))
-                        width = int(max(x_coords) - min(x_coords))
-                        height = int(max(y_coords) - min(y_coords))
-                        
-                        font_size = max(12, min(72, int(height * 0.9)))
-                        
-                        detected_texts.append({
-                            'id': idx + 1,
-                            'text': text,
-                            'position': {'x': x, 'y': y},
-                            'font': 'Arial',
-                            'size': font_size,
-                            'color': '#ffffff',
-                            'weight': 'normal',
-                            'bbox': {'width': width, 'height': height}
-                        })
-                
-                if detected_texts:
-                    note = f'Detected {len(detected_texts)} text elements'
-            except Exception as e:
-                print(f"OCR error: {e}")
+        clean_filename = filename
+        if clean_img is not img:
+            clean_filename = upload_storage.save_image(clean_img, f'clean_{filename}')
         
-        # Fallback placeholder if no text detected
-        if not detected_texts:
-            detected_texts = [{
-                'id': 1,
-                'text': 'Click to Edit Text',
-                'position': {'x': int(img.width * 0.5), 'y': int(img.height * 0.5)},
-                'font': 'Arial',
-                'size': 60,
-                'color': '#ffffff',
-                'weight': 'bold',
-                'isPlaceholder': True
-            }]
+        found = [t for t in detected_texts if not t.get('isPlaceholder')]
+        note = f'Detected {len(found)} text elements' if found else 'Add text manually using the + button'
+        if ocr_report['partial']:
+            note += ' (OCR time limit reached - some text was not read)'
         
         return jsonify({
             'success': True,
-            'image_data': f'data:image/png;base64,{img_str}',
+            'image_path': filename,
+            'image_ref': filename,
+            'clean_image_path': clean_filename,
+            'image_data': encode_png_base64(clean_img),
             'detected_texts': detected_texts,
-            'width': img.width,
-            'height': img.height,
+            'width': clean_img.width,
+            'height': clean_img.height,
             'note': note,
-            'ocr_available': OCR_AVAILABLE
+            'ocr_available': OCR_AVAILABLE,
+            'ocr_partial': ocr_report['partial']
         })
     
     except Exception as e:
@@ -152,6 +255,7 @@ def describe_image():
     })
 
 @app.route('/api/generate', methods=['POST'])
+@profiling.profiled
 def generate_variations():
     """Generate variations with AI backgrounds or effects"""
     data = request.json
@@ -159,110 +263,83 @@ def generate_variations():
     style_prompt = data.get('style_prompt', '').strip()
     
     try:
+        # Reference to an uploaded image (preferred), or the image itself inline
+        image_ref = data.get('image_ref') or data.get('image_path', '')
         image_data = data.get('image_data', '')
-        if not image_data:
-            return jsonify({'error': 'No image data provided'}), 400
-        
-        image_data = image_data.split(',')[1] if ',' in image_data else image_data
-        base_img = Image.open(io.BytesIO(base64.b64decode(image_data)))
-        if base_img.mode != 'RGB':
-            base_img = base_img.convert('RGB')
+        if image_data:
+            image_data = image_data.split(',')[1] if ',' in image_data else image_data
+            try:
+                image_bytes = base64.b64decode(image_data)
+            except ValueError:
+                image_bytes = b''
+            if not is_valid_image(image_bytes):
+                return jsonify({'error': 'Not a valid image'}), 400
+            image_ref, _ = store_blob(image_bytes)
+        if not image_ref:
+            return jsonify({'error': 'No image provided'}), 400
         
-        variations = []
-        use_ai_background = bool(style_prompt and len(style_prompt) > 3)
+        base_img = decoded_images.get(upload_storage, image_ref)
+        if base_img is None:
+            return reupload_required(image_ref)
         
-        if use_ai_background:
-            effects = [
-                {'name': f'{style_prompt} - Modern', 'description': f'Modern style with {style_prompt}', 'prompt_suffix': ', modern professional design, high quality, 4k'},
-                {'name': f'{style_prompt} - Vibrant', 'description': f'Vibrant style with {style_prompt}', 'prompt_suffix': ', vibrant colorful artistic design, beautiful'},
-                {'name': f'{style_prompt} - Minimalist', 'description': f'Minimalist style with {style_prompt}', 'prompt_suffix': ', minimalist clean elegant design, simple'}
-            ]
-        else:
-            effects = [
-                {'name': 'Enhanced Colors', 'description': 'Vibrant colors with enhanced contrast', 'prompt_suffix': None},
-                {'name': 'Artistic Filter', 'description': 'Stylized artistic look', 'prompt_suffix': None},
-                {'name': 'Professional', 'description': 'Clean professional look', 'prompt_suffix': None}
-            ]
+        if style_prompt and len(style_prompt) > 3:
+            get_requests()  # Timed here; Pollinations calls need it
         
-        for i, effect in enumerate(effects):
-            try:
-                if use_ai_background and effect['prompt_suffix']:
-                    text_content = ', '.join([t['text'] for t in texts if t.get('text')])
-                    full_prompt = style_prompt + effect['prompt_suffix']
-                    if text_content:
-                        full_prompt += f", with text: {text_content}"
-                    
-                    encoded_prompt = urllib.parse.quote(full_prompt)
-                    api_url = f"{POLLINATIONS_API}{encoded_prompt}?width=1024&height=1024&model=flux&nologo=true&enhance=true"
-                    
-                    response = requests.get(api_url, timeout=120)
-                    
-                    if response.status_code == 200:
-                        ai_img = Image.open(io.BytesIO(response.content))
-                        if ai_img.mode != 'RGB':
-                            ai_img = ai_img.convert('RGB')
-                        variation_img = ai_img.resize(base_img.size, Image.Resampling.LANCZOS)
-                    else:
-                        variation_img = base_img.copy()
-                else:
-                    variation_img = base_img.copy()
-                    if i == 0:
-                        enhancer = ImageEnhance.Color(variation_img)
-                        variation_img = enhancer.enhance(1.3)
-                        enhancer = ImageEnhance.Contrast(variation_img)
-                        variation_img = enhancer.enhance(1.2)
-                    elif i == 1:
-                        variation_img = variation_img.filter(ImageFilter.SMOOTH)
-                        enhancer = ImageEnhance.Color(variation_img)
-                        variation_img = enhancer.enhance(1.4)
-                    elif i == 2:
-                        variation_img = variation_img.filter(ImageFilter.SHARPEN)
-                        enhancer = ImageEnhance.Contrast(variation_img)
-                        variation_img = enhancer.enhance(1.15)
-                
-                draw = ImageDraw.Draw(variation_img)
-                
-                for text_elem in texts:
-                    text = text_elem.get('text', '')
-                    x = int(text_elem.get('position', {}).get('x', 50))
-                    y = int(text_elem.get('position', {}).get('y', 50))
-                    color = text_elem.get('color', '#ffffff')
-                    size = int(text_elem.get('size', 48))
-                    
-                    try:
-                        color_rgb = ImageColor.getrgb(color)
-                    except:
-                        color_rgb = (255, 255, 255)
-                    
-                    font = ImageFont.load_default()
-                    
-                    for adj_x in range(-2, 3):
-                        for adj_y in range(-2, 3):
-                            draw.text((x + adj_x, y + adj_y), text, font=font, fill=(0, 0, 0))
-                    draw.text((x, y), text, font=font, fill=color_rgb)
-                
-                buffered = io.BytesIO()
-                variation_img.save(buffered, format="PNG")
-                img_str = base64.b64encode(buffered.getvalue()).decode()
-                
-                variations.append({
-                    'id': i + 1,
-                    'image_data': f'data:image/png;base64,{img_str}',
-                    'description': effect['description'],
-                    'effect': effect['name']
-                })
-                
-            except Exception as e:
-                variations.append({
-                    'id': i + 1,
-                    'error': f'Error: {str(e)}',
-                    'effect': effect['name']
-                })
-        
-        return jsonify({'success': True, 'variations': variations})
+        variations = pipeline.generate_variations(base_img, texts, style_prompt, storage=generated_storage)
+        return jsonify({'success': True, 'variations': variations, 'image_ref': image_ref})
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/blobs', methods=['POST'])
+def upload_blob():
+    """Store an image without processing it (re-upload after a miss); returns its image_ref"""
+    file = request.files.get('image')
+    data = file.read() if file else request.get_data()
+    if not data:
+        return jsonify({'error': 'No image provided'}), 400
+    
+    if not is_valid_image(data):
+        return jsonify({'error': 'Not a valid image'}), 400
+    
+    image_ref, stored = store_blob(data)
+    return jsonify({'success': True, 'image_ref': image_ref, 'stored': stored})
+
+@app.route('/api/blobs/<image_ref>', methods=['GET', 'HEAD'])
+def blob_exists(image_ref):
+    """Whether an image is stored (lets clients skip uploading it again)"""
+    if not is_content_key(image_ref) or not upload_storage.exists(image_ref):
+        return jsonify({'exists': False, 'image_ref': image_ref}), 404
+    return jsonify({'exists': True, 'image_ref': image_ref})
+
+@app.route('/api/download/<path:filename>')
+def download_file(filename):
+    """Download a variation generated by this instance (or a stored upload)"""
+    data = generated_storage.load_bytes(filename) or upload_storage.load_bytes(filename)
+    if data is None:
+        return jsonify({'error': 'File not found'}), 404
+    return Response(data, mimetype=image_mimetype(data),
+                    headers={'Content-Disposition': f'attachment; filename={os.path.basename(filename)}'})
+
+@app.route('/api/debug/imports')
+def debug_imports():
+    """Import-time breakdown of this instance (cold start cost per dependency)"""
+    if os.environ.get('DEBUG_ENDPOINTS', '').lower() not in ('1', 'true', 'yes'):
+        return jsonify({'error': 'Not found'}), 404
+    
+    heavy = ['numpy', 'requests', 'easyocr', 'torch', 'cv2']
+    return jsonify({
+        'success': True,
+        'boot_ms': BOOT_MS,
+        'imports': IMPORT_TIMINGS,
+        'modules_loaded': len(sys.modules),
+        'heavy_modules_loaded': {name: name in sys.modules for name in heavy},
+        'ocr_enabled': OCR_ENABLED,
+        'ocr_available': OCR_AVAILABLE
+    })
+
+BOOT_MS = round((time.perf_counter() - _BOOT_STARTED) * 1000, 2)
+print(f"⚡ Cold start: {BOOT_MS} ms")
+
 # Vercel requires the app to be named 'app'
 # This file is the entry point for Vercel Python runtime
@@ -0,0 +1,83 @@
+"""
+Production server for src/app_free.py
+    gunicorn            (from the project root; this file is picked up automatically)
+
+The app - and with it the EasyOCR model - is imported once in the master
+and the workers are forked from it, so the model weights are shared
+copy-on-write instead of loaded once per worker. Worker and thread counts
+follow the cores available to the container:
+
+    WEB_CONCURRENCY   worker processes (default 1: the worker scales with its
+                      threads and admission control). AI edit and batch job
+                      state and /metrics are kept per process, so with more
+                      workers a job is only visible on the worker that took it:
+                      route clients to one worker (sticky sessions) first
+    GUNICORN_THREADS  request threads per worker (default 16: admission control
+                      bounds the CPU work, extra threads only queue or wait on upstreams)
+    OCR_THREADS       torch/OpenCV threads per worker (default: cores / workers),
+                      shared out between the worker's concurrent OCR/inpaint calls
+    SERVER_MODE=asgi  serve src/asgi.py on uvicorn workers instead: generate,
+                      describe, memes and AI edit await upstreams without a thread
+"""
+
+import gc
+import os
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+sys.path.insert(0, SRC_DIR)
+
+import cpu_budget
+
+cores = cpu_budget.available_cores()
+
+wsgi_app = 'app_free:app'
+pythonpath = SRC_DIR
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+preload_app = True
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+intra_op_threads = int(os.environ.get('OCR_THREADS', max(1, cores // workers)))
+
+if os.environ.get('SERVER_MODE') == 'asgi':
+    wsgi_app = 'asgi:app'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+
+# OCR of a large image can take a while on small instances
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
+
+# The preloaded app imports torch/numpy/cv2 after this file is read, so
+# their thread pools start at the per-worker size
+cpu_budget.limit_native_threads(intra_op_threads)
+# Admission slots per worker: the app reads this when it is preloaded
+os.environ.setdefault('ADMISSION_SLOTS', str(max(2, intra_op_threads)))
+# Batch render processes per worker: one per core for the host as a whole
+os.environ.setdefault('BATCH_WORKERS', str(max(1, cores // workers)))
+
+
+def when_ready(server):
+    # Everything imported so far (model included) moves to the permanent
+    # generation: the collector no longer touches those objects, so their
+    # pages stay shared with the workers instead of being copied
+    gc.freeze()
+    server.log.info(f"🏭 {workers} workers x {threads} threads, {intra_op_threads} OCR threads each ({cores} cores)")
+    if workers > 1:
+        server.log.warning("⚠️ AI edit / batch job status and /metrics are per worker: "
+                           "polls reaching another worker get 404 unless clients stick to one worker")
+
+
+def post_fork(server, worker):
+    applied = cpu_budget.set_intra_op_threads(intra_op_threads)
+    # Concurrent OCR / inpaint calls share this many threads
+    cpu_budget.budget.configure(intra_op_threads)
+    server.log.info(f"⚙️ Worker {worker.pid} intra-op threads: {applied}")
+
+    # Background threads do not survive the fork; start them in each worker
+    app_module = sys.modules.get('app_free')
+    if app_module is not None:
+        app_module.caption_pool.warm()
@@ -0,0 +1,192 @@
+"""
+Admission control for CPU-heavy endpoints
+Each limited endpoint gets a concurrency limit and a bounded wait queue,
+and all of them share a pool of CPU slots. Queued requests are admitted by
+priority (cheap, interactive endpoints first), then in arrival order; when
+an endpoint's queue is full - or a request waited too long - the client
+gets an immediate 429 with Retry-After instead of slowing everyone down.
+
+    admission_control = AdmissionController(total_slots=4)
+
+    @app.route('/api/upload', methods=['POST'])
+    @admission_control.limit('upload', limit=2, queue_size=8)
+    def upload_image(): ...
+
+Limits can be overridden per endpoint with ADMISSION_<NAME>_LIMIT /
+ADMISSION_<NAME>_QUEUE; ADMISSION_ENABLED=0 turns the gates off.
+"""
+
+from functools import wraps
+import threading
+import itertools
+import math
+import time
+import os
+
+import cpu_budget
+import metrics
+
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', '1') == '1'
+ADMISSION_MAX_WAIT = float(os.environ.get('ADMISSION_MAX_WAIT', 10))
+
+QUEUE_WAIT_SECONDS = metrics.Histogram(
+    'image_editor_admission_wait_seconds', 'Time a request waited for admission',
+    ['endpoint', 'outcome'])
+REJECTED_TOTAL = metrics.Counter(
+    'image_editor_admission_rejected_total', 'Requests turned away with 429',
+    ['endpoint', 'reason'])
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+class _Endpoint:
+    def __init__(self, name, limit, queue_size, priority, max_wait):
+        self.name = name
+        self.limit = max(1, limit)
+        self.queue_size = max(0, queue_size)
+        self.priority = priority  # lower is admitted first
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        self.service_time = 1.0  # moving average of admitted request time (s)
+
+
+class _Waiter:
+    def __init__(self, endpoint, order):
+        self.endpoint = endpoint
+        self.order = order
+        self.event = threading.Event()
+        self.granted = False
+
+
+class AdmissionController:
+    """Concurrency limits + bounded priority queue shared by the limited endpoints"""
+
+    def __init__(self, total_slots, max_wait=ADMISSION_MAX_WAIT):
+        self.total_slots = max(1, total_slots)
+        self.max_wait = max_wait
+        self.active_total = 0
+        self.endpoints = {}
+        self.waiters = []
+        self.order = itertools.count()
+        self.lock = threading.Lock()
+
+        metrics.Gauge(
+            'image_editor_admission_queue_depth', 'Requests waiting for admission',
+            ['endpoint'], callback=lambda: self._snapshot('waiting'))
+        metrics.Gauge(
+            'image_editor_admission_in_flight', 'Admitted requests currently running',
+            ['endpoint'], callback=lambda: self._snapshot('active'))
+
+    def _snapshot(self, field):
+        with self.lock:
+            return {(name,): getattr(endpoint, field) for name, endpoint in self.endpoints.items()}
+
+    def _can_run(self, endpoint):
+        return endpoint.active < endpoint.limit and self.active_total < self.total_slots
+
+    def _grant(self, endpoint):
+        endpoint.active += 1
+        self.active_total += 1
+
+    def _dispatch(self):
+        """Admit queued requests, highest priority first (lock held)"""
+        for waiter in sorted(self.waiters, key=lambda w: (w.endpoint.priority, w.order)):
+            if self.active_total >= self.total_slots:
+                break
+            if self._can_run(waiter.endpoint):
+                self._grant(waiter.endpoint)
+                waiter.endpoint.waiting -= 1
+                waiter.granted = True
+                self.waiters.remove(waiter)
+                waiter.event.set()
+
+    def retry_after(self, endpoint):
+        """Seconds until the queue in front of a new request has likely drained"""
+        return max(1, math.ceil((endpoint.waiting + 1) * endpoint.service_time / endpoint.limit))
+
+    def acquire(self, endpoint):
+        """
+        Wait for a slot. Returns (admitted, retry_after); a rejected request
+        was never counted as active
+        """
+        started = time.perf_counter()
+        with self.lock:
+            # Requests already queued for this endpoint go first
+            if endpoint.waiting == 0 and self._can_run(endpoint):
+                self._grant(endpoint)
+                QUEUE_WAIT_SECONDS.observe(0.0, endpoint.name, 'admitted')
+                return True, 0
+            if endpoint.waiting >= endpoint.queue_size:
+                REJECTED_TOTAL.inc(endpoint.name, 'queue_full')
+                QUEUE_WAIT_SECONDS.observe(0.0, endpoint.name, 'rejected')
+                return False, self.retry_after(endpoint)
+            waiter = _Waiter(endpoint, next(self.order))
+            endpoint.waiting += 1
+            self.waiters.append(waiter)
+
+        # Queued requests do not compete for CPU: they give up their thread share
+        with cpu_budget.budget.idle():
+            waiter.event.wait(endpoint.max_wait)
+
+        with self.lock:
+            waited = time.perf_counter() - started
+            if waiter.granted:
+                QUEUE_WAIT_SECONDS.observe(waited, endpoint.name, 'admitted')
+                return True, 0
+            self.waiters.remove(waiter)
+            endpoint.waiting -= 1
+            REJECTED_TOTAL.inc(endpoint.name, 'timeout')
+            QUEUE_WAIT_SECONDS.observe(waited, endpoint.name, 'rejected')
+            return False, self.retry_after(endpoint)
+
+    def release(self, endpoint, service_seconds):
+        with self.lock:
+            endpoint.active -= 1
+            self.active_total -= 1
+            endpoint.service_time = 0.8 * endpoint.service_time + 0.2 * service_seconds
+            self._dispatch()
+
+    def limit(self, name, limit, queue_size, priority=1, max_wait=None):
+        """
+        Route decorator: at most `limit` concurrent requests (plus `queue_size`
+        waiting) for this endpoint; lower `priority` values are admitted first
+        """
+        key = name.upper()
+        endpoint = _Endpoint(
+            name,
+            _env_int(f'ADMISSION_{key}_LIMIT', limit),
+            _env_int(f'ADMISSION_{key}_QUEUE', queue_size),
+            priority,
+            self.max_wait if max_wait is None else max_wait)
+        with self.lock:
+            self.endpoints[name] = endpoint
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not ADMISSION_ENABLED:
+                    return view(*args, **kwargs)
+
+                admitted, retry_after = self.acquire(endpoint)
+                if not admitted:
+                    from flask import jsonify
+                    response = jsonify({
+                        'error': 'Server is busy, please retry shortly',
+                        'retry_after': retry_after
+                    })
+                    response.status_code = 429
+                    response.headers['Retry-After'] = str(retry_after)
+                    return response
+
+                started = time.perf_counter()
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    self.release(endpoint, time.perf_counter() - started)
+
+            return wrapper
+
+        return decorator
@@ -0,0 +1,398 @@
+"""
+Background job queue for AI image editing
+/api/ai-edit submits a job and returns immediately; a small executor runs
+provider attempts and a single timer thread reschedules retries, so no
+Flask worker (and no executor worker) sleeps while a model is loading.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from datetime import datetime
+from PIL import Image
+import threading
+import hashlib
+import heapq
+import json
+import time
+import uuid
+import io
+import os
+
+from ai_providers import RetryLater
+from provider_router import HEDGE_PERCENTILE
+import rate_limit
+import metrics
+
+# Finished jobs are kept this long for status polling
+JOB_RETENTION_SECONDS = 3600
+
+# Provider result formats stored without re-encoding (PIL format -> extension)
+RESULT_EXTENSIONS = {'PNG': 'png', 'JPEG': 'jpg', 'WEBP': 'webp'}
+
+# Completed edits are reused for identical (image, prompt, providers, params)
+CACHE_SIZE = int(os.environ.get('AI_EDIT_CACHE_SIZE', 256))
+CACHE_TTL_SECONDS = float(os.environ.get('AI_EDIT_CACHE_TTL', 24 * 3600))
+
+# Longest a job waits for a provider's rate limit before moving on to the next one
+RATE_LIMIT_MAX_WAIT = float(os.environ.get('AI_EDIT_RATE_LIMIT_MAX_WAIT', 60))
+
+
+def make_cache_key(image_bytes, prompt, providers):
+    """Content hash of the input image + prompt + provider chain and their parameters"""
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    chain = [{'name': p.name, 'params': p.params} for p in providers]
+    signature = json.dumps({'image': digest, 'prompt': prompt.strip(), 'providers': chain}, sort_keys=True)
+    return hashlib.sha256(signature.encode()).hexdigest()
+
+
+class ResultCache:
+    """LRU of cache key -> result filename, with a TTL; entries whose file is gone are dropped"""
+
+    def __init__(self, folder, max_entries=CACHE_SIZE, ttl=CACHE_TTL_SECONDS):
+        self.folder = folder
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (filename, provider, stored_at)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            filename, provider, stored_at = entry
+            if time.time() - stored_at > self.ttl or not os.path.exists(os.path.join(self.folder, filename)):
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return filename, provider
+
+    def put(self, key, filename, provider):
+        with self.lock:
+            self.entries[key] = (filename, provider, time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class RetryScheduler:
+    """One daemon thread that fires callbacks at their due time (replaces time.sleep retries)"""
+
+    def __init__(self):
+        self._heap = []
+        self._counter = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._thread_pid = None
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        """Start (or restart after a fork, e.g. preloaded gunicorn workers) the timer thread"""
+        if self._thread is not None and self._thread.is_alive() and self._thread_pid == os.getpid():
+            return
+        self._thread_pid = os.getpid()
+        self._thread = threading.Thread(target=self._loop, name='ai-edit-retries', daemon=True)
+        self._thread.start()
+
+    def call_later(self, delay, fn, *args):
+        with self._cond:
+            self._ensure_thread()
+            self._counter += 1
+            heapq.heappush(self._heap, (time.monotonic() + delay, self._counter, fn, args))
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                _, _, fn, args = heapq.heappop(self._heap)
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"⚠️ Retry scheduler callback error: {e}")
+
+
+class AIEditJob:
+    """State of one AI edit request"""
+
+    def __init__(self, image, prompt, providers, cache_key=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.cache_key = cache_key
+        self.image = image
+        self.original_size = image.size
+        self.prompt = prompt
+        self.providers = providers
+        # Provider indexes that were started / that gave up
+        self.launched = set()
+        self.exhausted = set()
+        self.provider = None
+        # Set by the first provider that returns a result
+        self.winner = None
+        self.attempt = 0
+        self.status = 'queued'
+        self.message = ''
+        self.errors = []
+        self.result_filename = None
+        self.created_at = time.time()
+        self.finished_at = None
+        # Bumped on every change so SSE listeners can wait for updates
+        self.version = 0
+        self.cond = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status in ('completed', 'failed')
+
+    @property
+    def settled(self):
+        """Done, or a provider already won and its result is being saved"""
+        return self.done or self.winner is not None
+
+    def update(self, **fields):
+        with self.cond:
+            for key, value in fields.items():
+                setattr(self, key, value)
+            self.version += 1
+            self.cond.notify_all()
+
+    def wait_for_change(self, version, timeout):
+        """Block until the job changes past `version` (or timeout); returns the current version"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def to_dict(self):
+        with self.cond:
+            data = {
+                'job_id': self.id,
+                'status': self.status,
+                'provider': self.provider,
+                'attempt': self.attempt + 1,
+                'message': self.message,
+                'created_at': datetime.fromtimestamp(self.created_at).isoformat()
+            }
+            if self.status == 'completed':
+                data['image_url'] = f'/api/download/{self.result_filename}'
+                data['filename'] = self.result_filename
+            if self.status == 'failed':
+                data['error'] = self.message
+                data['details'] = self.errors
+            return data
+
+
+class AIEditQueue:
+    """
+    Runs AI edit jobs on a bounded executor with timer-based retries
+    Providers are ordered and skipped by the ProviderRouter; with hedging
+    enabled the next provider is launched when the current one runs past
+    its latency percentile, the first success wins and the rest are cancelled.
+    """
+
+    def __init__(self, result_folder, router, max_workers=4):
+        self.result_folder = result_folder
+        self.router = router
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai-edit')
+        self.scheduler = RetryScheduler()
+        self.cache = ResultCache(result_folder)
+        self.jobs = {}
+        # cache key -> job currently running for it (single-flight)
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    def submit(self, image, prompt, providers, cache_key=None):
+        """
+        Queue an edit. Returns (job, how) where how is 'queued', 'cached'
+        (identical edit already done) or 'coalesced' (identical edit running)
+        """
+        with self.lock:
+            self._prune()
+
+            if cache_key:
+                cached = self.cache.get(cache_key)
+                if cached:
+                    filename, provider = cached
+                    job = AIEditJob(image, prompt, providers, cache_key)
+                    job.update(status='completed', provider=provider, winner=provider, image=None,
+                               message=f'Edited with {provider} (cached)',
+                               result_filename=filename, finished_at=time.time())
+                    self.jobs[job.id] = job
+                    print(f"♻️ AI edit cache hit -> {filename}")
+                    return job, 'cached'
+
+                running = self.inflight.get(cache_key)
+                if running is not None and not running.done:
+                    print(f"🔗 AI edit coalesced into running job {running.id}")
+                    return running, 'coalesced'
+
+            job = AIEditJob(image, prompt, self.router.order(providers), cache_key)
+            self.jobs[job.id] = job
+            if cache_key:
+                self.inflight[cache_key] = job
+
+        print(f"📥 AI edit job {job.id} queued ({', '.join(p.name for p in job.providers)})")
+        self._launch_next(job)
+        return job, 'queued'
+
+    def _settle(self, job):
+        """Job finished: release the single-flight slot and cache a successful result"""
+        if not job.cache_key:
+            return
+        with self.lock:
+            if self.inflight.get(job.cache_key) is job:
+                del self.inflight[job.cache_key]
+            if job.status == 'completed':
+                self.cache.put(job.cache_key, job.result_filename, job.provider)
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id in [j.id for j in self.jobs.values() if j.done and j.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    def _launch_next(self, job):
+        """Start the next provider whose circuit allows a call; fail the job when none is left"""
+        while True:
+            with job.cond:
+                if job.settled:
+                    return
+                pending = [i for i in range(len(job.providers)) if i not in job.launched]
+                if not pending:
+                    break
+                index = pending[0]
+                job.launched.add(index)
+            provider = job.providers[index]
+
+            if not self.router.allow(provider.name):
+                self._provider_failed(job, index, 'circuit open - skipped', launch_next=False)
+                continue
+
+            job.update(status='running', provider=provider.name, attempt=0,
+                       message=f'Editing with {provider.name}')
+            self.executor.submit(self._attempt, job, index, 0)
+
+            delay = self.router.hedge_delay(provider.name)
+            if delay is not None and len(pending) > 1:
+                self.scheduler.call_later(delay, self._hedge, job, index)
+            return
+
+        self._fail_if_exhausted(job)
+
+    def _hedge(self, job, index):
+        """Hedge timer fired - launch the next provider if this one is still running"""
+        with job.cond:
+            still_running = not job.settled and index not in job.exhausted
+        if still_running:
+            print(f"🏁 {job.providers[index].name} slower than p{int(HEDGE_PERCENTILE)}, hedging job {job.id}")
+            self._launch_next(job)
+
+    def _attempt(self, job, index, attempt):
+        """Pace one attempt with the provider's rate limit: call now, later, or skip the provider"""
+        if job.settled:
+            return  # Another provider already won (or the job failed)
+
+        provider = job.providers[index]
+        delay = rate_limit.bucket(provider.name).reserve(RATE_LIMIT_MAX_WAIT)
+        if delay is None:
+            self._provider_failed(job, index, 'rate limit - skipped')
+        elif delay > 0:
+            # The token is reserved; the timer thread waits for it, not a worker
+            job.update(message=f'{provider.name}: waiting {delay:.0f}s for the rate limit')
+            self.scheduler.call_later(delay, self.executor.submit, self._call_provider, job, index, attempt)
+        else:
+            self._call_provider(job, index, attempt)
+
+    def _call_provider(self, job, index, attempt):
+        """Make one attempt with one provider"""
+        if job.settled:
+            return
+
+        provider = job.providers[index]
+        started = time.monotonic()
+
+        try:
+            result_bytes = provider.edit(job.image, job.prompt, attempt)
+            # An answer that is not an image is a failed call (recorded as an error below)
+            result_img = Image.open(io.BytesIO(result_bytes))  # Header only until needed
+            self._record(provider, started, 'ok')
+            self._complete(job, provider, result_bytes, result_img)
+
+        except RetryLater as retry:
+            self._record(provider, started, 'retry')
+            # Other jobs would get the same answer: hold them back too
+            rate_limit.bucket(provider.name).pause(retry.delay)
+            if attempt + 1 < provider.max_attempts and not job.settled:
+                print(f"⏳ {provider.name}: {retry}, retrying in {retry.delay}s (attempt {attempt + 1}/{provider.max_attempts})")
+                job.update(status='retrying', attempt=attempt + 1,
+                           message=f'{provider.name}: {retry} - retrying in {retry.delay}s')
+                self.scheduler.call_later(retry.delay, self.executor.submit, self._attempt, job, index, attempt + 1)
+            else:
+                if attempt + 1 >= provider.max_attempts:
+                    # Out of attempts: the provider kept saying "later" - one failure for the breaker
+                    self.router.record(provider.name, time.monotonic() - started, False)
+                self._provider_failed(job, index, str(retry))
+
+        except Exception as e:
+            self._record(provider, started, 'error')
+            self._provider_failed(job, index, str(e))
+
+    def _record(self, provider, started, outcome):
+        """Feed one attempt's latency to the router (routing) and the metrics (dashboards)"""
+        elapsed = time.monotonic() - started
+        # 'retry' (model loading, busy) is the provider working normally, not a
+        # failure: it must not count towards opening the circuit for every job
+        if outcome != 'retry':
+            self.router.record(provider.name, elapsed, outcome == 'ok')
+        metrics.UPSTREAM_SECONDS.observe(elapsed, f'ai_edit_{provider.name}', 'background', outcome)
+
+    def _provider_failed(self, job, index, error, launch_next=True):
+        provider = job.providers[index]
+        print(f"⚠️ {provider.name} error: {error}")
+        with job.cond:
+            job.errors.append({'provider': provider.name, 'error': error})
+            job.exhausted.add(index)
+        if launch_next:
+            self._launch_next(job)
+
+    def _fail_if_exhausted(self, job):
+        with job.cond:
+            if job.settled or len(job.exhausted) < len(job.providers):
+                return  # A launched provider is still working
+        job.update(status='failed', message='All AI editing services failed - please try again',
+                   finished_at=time.time(), image=None)
+        self._settle(job)
+
+    def _complete(self, job, provider, result_bytes, result_img):
+        extension = RESULT_EXTENSIONS.get(result_img.format)
+
+        # First successful provider wins; late hedged results are dropped
+        with job.cond:
+            if job.settled:
+                print(f"🗑️ Discarding late {provider.name} result for job {job.id}")
+                return
+            job.winner = provider.name
+
+        try:
+            if result_img.size == job.original_size and extension:
+                # Already the right size - store the provider's bytes as they are
+                result_filename = f'ai_edited_{job.id}.{extension}'
+                with open(os.path.join(self.result_folder, result_filename), 'wb') as f:
+                    f.write(result_bytes)
+            else:
+                result_filename = f'ai_edited_{job.id}.png'
+                result_img = result_img.resize(job.original_size, Image.LANCZOS)
+                result_img.save(os.path.join(self.result_folder, result_filename))
+        except Exception as e:
+            job.update(status='failed', message=f'Could not save result: {e}',
+                       finished_at=time.time(), image=None)
+            self._settle(job)
+            return
+
+        print(f"✅ AI Edit ({provider.name}) complete: {result_filename}")
+        job.update(status='completed', provider=provider.name, message=f'Edited with {provider.name}',
+                   result_filename=result_filename, finished_at=time.time(), image=None)
+        self._settle(job)
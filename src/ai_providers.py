@@ -0,0 +1,227 @@
+"""
+AI image editing providers (Fal.ai, Hugging Face Instruct-Pix2Pix, Replicate)
+Each provider makes ONE attempt and returns the edited image bytes.
+Waiting between attempts is left to the caller (see ai_jobs.py) so no
+thread sleeps while a model is loading.
+Images stay in memory: the client's encoded bytes are sent as-is when the
+provider accepts them, and are only decoded when pixels really change.
+"""
+
+from collections import namedtuple
+from PIL import Image
+import threading
+import requests
+import base64
+import io
+import os
+
+# Base URLs are overridable to run against local stand-ins (tests/fake_upstreams.py).
+# Replicate's client reads REPLICATE_BASE_URL itself.
+HF_API_BASE = os.environ.get('HF_API_BASE', 'https://api-inference.huggingface.co')
+HF_PIX2PIX_URL = f"{HF_API_BASE.rstrip('/')}/models/timbrooks/instruct-pix2pix"
+# Empty: fal_client SDK (upload + queue). Set: fal's synchronous REST API at this base
+FAL_API_BASE = os.environ.get('FAL_API_BASE', '')
+REPLICATE_PIX2PIX_MODEL = "timbrooks/instruct-pix2pix:30c1d0b916a6f8efce20493f5d61ee27491ab2a60437c13c588468b9810ec23f"
+
+
+class RetryLater(Exception):
+    """The provider is temporarily unavailable (e.g. model loading) - retry after `delay` seconds"""
+
+    def __init__(self, delay, message=''):
+        super().__init__(message or f'retry in {delay}s')
+        self.delay = delay
+
+
+class ProviderError(Exception):
+    """The provider failed - move on to the next one"""
+
+
+def retry_after(response, default):
+    """Seconds from a Retry-After header (falls back to `default`)"""
+    try:
+        return max(1, int(float(response.headers.get('Retry-After', default))))
+    except ValueError:
+        return default
+
+
+class EditImage:
+    """
+    Encoded input image kept in memory
+    Only the header is parsed up front; pixels are decoded on first use and
+    re-encoded at most once per target size.
+    """
+
+    # Formats every provider accepts directly -> content type
+    PASSTHROUGH_FORMATS = {'PNG': 'image/png', 'JPEG': 'image/jpeg'}
+    PASSTHROUGH_MODES = ('RGB', 'RGBA', 'L')
+
+    def __init__(self, data):
+        self.data = data
+        probe = Image.open(io.BytesIO(data))  # Lazy - reads the header only
+        self.size = probe.size
+        self.format = probe.format
+        self.mode = probe.mode
+        self._decoded = None
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    @property
+    def passthrough(self):
+        return self.format in self.PASSTHROUGH_FORMATS and self.mode in self.PASSTHROUGH_MODES
+
+    def decoded(self):
+        """Full RGB decode (cached)"""
+        with self._lock:
+            if self._decoded is None:
+                self._decoded = Image.open(io.BytesIO(self.data)).convert('RGB')
+            return self._decoded
+
+    def encoded(self, max_size=None):
+        """
+        (bytes, content_type) ready to upload, no larger than max_size x max_size
+        Returns the original bytes untouched whenever possible
+        """
+        fits = max_size is None or max(self.size) <= max_size
+        if self.passthrough and fits:
+            return self.data, self.PASSTHROUGH_FORMATS[self.format]
+
+        key = max_size if not fits else None
+        with self._lock:
+            cached = self._encoded.get(key)
+        if cached is None:
+            img = self.decoded()
+            if not fits:
+                img = img.copy()
+                img.thumbnail((max_size, max_size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            img.save(buffer, format='PNG')
+            cached = (buffer.getvalue(), 'image/png')
+            with self._lock:
+                self._encoded[key] = cached
+        return cached
+
+
+# name: short id, env_key: API key that enables it, edit: fn(image: EditImage, prompt, attempt) -> bytes,
+# params: model parameters sent with every request (also part of the result cache key)
+Provider = namedtuple('Provider', ['name', 'env_key', 'edit', 'max_attempts', 'params'])
+
+FAL_PARAMS = {
+    'model': 'fal-ai/flux-pro/v1.1-ultra',
+    'strength': 0.75,  # How much to change (0-1)
+    'num_images': 1,
+    'enable_safety_checker': True
+}
+HF_PARAMS = {
+    'model': HF_PIX2PIX_URL,
+    'max_size': 512  # Resize image for API (max 512x512 for speed)
+}
+REPLICATE_PARAMS = {
+    'model': REPLICATE_PIX2PIX_MODEL,
+    'num_inference_steps': 50,
+    'image_guidance_scale': 1.5
+}
+
+
+def edit_with_fal(image, prompt, attempt):
+    """Fal.ai FLUX Pro image-to-image"""
+    data, content_type = image.encoded()
+    arguments = {
+        "prompt": prompt,
+        "strength": FAL_PARAMS['strength'],
+        "num_images": FAL_PARAMS['num_images'],
+        "enable_safety_checker": FAL_PARAMS['enable_safety_checker']
+    }
+
+    if FAL_API_BASE:
+        # Synchronous REST endpoint, image inlined as a data URI
+        arguments['image_url'] = f"data:{content_type};base64,{base64.b64encode(data).decode()}"
+        response = requests.post(
+            f"{FAL_API_BASE.rstrip('/')}/{FAL_PARAMS['model']}",
+            headers={"Authorization": f"Key {os.environ.get('FAL_KEY', '')}"},
+            json=arguments,
+            timeout=120
+        )
+        if response.status_code in (429, 503):
+            raise RetryLater(retry_after(response, 10), f'Fal.ai busy ({response.status_code})')
+        if response.status_code != 200:
+            raise ProviderError(f'Fal.ai API error: {response.status_code} - {response.text[:200]}')
+        result = response.json()
+    else:
+        import fal_client
+
+        # Upload straight from memory
+        arguments['image_url'] = fal_client.upload(data, content_type)
+        result = fal_client.subscribe(FAL_PARAMS['model'], arguments=arguments, with_logs=True)
+
+    if not result or not result.get('images'):
+        raise ProviderError('Fal.ai returned no images')
+
+    response = requests.get(result['images'][0]['url'], timeout=60)
+    if response.status_code != 200:
+        raise ProviderError(f'Fal.ai result download failed: {response.status_code}')
+    return response.content
+
+
+def edit_with_huggingface(image, prompt, attempt):
+    """Hugging Face Instruct-Pix2Pix - TRANSFORMS images based on instructions"""
+    # Only decodes/resizes when the image is larger than the model input
+    data, content_type = image.encoded(HF_PARAMS['max_size'])
+
+    headers = {"Authorization": f"Bearer {os.environ.get('HUGGING_FACE_API_KEY', '')}"}
+
+    print(f"📤 Sending to Instruct-Pix2Pix: {prompt} (attempt {attempt + 1})")
+    response = requests.post(
+        HF_PIX2PIX_URL,
+        headers=headers,
+        files={'inputs': ('image', data, content_type)},
+        data={'prompt': prompt},
+        timeout=120
+    )
+
+    if response.status_code == 503:
+        # Model loading - come back later instead of sleeping here
+        raise RetryLater(20 * (attempt + 1), 'Model loading')
+    if response.status_code == 429:
+        raise RetryLater(retry_after(response, 10 * (attempt + 1)), 'Rate limited')
+    if response.status_code != 200:
+        raise ProviderError(f'Pix2Pix API error: {response.status_code} - {response.text[:200]}')
+    return response.content
+
+
+def edit_with_replicate(image, prompt, attempt):
+    """Replicate Instruct-Pix2Pix (free tier)"""
+    import replicate
+
+    # Replicate streams file-like inputs, so an in-memory buffer works like a file
+    data, content_type = image.encoded()
+    output = replicate.run(
+        REPLICATE_PARAMS['model'],
+        input={
+            "image": io.BytesIO(data),
+            "prompt": prompt,
+            "num_inference_steps": REPLICATE_PARAMS['num_inference_steps'],
+            "image_guidance_scale": REPLICATE_PARAMS['image_guidance_scale']
+        }
+    )
+
+    if not output:
+        raise ProviderError('Replicate returned no output')
+
+    result_url = output[0] if isinstance(output, list) else output
+    response = requests.get(result_url, timeout=60)
+    if response.status_code != 200:
+        raise ProviderError(f'Replicate result download failed: {response.status_code}')
+    return response.content
+
+
+# Priority order: Fal.ai (best quality) -> Hugging Face -> Replicate
+PROVIDERS = [
+    Provider('fal', 'FAL_KEY', edit_with_fal, 1, FAL_PARAMS),
+    Provider('huggingface', 'HUGGING_FACE_API_KEY', edit_with_huggingface, 3, HF_PARAMS),
+    Provider('replicate', 'REPLICATE_API_TOKEN', edit_with_replicate, 1, REPLICATE_PARAMS),
+]
+
+
+def configured_providers():
+    """Providers whose API key is present in the environment, in priority order"""
+    return [p for p in PROVIDERS if os.environ.get(p.env_key, '')]
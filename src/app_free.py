@@ -4,8 +4,8 @@ Uses Pollinations.ai - No API keys needed!
 Features: OCR text extraction, live editing, AI generation
 """
 
-from flask import Flask, render_template, request, jsonify, send_file
-from PIL import Image, ImageDraw, ImageFont, ImageColor
+from flask import Flask, render_template, request, jsonify, send_file, Response, g
+from PIL import Image, ImageDraw, ImageColor
 import io
 import base64
 import os
@@ -13,8 +13,27 @@ from datetime import datetime
 import requests
 import json
 import time
+import threading
+from collections import OrderedDict
 import easyocr
-import numpy as np
+
+from rendering import DEFAULT_PRESETS, load_font
+import pipeline
+from storage import FileStorage, content_key
+import batch_jobs
+from ai_providers import configured_providers, EditImage
+from ai_jobs import AIEditQueue, make_cache_key
+from provider_router import ProviderRouter
+import gemini_client
+import palette
+from caption_pool import CaptionPool
+from lazy_ocr import LazyRecognizer
+from admission import AdmissionController
+import single_flight
+import rate_limit
+import cpu_budget
+import metrics
+import profiling
 
 # Get the project root directory (parent of src/)
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -29,194 +48,112 @@ app.config['GENERATED_FOLDER'] = os.path.join(PROJECT_ROOT, 'generated')
 # Create folders if they don't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['GENERATED_FOLDER'], exist_ok=True)
+upload_storage = FileStorage(app.config['UPLOAD_FOLDER'])
+generated_storage = FileStorage(app.config['GENERATED_FOLDER'])
+
+# Per-stage latency histograms and request counters on /metrics
+metrics.instrument_app(app)
+# torch / OpenCV threads per OCR call follow the number of requests in flight
+cpu_budget.budget.track_app(app)
+# Opt-in request profiles (X-Profile admin header or PROFILE_SAMPLE_RATE)
+profiling.register_admin_routes(app)
 
 # Initialize EasyOCR reader (supports English)
 print("🔍 Initializing OCR reader...")
 reader = easyocr.Reader(['en'], gpu=False)
 print("✅ OCR reader ready!")
 
+# OCR results of recent uploads (image_path -> detected texts), reused by
+# other endpoints instead of running OCR again
+OCR_CACHE_SIZE = 256
+ocr_cache = OrderedDict()
+ocr_cache_lock = threading.Lock()
+
+def remember_ocr(image_path, detected_texts):
+    with ocr_cache_lock:
+        ocr_cache[image_path] = detected_texts
+        ocr_cache.move_to_end(image_path)
+        while len(ocr_cache) > OCR_CACHE_SIZE:
+            ocr_cache.popitem(last=False)
+
+def cached_ocr(image_path):
+    with ocr_cache_lock:
+        return ocr_cache.get(os.path.basename(image_path or ''))
+
+# OCR_MODE=lazy (or an 'ocr_mode' upload field): uploads only detect text boxes;
+# /api/recognize reads the boxes the user selects, a background thread the rest
+OCR_MODE = os.environ.get('OCR_MODE', 'full')
+lazy_recognizer = LazyRecognizer(reader, lambda image_path: load_generate_base(image_path)[0], store=upload_storage)
+
 # Using Pollinations.ai - 100% FREE, NO API KEY NEEDED!
 # This service provides free AI image generation via simple HTTP requests
-POLLINATIONS_API = "https://image.pollinations.ai/prompt/"
-POLLINATIONS_TEXT_API = "https://text.pollinations.ai/"
+POLLINATIONS_TEXT_API = os.environ.get('POLLINATIONS_TEXT_API', "https://text.pollinations.ai/")
 
 print("✅ Using Pollinations.ai (100% FREE - No API key needed!)")
 
-def remove_text_from_image(img, text_bboxes):
-    """
-    Remove detected text from image by filling with surrounding colors (inpainting)
-    Returns clean image with text areas filled
-    """
-    try:
-        from PIL import ImageFilter
-        import cv2
-        
-        # Convert PIL to OpenCV format
-        img_cv = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-        
-        # Create mask for text areas
-        mask = np.zeros(img_cv.shape[:2], dtype=np.uint8)
-        
-        for bbox in text_bboxes:
-            # bbox is [[x1,y1], [x2,y2], [x3,y3], [x4,y4]]
-            points = np.array(bbox, dtype=np.int32)
-            
-            # Expand the bbox slightly to ensure all text is covered
-            # Calculate bounding rectangle
-            x_coords = [p[0] for p in points]
-            y_coords = [p[1] for p in points]
-            
-            x_min = max(0, int(min(x_coords)) - 3)
-            y_min = max(0, int(min(y_coords)) - 3)
-            x_max = min(img_cv.shape[1], int(max(x_coords)) + 3)
-            y_max = min(img_cv.shape[0], int(max(y_coords)) + 3)
-            
-            # Fill this area in the mask
-            cv2.rectangle(mask, (x_min, y_min), (x_max, y_max), 255, -1)
-        
-        # Use inpainting to fill the text areas
-        inpainted = cv2.inpaint(img_cv, mask, inpaintRadius=7, flags=cv2.INPAINT_TELEA)
-        
-        # Convert back to PIL
-        clean_img = Image.fromarray(cv2.cvtColor(inpainted, cv2.COLOR_BGR2RGB))
-        
-        print(f"✅ Removed {len(text_bboxes)} text areas from image")
-        return clean_img
-        
-    except Exception as e:
-        print(f"⚠️ Text removal failed: {e}, returning original image")
-        return img
+# AI edits run as background jobs so slow providers never hold a request thread
+# Provider health (latency, errors, circuit breakers) is shared by all jobs
+ai_provider_router = ProviderRouter()
+ai_edit_queue = AIEditQueue(app.config['GENERATED_FOLDER'], ai_provider_router,
+                            max_workers=int(os.environ.get('AI_EDIT_WORKERS', 4)))
+
+# Admission control: CPU-heavy endpoints share ADMISSION_SLOTS slots; upload and
+# generate leave one free so previews (admitted first) stay responsive
+ADMISSION_SLOTS = int(os.environ.get('ADMISSION_SLOTS', max(2, cpu_budget.budget.max_threads)))
+admission_control = AdmissionController(ADMISSION_SLOTS)
+HEAVY_LIMIT = max(1, ADMISSION_SLOTS - 1)
+
+# Identical uploads / previews arriving together (double clicks, several tabs)
+# are computed once; the others wait for that response without taking a slot
+upload_flight = single_flight.group('upload')
+preview_flight = single_flight.group('render_preview')
 
-def extract_text_from_image(img):
+def upload_key():
+    """Content hash of the uploaded file and the OCR mode (None without a file)"""
+    file = request.files.get('image')
+    if file is None or file.filename == '':
+        return None
+    digest = content_key(file.read())
+    file.seek(0)
+    return f"{digest}:{request.form.get('ocr_mode', '')}"
+
+def preview_key():
+    """Hash of the preview payload, independent of JSON key order"""
+    data = request.get_json(silent=True)
+    if data is None:
+        return None
+    return content_key(json.dumps(data, sort_keys=True).encode())
+
+def extract_text_from_image(img, time_budget=None):
     """
     Extract text from image using EasyOCR
-    Returns text elements with position, content, and estimated styling
+    Returns (text elements with position, content and estimated styling, clean image)
     """
-    try:
-        print("🔍 Running OCR on image...")
-        
-        # Convert PIL Image to numpy array for EasyOCR
-        img_array = np.array(img)
-        
-        # Perform OCR with timeout protection
-        import signal
-        
-        def timeout_handler(signum, frame):
-            raise TimeoutError("OCR timeout")
-        
-        # Set timeout (only on Unix-like systems, skip on Windows)
-        results = None
-        try:
-            # Perform OCR - returns list of (bbox, text, confidence)
-            results = reader.readtext(img_array, paragraph=False)
-            print(f"� OCR found {len(results)} text elements")
-        except Exception as ocr_error:
-            print(f"⚠️ OCR processing error: {ocr_error}")
-            results = []
-        
-        if not results or len(results) == 0:
-            # No text detected, return ONE editable placeholder
-            print("ℹ️ No text detected - returning editable placeholder")
-            width, height = img.size
-            return [{
-                'id': 1,
-                'text': 'Click to Add Text',
-                'position': {'x': int(width * 0.5), 'y': int(height * 0.5)},
-                'font': 'Arial',
-                'size': 60,
-                'color': '#ffffff',
-                'weight': 'bold',
-                'isPlaceholder': True  # Mark as placeholder
-            }], img  # Return tuple with original image
-        
-        # Process OCR results
-        detected_texts = []
-        img_width, img_height = img.size
-        
-        for idx, (bbox, text, confidence) in enumerate(results):
-            # Skip if confidence is too low
-            if confidence < 0.2:  # Lowered threshold for better detection
-                print(f"⏭️ Skipping low confidence text: '{text}' ({confidence:.2f})")
-                continue
-                
-            # bbox is [[x1,y1], [x2,y2], [x3,y3], [x4,y4]]
-            # Get bounding box coordinates
-            x_coords = [point[0] for point in bbox]
-            y_coords = [point[1] for point in bbox]
-            
-            x = int(min(x_coords))
-            y = int(min(y_coords))
-            width = int(max(x_coords) - min(x_coords))
-            height = int(max(y_coords) - min(y_coords))
-            
-            # Estimate font size based on height
-            font_size = max(20, min(72, int(height * 0.9)))
-            
-            detected_texts.append({
-                'id': idx + 1,
-                'text': text.strip(),
-                'position': {'x': x, 'y': y + height},  # y + height for baseline position
-                'font': 'Arial',
-                'size': font_size,
-                'color': '#ffffff',  # Default white, user can change
-                'weight': 'bold' if font_size > 40 else 'normal',
-                'confidence': round(confidence, 2),
-                'bbox': {'x': x, 'y': y, 'width': width, 'height': height}
-            })
-            
-            print(f"✅ Detected: '{text}' at ({x},{y}) size:{font_size}px conf:{confidence:.2f}")
-        
-        # If text was detected, remove text from background to avoid double text
-        if len(detected_texts) > 0:
-            print(f"✅ Returning {len(detected_texts)} detected text elements")
-            
-            # Extract bounding boxes for text removal
-            text_bboxes = [result[0] for result in results if result[2] >= 0.2]
-            
-            # Remove text from image using inpainting (preserves background, removes only text)
-            clean_img = remove_text_from_image(img, text_bboxes)
-            
-            return detected_texts, clean_img
-        
-        # If no text passed confidence check, return ONE placeholder with original image
-        print("ℹ️ No high-confidence text - returning editable placeholder")
-        return [{
-            'id': 1,
-            'text': 'Click to Add Text',
-            'position': {'x': int(img_width * 0.5), 'y': int(img_height * 0.5)},
-            'font': 'Arial',
-            'size': 60,
-            'color': '#ffffff',
-            'weight': 'bold',
-            'isPlaceholder': True
-        }], img  # Return original image unchanged
-        
-    except Exception as e:
-        print(f"❌ OCR Error: {e}")
-        import traceback
-        traceback.print_exc()
-        
-        # Return ONE editable placeholder on error with original image
-        width, height = img.size if img else (800, 600)
-        return [{
-            'id': 1,
-            'text': 'Click to Add Text',
-            'position': {'x': int(width * 0.5), 'y': int(height * 0.5)},
-            'font': 'Arial',
-            'size': 60,
-            'color': '#ffffff',
-            'weight': 'bold',
-            'isPlaceholder': True
-        }], img if img else None
+    return pipeline.extract_text(reader, img, time_budget)
 
-def generate_meme_captions(image_description="random photo"):
+# Static captions used when neither the API nor the caption pool has any
+FALLBACK_MEME_CAPTIONS = [
+    "When you see it...",
+    "Me trying to adult",
+    "Nobody:\nAbsolutely nobody:\nMe:",
+    "It really do be like that sometimes",
+    "This is fine 🔥"
+]
+DEFAULT_MEME_TOPIC = "a funny situation"
+
+def fetch_meme_captions(image_description="random photo", count=5, max_wait=rate_limit.RATE_LIMIT_MAX_WAIT):
     """
-    Generate funny meme captions using AI based on image context
-    Returns list of 5 meme caption suggestions
+    Ask the Pollinations text API for meme captions about a scenario
+    Returns the captions it produced ([] if the call failed or the rate
+    limit would make it wait longer than max_wait)
     """
+    bucket = rate_limit.bucket('pollinations_text')
+    if not bucket.acquire(max_wait):
+        print("⏳ Meme caption API rate limit reached")
+        return []
     try:
         # Create prompt for AI to generate meme captions
-        prompt = f"""You are a meme expert. Generate 5 funny, relatable meme captions for this scenario: {image_description}
+        prompt = f"""You are a meme expert. Generate {count} funny, relatable meme captions for this scenario: {image_description}
 
 Rules:
 - Keep each caption under 15 words
@@ -233,48 +170,52 @@ That face you make when
 POV: You just realized"""
 
         # Call Pollinations text API
-        response = requests.post(
-            POLLINATIONS_TEXT_API,
-            json={
-                "messages": [{"role": "user", "content": prompt}],
-                "model": "openai"
-            },
-            headers={"Content-Type": "application/json"},
-            timeout=10
-        )
+        with metrics.upstream('pollinations_text') as call:
+            response = requests.post(
+                POLLINATIONS_TEXT_API,
+                json={
+                    "messages": [{"role": "user", "content": prompt}],
+                    "model": "openai"
+                },
+                headers={"Content-Type": "application/json"},
+                timeout=10
+            )
+            if response.status_code != 200:
+                call.outcome = 'error'
+        pipeline.throttled(bucket, response.status_code, response.headers)
         
         if response.status_code == 200:
             result = response.text.strip()
             # Split by newlines and clean up
             captions = [line.strip() for line in result.split('\n') if line.strip()]
-            # Take first 5 non-empty captions
-            captions = [c for c in captions if len(c) > 3][:5]
-            
-            # If we got captions, return them
-            if len(captions) >= 3:
-                print(f"✅ Generated {len(captions)} meme captions")
-                return captions
-        
-        # Fallback captions if API fails
-        print("⚠️ Using fallback meme captions")
-        return [
-            "When you see it...",
-            "Me trying to adult",
-            "Nobody:\nAbsolutely nobody:\nMe:",
-            "It really do be like that sometimes",
-            "This is fine 🔥"
-        ]
+            return [c for c in captions if len(c) > 3][:count]
+        
+        print(f"⚠️ Meme caption API returned {response.status_code}")
+        return []
         
     except Exception as e:
         print(f"❌ Meme caption generation error: {e}")
-        # Return fun fallback captions
-        return [
-            "That face you make when...",
-            "Me: *exists*\nEveryone:",
-            "POV: You just realized",
-            "When the teacher says 'Get into groups'",
-            "Expectation vs Reality"
-        ]
+        return []
+
+def generate_meme_captions(image_description="random photo"):
+    """
+    Generate funny meme captions using AI based on image context
+    Returns list of 5 meme caption suggestions
+    """
+    captions = fetch_meme_captions(image_description)
+    
+    # If we got captions, return them
+    if len(captions) >= 3:
+        print(f"✅ Generated {len(captions)} meme captions")
+        return captions
+    
+    # Fallback captions if API fails
+    print("⚠️ Using fallback meme captions")
+    return FALLBACK_MEME_CAPTIONS
+
+# Captions are pre-generated per topic in the background; requests just sample
+# (refills are not interactive, so they may wait longer for the rate limit)
+caption_pool = CaptionPool(lambda topic: fetch_meme_captions(topic, count=10, max_wait=60), DEFAULT_MEME_TOPIC)
 
 @app.route('/')
 def index():
@@ -289,6 +230,9 @@ def docs_editor():
     return render_template('docs.html')
 
 @app.route('/api/upload', methods=['POST'])
+@single_flight.coalesced(upload_flight, upload_key)
+@admission_control.limit('upload', limit=HEAVY_LIMIT, queue_size=2 * ADMISSION_SLOTS)
+@profiling.profiled
 def upload_image():
     """Upload and process image - extract text using simple pattern detection"""
     if 'image' not in request.files:
@@ -300,34 +244,52 @@ def upload_image():
     
     try:
         # Read and process image
-        img = Image.open(file.stream)
+        data = file.read()
+        img = Image.open(io.BytesIO(data))
+        with metrics.stage('decode'):
+            img.load()
         
         # Convert to RGB if needed
         if img.mode != 'RGB':
-            img = img.convert('RGB')
+            with metrics.stage('rgb_convert'):
+                img = img.convert('RGB')
         
-        # Save uploaded image
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        # Save uploaded image (the content hash keeps uploads in the same second apart)
+        timestamp = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{content_key(data)[:12]}"
         filename = f'upload_{timestamp}.png'
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        img.save(filepath)
-        
-        # Extract text from image (returns texts and clean image)
-        detected_texts, clean_img = extract_text_from_image(img)
+        upload_storage.save_image(img, filename)
+        
+        ocr_mode = request.form.get('ocr_mode') or OCR_MODE
+        if ocr_mode == 'lazy':
+            # Text boxes only (positions, sizes, colors); their text is read on demand
+            detected_texts, clean_img, detection = pipeline.detect_text(reader, img)
+            ocr_report = {'partial': False}
+            cached_texts = detected_texts
+            if detection is not None:
+                cached_texts = lazy_recognizer.start(filename, detection, detected_texts)
+        else:
+            # Extract text from image (returns texts and clean image); with an OCR
+            # time budget, within what is left of it, the largest text boxes first
+            detected_texts, clean_img, ocr_report = pipeline.run_ocr(
+                reader, img, pipeline.ocr_budget_left(g.get('metrics_started')))
+            cached_texts = detected_texts
+        remember_ocr(filename, cached_texts)
         
         # Save the clean image (with text removed) for canvas display
         clean_filename = f'clean_{timestamp}.png'
-        clean_filepath = os.path.join(app.config['UPLOAD_FOLDER'], clean_filename)
         if clean_img:
-            clean_img.save(clean_filepath)
+            upload_storage.save_image(clean_img, clean_filename)
+            remember_ocr(clean_filename, cached_texts)
         else:
             clean_img = img  # Fallback to original if cleaning failed
             clean_filename = filename
         
         # Convert CLEAN image to base64 for canvas display
         buffered = io.BytesIO()
-        clean_img.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+        with metrics.stage('png_encode'):
+            clean_img.save(buffered, format="PNG")
+        with metrics.stage('base64_encode'):
+            img_str = base64.b64encode(buffered.getvalue()).decode()
         
         return jsonify({
             'success': True,
@@ -335,6 +297,9 @@ def upload_image():
             'clean_image_path': clean_filename,  # Clean without text
             'image_data': f'data:image/png;base64,{img_str}',  # Clean image for canvas
             'detected_texts': detected_texts,
+            'ocr_partial': ocr_report['partial'],  # OCR budget ran out before every box was read
+            'ocr_mode': ocr_mode,
+            'ocr_pending': [t['id'] for t in detected_texts if t.get('pending')],  # lazy: see /api/recognize
             'width': clean_img.width,
             'height': clean_img.height
         })
@@ -342,7 +307,33 @@ def upload_image():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/recognize', methods=['POST'])
+@admission_control.limit('recognize', limit=HEAVY_LIMIT, queue_size=4 * ADMISSION_SLOTS, priority=0, max_wait=3)
+@profiling.profiled
+def recognize_text():
+    """Read the text of detected boxes after a lazy OCR upload (box_ids), or report progress (none)"""
+    data = request.get_json(silent=True) or {}
+    image_path = os.path.basename(data.get('image_path', ''))
+    if not image_path:
+        return jsonify({'error': 'No image uploaded'}), 400
+    try:
+        box_ids = [int(box_id) for box_id in data.get('box_ids') or []]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'box_ids must be a list of text ids'}), 400
+    
+    try:
+        result = lazy_recognizer.recognize(image_path, box_ids)
+        if result is None:
+            return jsonify({'error': 'Image not found or has no text'}), 404
+        return jsonify({'success': True, 'texts': result['texts'], 'pending': result['pending']})
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/render-preview', methods=['POST'])
+@single_flight.coalesced(preview_flight, preview_key)
+@admission_control.limit('render_preview', limit=ADMISSION_SLOTS, queue_size=4 * ADMISSION_SLOTS, priority=0, max_wait=3)
+@profiling.profiled
 def render_preview():
     """Render text on image for live preview"""
     data = request.json
@@ -352,38 +343,40 @@ def render_preview():
     try:
         # Load original image
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], image_path)
-        img = Image.open(filepath).convert('RGBA')
+        img = Image.open(filepath)
+        with metrics.stage('decode'):
+            img.load()
+        with metrics.stage('rgb_convert'):
+            img = img.convert('RGBA')
         
         # Create a transparent overlay for text
         txt_layer = Image.new('RGBA', img.size, (255, 255, 255, 0))
         draw = ImageDraw.Draw(txt_layer)
         
         # Draw each text element
-        for text_elem in texts:
-            text = text_elem.get('text', '')
-            x = text_elem.get('position', {}).get('x', 0)
-            y = text_elem.get('position', {}).get('y', 0)
-            size = text_elem.get('size', 32)
-            color = text_elem.get('color', '#ffffff')
-            
-            try:
-                # Try to use system font
-                font = ImageFont.truetype("arial.ttf", size)
-            except:
-                # Fallback to default font
-                font = ImageFont.load_default()
+        with metrics.stage('text_render'):
+            for text_elem in texts:
+                text = text_elem.get('text', '')
+                x = text_elem.get('position', {}).get('x', 0)
+                y = text_elem.get('position', {}).get('y', 0)
+                size = text_elem.get('size', 32)
+                color = text_elem.get('color', '#ffffff')
+                
+                font = load_font(size)
+                
+                # Draw text
+                draw.text((x, y), text, font=font, fill=color)
             
-            # Draw text
-            draw.text((x, y), text, font=font, fill=color)
-        
-        # Composite text over image
-        img = Image.alpha_composite(img, txt_layer)
-        img = img.convert('RGB')
+            # Composite text over image
+            img = Image.alpha_composite(img, txt_layer)
+            img = img.convert('RGB')
         
         # Convert to base64
         buffered = io.BytesIO()
-        img.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+        with metrics.stage('png_encode'):
+            img.save(buffered, format="PNG")
+        with metrics.stage('base64_encode'):
+            img_str = base64.b64encode(buffered.getvalue()).decode()
         
         return jsonify({
             'success': True,
@@ -393,30 +386,58 @@ def render_preview():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def meme_captions_response(data, remote_addr=None):
+    """Response body of /api/generate-memes (shared with the ASGI app)"""
+    image_path = data.get('image_path', '')
+    
+    # Topic: explicit, else the text found in the uploaded image
+    topic = data.get('topic', '')
+    if not topic:
+        texts = cached_ocr(image_path) or []
+        topic = ' '.join(t['text'] for t in texts if t.get('text') and not t.get('isPlaceholder'))
+    topic = topic or DEFAULT_MEME_TOPIC
+    
+    session_id = data.get('session_id') or remote_addr or 'anonymous'
+    
+    # Sample 5 captions from the pre-generated pool (no upstream call here)
+    captions, source = caption_pool.sample(topic, session_id, 5)
+    if not captions:
+        captions = FALLBACK_MEME_CAPTIONS
+        source = 'fallback'
+    
+    return {
+        'success': True,
+        'captions': captions,
+        'source': source
+    }
+
 @app.route('/api/generate-memes', methods=['POST'])
 def generate_memes():
     """Generate meme caption suggestions based on uploaded image"""
     try:
-        data = request.json
-        image_path = data.get('image_path', '')
-        
-        # For now, use generic description
-        # In future, can add image recognition to detect content
-        description = "a funny situation"
-        
-        # Generate 5 meme captions
-        captions = generate_meme_captions(description)
-        
-        return jsonify({
-            'success': True,
-            'captions': captions
-        })
+        return jsonify(meme_captions_response(request.json or {}, request.remote_addr))
         
     except Exception as e:
         print(f"❌ Meme generation error: {e}")
         return jsonify({'error': str(e)}), 500
 
+def load_generate_base(image_path):
+    """Uploaded image to render variations from: (RGB image, None) or (None, error)"""
+    if not image_path:
+        return None, 'No image uploaded'
+    
+    # Load original image
+    if not upload_storage.exists(image_path):
+        return None, 'Original image not found'
+        
+    base_img = upload_storage.load_image(image_path)
+    if base_img.mode != 'RGB':
+        base_img = base_img.convert('RGB')
+    return base_img, None
+
 @app.route('/api/generate', methods=['POST'])
+@admission_control.limit('generate', limit=HEAVY_LIMIT, queue_size=2 * ADMISSION_SLOTS)
+@profiling.profiled
 def generate_variations():
     """Generate variations with background changes OR effects based on user prompt"""
     data = request.json
@@ -425,199 +446,17 @@ def generate_variations():
     style_prompt = data.get('style_prompt', '').strip()  # User's background prompt
     
     try:
-        if not image_path:
-            return jsonify({'error': 'No image uploaded'}), 400
-        
-        # Load original image
-        original_path = os.path.join(app.config['UPLOAD_FOLDER'], image_path)
-        if not os.path.exists(original_path):
-            return jsonify({'error': 'Original image not found'}), 400
-            
-        base_img = Image.open(original_path)
-        if base_img.mode != 'RGB':
-            base_img = base_img.convert('RGB')
+        base_img, error = load_generate_base(image_path)
+        if error:
+            return jsonify({'error': error}), 400
         
-        variations = []
-        
-        # Check if user wants AI background replacement or just effects
-        use_ai_background = bool(style_prompt and len(style_prompt) > 3)
-        
-        if use_ai_background:
+        if style_prompt and len(style_prompt) > 3:
             print(f"🎨 Creating 3 AI variations with background: '{style_prompt}'...")
-            
-            # AI-powered background replacement using Pollinations.ai with image reference
-            # We'll create variations by combining the prompt with the image
-            effects = [
-                {
-                    'name': f'{style_prompt} - Modern',
-                    'description': f'Modern professional style with {style_prompt} background',
-                    'prompt_suffix': ', modern professional design, high quality, 4k, detailed'
-                },
-                {
-                    'name': f'{style_prompt} - Vibrant', 
-                    'description': f'Vibrant colorful style with {style_prompt} background',
-                    'prompt_suffix': ', vibrant colorful artistic design, beautiful, high quality'
-                },
-                {
-                    'name': f'{style_prompt} - Minimalist',
-                    'description': f'Minimalist clean style with {style_prompt} background',
-                    'prompt_suffix': ', minimalist clean elegant design, simple, high quality'
-                }
-            ]
         else:
             print(f"🎨 Creating 3 effect variations of {image_path} with {len(texts)} text elements...")
-            
-            # Standard image effects (no AI, just filters)
-            effects = [
-                {
-                    'name': 'Enhanced Colors',
-                    'description': 'Vibrant colors with enhanced contrast',
-                    'prompt_suffix': None
-                },
-                {
-                    'name': 'Artistic Filter', 
-                    'description': 'Stylized artistic look with softer tones',
-                    'prompt_suffix': None
-                },
-                {
-                    'name': 'Professional',
-                    'description': 'Clean professional look with subtle adjustments',
-                    'prompt_suffix': None
-                }
-            ]
-        
-        for i, effect in enumerate(effects):
-            try:
-                print(f"🎨 Creating variation {i+1}: {effect['name']}...")
-                
-                if use_ai_background and effect['prompt_suffix']:
-                    # AI-POWERED BACKGROUND REPLACEMENT
-                    # Use Pollinations.ai to generate new background based on prompt
-                    import urllib.parse
-                    
-                    # Build comprehensive prompt
-                    text_content = ', '.join([t['text'] for t in texts if t.get('text')]) if texts else ''
-                    full_prompt = style_prompt + effect['prompt_suffix']
-                    if text_content:
-                        full_prompt += f", with text overlay: {text_content}"
-                    
-                    encoded_prompt = urllib.parse.quote(full_prompt)
-                    api_url = f"{POLLINATIONS_API}{encoded_prompt}?width=1024&height=1024&model=flux&nologo=true&enhance=true"
-                    
-                    print(f"   🌐 AI Request: {full_prompt[:80]}...")
-                    response = requests.get(api_url, timeout=120)
-                    
-                    if response.status_code == 200 and response.headers.get('content-type', '').startswith('image'):
-                        # Load AI-generated background
-                        ai_img = Image.open(io.BytesIO(response.content))
-                        if ai_img.mode != 'RGB':
-                            ai_img = ai_img.convert('RGB')
-                        
-                        # Resize to match original if needed
-                        ai_img = ai_img.resize(base_img.size, Image.Resampling.LANCZOS)
-                        variation_img = ai_img
-                        
-                        print(f"   ✅ AI background generated successfully")
-                    else:
-                        print(f"   ⚠️ AI failed, using effect fallback")
-                        # Fallback to effect-based variation
-                        variation_img = base_img.copy()
-                        from PIL import ImageEnhance
-                        enhancer = ImageEnhance.Color(variation_img)
-                        variation_img = enhancer.enhance(1.3)
-                else:
-                    # STANDARD IMAGE EFFECTS (No AI)
-                    variation_img = base_img.copy()
-                    
-                    # Apply different effects based on variation type
-                    if i == 0:
-                        # Variation 1: Enhanced Colors
-                        from PIL import ImageEnhance
-                        enhancer = ImageEnhance.Color(variation_img)
-                        variation_img = enhancer.enhance(1.3)
-                        enhancer = ImageEnhance.Contrast(variation_img)
-                        variation_img = enhancer.enhance(1.2)
-                        enhancer = ImageEnhance.Brightness(variation_img)
-                        variation_img = enhancer.enhance(1.1)
-                        
-                    elif i == 1:
-                        # Variation 2: Artistic Filter
-                        from PIL import ImageEnhance, ImageFilter
-                        variation_img = variation_img.filter(ImageFilter.SMOOTH)
-                        enhancer = ImageEnhance.Color(variation_img)
-                        variation_img = enhancer.enhance(1.4)
-                        enhancer = ImageEnhance.Sharpness(variation_img)
-                        variation_img = enhancer.enhance(0.8)
-                        
-                    elif i == 2:
-                        # Variation 3: Professional
-                        from PIL import ImageEnhance, ImageFilter
-                        variation_img = variation_img.filter(ImageFilter.SHARPEN)
-                        enhancer = ImageEnhance.Contrast(variation_img)
-                        variation_img = enhancer.enhance(1.15)
-                        enhancer = ImageEnhance.Brightness(variation_img)
-                        variation_img = enhancer.enhance(1.05)
-                
-                # Now render the edited text on top of the styled image
-                draw = ImageDraw.Draw(variation_img)
-                
-                for text_elem in texts:
-                    text = text_elem.get('text', '')
-                    x = int(text_elem.get('position', {}).get('x', 50))
-                    y = int(text_elem.get('position', {}).get('y', 50))
-                    color = text_elem.get('color', '#ffffff')
-                    size = int(text_elem.get('size', 48))
-                    weight = text_elem.get('weight', 'bold')
-                    
-                    # Convert hex color to RGB
-                    try:
-                        color_rgb = ImageColor.getrgb(color)
-                    except:
-                        color_rgb = (255, 255, 255)
-                    
-                    # Load font
-                    try:
-                        font = ImageFont.truetype("arial.ttf", size)
-                    except:
-                        font = ImageFont.load_default()
-                    
-                    # Draw text with outline for better visibility
-                    # Draw outline (black stroke)
-                    outline_range = 2
-                    for adj_x in range(-outline_range, outline_range + 1):
-                        for adj_y in range(-outline_range, outline_range + 1):
-                            draw.text((x + adj_x, y + adj_y), text, font=font, fill=(0, 0, 0))
-                    
-                    # Draw main text
-                    draw.text((x, y), text, font=font, fill=color_rgb)
-                
-                # Save the variation
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                filename = f'variation_{timestamp}_{i+1}.png'
-                filepath = os.path.join(app.config['GENERATED_FOLDER'], filename)
-                variation_img.save(filepath)
-                
-                # Convert to base64
-                buffered = io.BytesIO()
-                variation_img.save(buffered, format="PNG")
-                img_str = base64.b64encode(buffered.getvalue()).decode()
-                
-                variations.append({
-                    'id': i + 1,
-                    'image_data': f'data:image/png;base64,{img_str}',
-                    'description': effect['description'],
-                    'effect': effect['name'],
-                    'filename': filename
-                })
-                print(f"✅ Variation {i+1} '{effect['name']}' created!")
-                
-            except Exception as e:
-                variations.append({
-                    'id': i + 1,
-                    'error': f'Error: {str(e)}',
-                    'effect': effect['name']
-                })
-                print(f"❌ Error creating variation {i+1}: {e}")
+        
+        # Same pipeline as the serverless version; results saved to generated/
+        variations = pipeline.generate_variations(base_img, texts, style_prompt, storage=generated_storage)
         
         return jsonify({
             'success': True,
@@ -647,219 +486,236 @@ def download_file(filename):
         return jsonify({'error': str(e)}), 500
 
 
+# ============================================================
+# BATCH JOBS - many images x many presets per submission
+# ============================================================
+
+@app.route('/api/batch', methods=['POST'])
+def create_batch():
+    """
+    Submit a batch job: every image is rendered with every preset
+    Images are referenced by uploaded image_path or sent inline as image_data
+    """
+    data = request.json or {}
+    image_refs = data.get('images', [])
+    presets = data.get('presets') or DEFAULT_PRESETS
+    default_texts = data.get('texts', [])
+    
+    try:
+        if not image_refs:
+            return jsonify({'error': 'No images provided'}), 400
+        
+        images = []
+        for idx, ref in enumerate(image_refs):
+            if isinstance(ref, str):
+                ref = {'image_path': ref}
+            
+            if ref.get('image_path'):
+                name = os.path.basename(ref['image_path'])
+                path = os.path.join(app.config['UPLOAD_FOLDER'], name)
+                if not os.path.exists(path):
+                    return jsonify({'error': f'Image not found: {name}'}), 400
+            elif ref.get('image_data'):
+                # Inline images are written once so workers read them from disk;
+                # named by content, so concurrent batches never overwrite each other
+                image_data = ref['image_data']
+                image_data = image_data.split(',')[1] if ',' in image_data else image_data
+                image_bytes = base64.b64decode(image_data)
+                name = f'batch_{content_key(image_bytes)[:12]}.png'
+                path = os.path.join(app.config['UPLOAD_FOLDER'], name)
+                if not os.path.exists(path):
+                    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+                    with open(tmp_path, 'wb') as f:
+                        f.write(image_bytes)
+                    os.replace(tmp_path, path)
+            else:
+                return jsonify({'error': f'Image {idx + 1} needs image_path or image_data'}), 400
+            
+            images.append({'path': path, 'name': name, 'texts': ref.get('texts')})
+        
+        job = batch_jobs.submit_batch(images, presets, default_texts, app.config['GENERATED_FOLDER'])
+        return jsonify(dict(job.to_dict(), success=True)), 202
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"❌ Batch submit error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/batch/<job_id>')
+def batch_status(job_id):
+    """Progress of a batch job, with the per-item manifest"""
+    job = batch_jobs.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Batch job not found'}), 404
+    
+    return jsonify(dict(job.to_dict(), success=True, items=job.manifest()))
+
+@app.route('/api/batch/<job_id>/download')
+def batch_download(job_id):
+    """Download the ZIP archive (images + manifest.json) of a finished batch"""
+    job = batch_jobs.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Batch job not found'}), 404
+    if not job.archive_path:
+        return jsonify({'error': 'Batch job not finished yet', 'status': job.status}), 409
+    
+    return send_file(job.archive_path, as_attachment=True, download_name=f'batch_{job_id}.zip')
+
+
 # ============================================================
 # AI FEATURES - Fal.ai Image Editing & Gemini Description
 # ============================================================
 
+def submit_ai_edit(data):
+    """
+    Validate an AI edit request and queue its job (shared with the ASGI app)
+    Returns (response body, status); the providers are called by the job queue
+    """
+    image_data = data.get('image')  # Base64 image
+    prompt = data.get('prompt', '')
+    
+    if not image_data:
+        return {'error': 'Image required'}, 400
+    if not prompt:
+        return {'error': 'Prompt required'}, 400
+    
+    providers = configured_providers()
+    if not providers:
+        # No API keys available
+        return {
+            'error': 'No AI editing service available. Please add one of: FAL_KEY, HUGGING_FACE_API_KEY, or REPLICATE_API_TOKEN to your .env file',
+            'help': 'Get free API keys at: fal.ai, huggingface.co, or replicate.com'
+        }, 400
+    
+    print(f"✨ AI Edit with prompt: {prompt}")
+    
+    # Decode base64
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    
+    # Keep the encoded bytes - providers get them as-is, no temp files
+    image_bytes = base64.b64decode(image_data)
+    source = EditImage(image_bytes)
+    
+    # Identical (image, prompt) edits share one upstream call and its cached result
+    cache_key = None if data.get('no_cache') else make_cache_key(image_bytes, prompt, providers)
+    job, how = ai_edit_queue.submit(source, prompt, providers, cache_key)
+    
+    return dict(job.to_dict(),
+                success=True,
+                cached=how == 'cached',
+                coalesced=how == 'coalesced',
+                status_url=f'/api/ai-edit/{job.id}',
+                events_url=f'/api/ai-edit/{job.id}/events'), 200 if job.done else 202
+
 @app.route('/api/ai-edit', methods=['POST'])
+@profiling.profiled
 def ai_edit_image():
     """
-    AI Image Editing using Fal.ai (ChatGPT-like image editing)
-    Transforms image based on text prompt - FREE tier available
+    AI Image Editing using Fal.ai, Hugging Face or Replicate (ChatGPT-like image editing)
+    Queues a background job and returns its id right away - poll
+    /api/ai-edit/<job_id> (or stream /api/ai-edit/<job_id>/events) for the result
     """
     try:
-        data = request.json
-        image_data = data.get('image')  # Base64 image
-        prompt = data.get('prompt', '')
+        payload, status = submit_ai_edit(request.json)
+        return jsonify(payload), status
         
-        if not image_data:
-            return jsonify({'error': 'Image required'}), 400
-        if not prompt:
-            return jsonify({'error': 'Prompt required'}), 400
-        
-        print(f"✨ AI Edit with prompt: {prompt}")
-        
-        # Decode base64
+    except Exception as e:
+        print(f"❌ AI Edit error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/ai-edit/providers')
+def ai_edit_providers():
+    """Rolling health of each AI editing provider (latency, error rate, circuit state)"""
+    configured = [p.name for p in configured_providers()]
+    return jsonify({
+        'success': True,
+        'configured': configured,
+        'order': [p.name for p in ai_provider_router.order(configured_providers())],
+        'providers': ai_provider_router.snapshot()
+    })
+
+@app.route('/api/ai-edit/<job_id>')
+def ai_edit_status(job_id):
+    """Status (and result once completed) of an AI edit job"""
+    job = ai_edit_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'AI edit job not found'}), 404
+    
+    return jsonify(dict(job.to_dict(), success=job.status != 'failed'))
+
+@app.route('/api/ai-edit/<job_id>/events')
+def ai_edit_events(job_id):
+    """Server-Sent Events stream of AI edit job updates (ends when the job finishes)"""
+    job = ai_edit_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'AI edit job not found'}), 404
+    
+    def stream():
+        version = None
+        while True:
+            if version is not None:
+                version = job.wait_for_change(version, timeout=15)
+            else:
+                version = job.version
+            yield f"data: {json.dumps(job.to_dict())}\n\n"
+            if job.done:
+                break
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def describe_fallback(image_data, data):
+    """
+    Basic description without Gemini: size, dominant colors and known text
+    Returns (response body, status); CPU only (shared with the ASGI app)
+    """
+    try:
         if ',' in image_data:
             image_data = image_data.split(',')[1]
         
+        # Use basic OCR-based description as fallback
         image_bytes = base64.b64decode(image_data)
-        img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-        original_size = img.size
-        
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        img = Image.open(io.BytesIO(image_bytes))
         
-        # Check for Fal.ai API key
-        FAL_KEY = os.environ.get('FAL_KEY', '')
+        # Get basic info
+        width, height = img.size
+        mode = img.mode
         
-        if FAL_KEY:
-            try:
-                import fal_client
-                
-                # Save temp image for Fal.ai
-                temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f'temp_fal_{timestamp}.png')
-                img.save(temp_path)
-                
-                # Upload image to Fal.ai
-                with open(temp_path, 'rb') as f:
-                    image_url = fal_client.upload(f, "image/png")
-                
-                # Use FLUX Pro image-to-image model
-                result = fal_client.subscribe(
-                    "fal-ai/flux-pro/v1.1-ultra",
-                    arguments={
-                        "prompt": prompt,
-                        "image_url": image_url,
-                        "strength": 0.75,  # How much to change (0-1)
-                        "num_images": 1,
-                        "enable_safety_checker": True
-                    },
-                    with_logs=True
-                )
-                
-                # Download result image
-                if result and result.get('images'):
-                    result_url = result['images'][0]['url']
-                    response = requests.get(result_url, timeout=60)
-                    
-                    if response.status_code == 200:
-                        result_filename = f'ai_edited_{timestamp}.png'
-                        result_path = os.path.join(app.config['GENERATED_FOLDER'], result_filename)
-                        
-                        result_img = Image.open(io.BytesIO(response.content))
-                        result_img = result_img.resize(original_size, Image.LANCZOS)
-                        result_img.save(result_path)
-                        
-                        # Cleanup temp
-                        os.remove(temp_path)
-                        
-                        print(f"✅ AI Edit complete: {result_filename}")
-                        return jsonify({
-                            'success': True,
-                            'image_url': f'/api/download/{result_filename}',
-                            'filename': result_filename
-                        })
-                
-                os.remove(temp_path)
-                
-            except Exception as e:
-                print(f"⚠️ Fal.ai error: {e}")
-                # Continue to fallback
-        
-        # Fallback: Use Hugging Face Instruct-Pix2Pix (FREE - actually transforms the image!)
-        print("⚠️ Fal.ai not available, using Hugging Face Instruct-Pix2Pix...")
-        
-        HF_API_KEY = os.environ.get('HUGGING_FACE_API_KEY', '')
-        
-        if HF_API_KEY:
-            try:
-                # Resize image for API (max 512x512 for speed)
-                max_size = 512
-                img_resized = img.copy()
-                img_resized.thumbnail((max_size, max_size), Image.LANCZOS)
-                
-                # Convert to bytes
-                img_buffer = io.BytesIO()
-                img_resized.save(img_buffer, format='PNG')
-                img_buffer.seek(0)
-                
-                # Use Instruct-Pix2Pix - this model TRANSFORMS images based on instructions!
-                HF_PIX2PIX_URL = "https://api-inference.huggingface.co/models/timbrooks/instruct-pix2pix"
-                
-                headers = {"Authorization": f"Bearer {HF_API_KEY}"}
-                
-                # Send image + prompt to model
-                files = {'inputs': img_buffer}
-                params = {'parameters': {'prompt': prompt}}
-                
-                print(f"📤 Sending to Instruct-Pix2Pix: {prompt}")
-                
-                # Retry logic for model loading
-                max_retries = 3
-                for attempt in range(max_retries):
-                    response = requests.post(
-                        HF_PIX2PIX_URL,
-                        headers=headers,
-                        files={'inputs': ('image.png', img_buffer.getvalue(), 'image/png')},
-                        data={'prompt': prompt},
-                        timeout=120
-                    )
-                    
-                    if response.status_code == 503:
-                        wait_time = 20 * (attempt + 1)
-                        print(f"⏳ Model loading, waiting {wait_time}s... (attempt {attempt + 1}/{max_retries})")
-                        time.sleep(wait_time)
-                        continue
-                    break
-                
-                if response.status_code == 200:
-                    result_filename = f'ai_edited_{timestamp}.png'
-                    result_path = os.path.join(app.config['GENERATED_FOLDER'], result_filename)
-                    
-                    result_img = Image.open(io.BytesIO(response.content))
-                    result_img = result_img.resize(original_size, Image.LANCZOS)
-                    result_img.save(result_path)
-                    
-                    print(f"✅ AI Edit (Pix2Pix) complete: {result_filename}")
-                    return jsonify({
-                        'success': True,
-                        'image_url': f'/api/download/{result_filename}',
-                        'filename': result_filename
-                    })
-                else:
-                    print(f"⚠️ Pix2Pix API error: {response.status_code} - {response.text[:200]}")
-                    
-            except Exception as e:
-                print(f"⚠️ Pix2Pix error: {e}")
-        
-        # Final fallback: Replicate's Instruct-Pix2Pix (also free tier)
-        print("⚠️ Trying Replicate Instruct-Pix2Pix...")
+        # Dominant colors (vectorized histogram + k-means on a bounded sample)
+        colors = palette.dominant_colors(img, k=5)
+        if colors:
+            dominant_colors = [f"{c['hex']} ({c['proportion']:.0%})" for c in colors]
+        else:
+            dominant_colors = ["Unable to extract"]
         
-        try:
-            REPLICATE_TOKEN = os.environ.get('REPLICATE_API_TOKEN', '')
-            if REPLICATE_TOKEN:
-                import replicate
-                
-                # Save temp image
-                temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f'temp_rep_{timestamp}.png')
-                img.save(temp_path)
-                
-                with open(temp_path, 'rb') as f:
-                    output = replicate.run(
-                        "timbrooks/instruct-pix2pix:30c1d0b916a6f8efce20493f5d61ee27491ab2a60437c13c588468b9810ec23f",
-                        input={
-                            "image": f,
-                            "prompt": prompt,
-                            "num_inference_steps": 50,
-                            "image_guidance_scale": 1.5
-                        }
-                    )
-                
-                os.remove(temp_path)
-                
-                if output:
-                    result_url = output[0] if isinstance(output, list) else output
-                    response = requests.get(result_url, timeout=60)
-                    
-                    if response.status_code == 200:
-                        result_filename = f'ai_edited_{timestamp}.png'
-                        result_path = os.path.join(app.config['GENERATED_FOLDER'], result_filename)
-                        
-                        result_img = Image.open(io.BytesIO(response.content))
-                        result_img = result_img.resize(original_size, Image.LANCZOS)
-                        result_img.save(result_path)
-                        
-                        print(f"✅ AI Edit (Replicate) complete: {result_filename}")
-                        return jsonify({
-                            'success': True,
-                            'image_url': f'/api/download/{result_filename}',
-                            'filename': result_filename
-                        })
-        except Exception as e:
-            print(f"⚠️ Replicate error: {e}")
+        # Text: what the editor sent, else the OCR done at upload - no second OCR pass
+        texts = data.get('texts')
+        if texts is None:
+            texts = cached_ocr(data.get('image_path', '')) or []
+        detected_text = [t['text'] for t in texts if t.get('text') and not t.get('isPlaceholder')]
         
-        # No API keys available
-        return jsonify({
-            'error': 'No AI editing service available. Please add one of: FAL_KEY, HUGGING_FACE_API_KEY, or REPLICATE_API_TOKEN to your .env file',
-            'help': 'Get free API keys at: fal.ai, huggingface.co, or replicate.com'
-        }), 400
+        description = f"""Image Analysis:
+- Dimensions: {width}x{height} pixels
+- Color mode: {mode}
+- Dominant colors: {', '.join(dominant_colors[:3])}
+- Detected text: {', '.join(detected_text) if detected_text else 'None'}
+
+Note: For detailed AI description, add GEMINI_API_KEY to environment variables (free at aistudio.google.com)"""
         
-        return jsonify({'error': 'AI edit failed - please try again'}), 500
+        return {
+            'success': True,
+            'description': description,
+            'suggested_prompt': f"An image with dimensions {width}x{height}",
+            'palette': colors,
+            'note': 'Basic analysis. Add GEMINI_API_KEY for detailed AI descriptions.'
+        }, 200
         
     except Exception as e:
-        print(f"❌ AI Edit error: {e}")
-        return jsonify({'error': str(e)}), 500
-
+        print(f"⚠️ Fallback description error: {e}")
+        return {'error': 'Could not analyze image'}, 500
 
 @app.route('/api/describe', methods=['POST'])
 def describe_image():
@@ -876,104 +732,37 @@ def describe_image():
         
         print("🔍 Analyzing image with AI...")
         
-        # Check for Gemini API key
-        GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '')
-        
-        if GEMINI_API_KEY:
+        # Single structured Gemini call (description + prompt), cached by image hash
+        if gemini_client.is_configured():
             try:
-                import google.generativeai as genai
-                
-                genai.configure(api_key=GEMINI_API_KEY)
-                model = genai.GenerativeModel('gemini-1.5-flash')
-                
                 # Decode base64
                 if ',' in image_data:
                     image_data = image_data.split(',')[1]
                 
-                image_bytes = base64.b64decode(image_data)
-                img = Image.open(io.BytesIO(image_bytes))
-                
-                # Generate description
-                response = model.generate_content([
-                    "Describe this image in detail. Include: 1) Main subject/objects, 2) Colors and lighting, 3) Background/setting, 4) Mood/atmosphere, 5) Any text visible. Be concise but thorough.",
-                    img
-                ])
-                
-                description = response.text
-                
-                # Also generate a short prompt for AI generation
-                prompt_response = model.generate_content([
-                    "Create a short, descriptive prompt (max 50 words) that could be used to generate a similar image with AI. Focus on key visual elements.",
-                    img
-                ])
+                result = gemini_client.describe_image_bytes(base64.b64decode(image_data))
                 
-                suggested_prompt = prompt_response.text
-                
-                print(f"✅ Image described successfully")
+                print(f"✅ Image described successfully{' (cached)' if result['cached'] else ''}")
                 return jsonify({
                     'success': True,
-                    'description': description,
-                    'suggested_prompt': suggested_prompt
+                    'description': result['description'],
+                    'suggested_prompt': result['suggested_prompt']
                 })
                 
             except Exception as e:
                 print(f"⚠️ Gemini error: {e}")
         
-        # Fallback: Use Pollinations text API for description
-        try:
-            # Save image temporarily
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
-            
-            # Use basic OCR-based description as fallback
-            image_bytes = base64.b64decode(image_data)
-            img = Image.open(io.BytesIO(image_bytes))
-            
-            # Get basic info
-            width, height = img.size
-            mode = img.mode
-            
-            # Extract colors
-            img_small = img.resize((50, 50))
-            colors = img_small.getcolors(maxcolors=2500)
-            if colors:
-                colors = sorted(colors, key=lambda x: x[0], reverse=True)[:5]
-                dominant_colors = [f"RGB{c[1][:3] if len(c[1]) >= 3 else c[1]}" for c in colors]
-            else:
-                dominant_colors = ["Unable to extract"]
-            
-            # Try OCR for any text
-            try:
-                img_array = np.array(img)
-                ocr_results = reader.readtext(img_array)
-                detected_text = [r[1] for r in ocr_results] if ocr_results else []
-            except:
-                detected_text = []
-            
-            description = f"""Image Analysis:
-- Dimensions: {width}x{height} pixels
-- Color mode: {mode}
-- Dominant colors: {', '.join(dominant_colors[:3])}
-- Detected text: {', '.join(detected_text) if detected_text else 'None'}
-
-Note: For detailed AI description, add GEMINI_API_KEY to environment variables (free at aistudio.google.com)"""
-            
-            return jsonify({
-                'success': True,
-                'description': description,
-                'suggested_prompt': f"An image with dimensions {width}x{height}",
-                'note': 'Basic analysis. Add GEMINI_API_KEY for detailed AI descriptions.'
-            })
-            
-        except Exception as e:
-            print(f"⚠️ Fallback description error: {e}")
-            return jsonify({'error': 'Could not analyze image'}), 500
+        # Fallback: basic local analysis (size, palette, known text)
+        payload, status = describe_fallback(image_data, data)
+        return jsonify(payload), status
         
     except Exception as e:
         print(f"❌ Describe error: {e}")
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
+    # Start generating meme captions before the first click
+    caption_pool.warm()
+    
     print("=" * 60)
     print("🎨 AI Image Text Editor - FREE VERSION")
     print("=" * 60)
@@ -985,6 +774,8 @@ if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     print(f"🚀 Starting server at http://0.0.0.0:{port}")
     print("   Press CTRL+C to stop")
+    print("   Production: run `gunicorn` from the project root (see gunicorn.conf.py)")
     print("=" * 60)
     
-    app.run(debug=True, host='0.0.0.0', port=port)
+    # The debug reloader imports the app (and EasyOCR) twice; FLASK_DEBUG=0 turns it off
+    app.run(debug=os.environ.get('FLASK_DEBUG', '1') == '1', host='0.0.0.0', port=port)
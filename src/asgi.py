@@ -0,0 +1,227 @@
+"""
+ASGI entry point: upstream-bound endpoints without a thread per request
+/api/generate, /api/describe, /api/generate-memes and /api/ai-edit are
+served by coroutines that await upstream HTTP on one shared
+httpx.AsyncClient, so a process keeps hundreds of upstream calls in flight
+while their CPU work (decoding, effects, text, encoding) runs on a bounded
+thread pool. Every other route is the Flask app (app_free.py), run on its
+own thread pool by a2wsgi's WSGI adapter.
+
+    uvicorn asgi:app --app-dir src --port 5000
+    SERVER_MODE=asgi gunicorn          (preloaded workers, see gunicorn.conf.py)
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import asyncio
+import base64
+import json
+import time
+import os
+
+import httpx
+from a2wsgi import WSGIMiddleware
+
+import app_free
+import gemini_client
+import metrics
+import pipeline
+
+# Upstream connections kept open at once by this process (all services)
+MAX_UPSTREAM_CONNECTIONS = int(os.environ.get('ASGI_MAX_UPSTREAM_CONNECTIONS', 200))
+# Requests on the async routes in flight before new ones get 429
+MAX_INFLIGHT = int(os.environ.get('ASGI_MAX_INFLIGHT', 500))
+# Threads for the CPU steps of the async routes
+CPU_WORKERS = int(os.environ.get('ASGI_CPU_WORKERS', app_free.ADMISSION_SLOTS))
+# Threads for the Flask routes (upload, previews, polling) - as GUNICORN_THREADS
+WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 16))
+MAX_BODY_BYTES = app_free.app.config['MAX_CONTENT_LENGTH']
+
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix='asgi-cpu')
+flask_app = WSGIMiddleware(app_free.app, workers=WSGI_THREADS)
+
+_client = None
+_inflight = 0
+
+metrics.Gauge(
+    'image_editor_asgi_in_flight', 'Requests in flight on the async routes',
+    callback=lambda: {(): _inflight})
+
+
+def get_client():
+    """Shared async HTTP client, created on first use inside the worker's event loop"""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=MAX_UPSTREAM_CONNECTIONS,
+                                max_keepalive_connections=MAX_UPSTREAM_CONNECTIONS // 4),
+            follow_redirects=True)
+    return _client
+
+
+async def run_cpu(fn, *args):
+    """Run CPU work on the executor, keeping the request's metric labels"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(cpu_executor, context.run, fn, *args)
+
+
+def _decode_data_url(image_data):
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    return base64.b64decode(image_data)
+
+
+# ---------- routes ----------
+
+async def generate_variations(data, scope):
+    """Same contract as app_free.generate_variations; the AI backgrounds are fetched concurrently"""
+    image_path = data.get('image_path', '')
+    texts = data.get('texts', [])
+    style_prompt = data.get('style_prompt', '').strip()
+
+    base_img, error = await run_cpu(app_free.load_generate_base, image_path)
+    if error:
+        return {'error': error}, 400
+
+    print(f"🎨 Creating 3 variations of {image_path} (async)...")
+    variations = await pipeline.generate_variations_async(
+        get_client(), base_img, texts, style_prompt, storage=app_free.generated_storage, run_cpu=run_cpu)
+    return {'success': True, 'variations': variations}, 200
+
+
+async def describe_image(data, scope):
+    image_data = data.get('image')
+    if not image_data:
+        return {'error': 'Image required'}, 400
+
+    if gemini_client.is_configured():
+        try:
+            image_bytes = await run_cpu(_decode_data_url, image_data)
+            result = await gemini_client.describe_image_bytes_async(get_client(), image_bytes)
+            print(f"✅ Image described successfully{' (cached)' if result['cached'] else ''}")
+            return {
+                'success': True,
+                'description': result['description'],
+                'suggested_prompt': result['suggested_prompt']
+            }, 200
+        except Exception as e:
+            print(f"⚠️ Gemini error: {e}")
+
+    return await run_cpu(app_free.describe_fallback, image_data, data)
+
+
+async def generate_memes(data, scope):
+    # Sampled from the pre-generated pool: no upstream call, no thread needed
+    client = scope.get('client') or (None, None)
+    return app_free.meme_captions_response(data, client[0]), 200
+
+
+async def ai_edit_image(data, scope):
+    # Decoding and hashing the image is CPU work; the providers run on the job queue
+    return await run_cpu(app_free.submit_ai_edit, data)
+
+
+# (method, path) -> (endpoint label, handler); names match the Flask endpoints
+ROUTES = {
+    ('POST', '/api/generate'): ('generate_variations', generate_variations),
+    ('POST', '/api/describe'): ('describe_image', describe_image),
+    ('POST', '/api/generate-memes'): ('generate_memes', generate_memes),
+    ('POST', '/api/ai-edit'): ('ai_edit_image', ai_edit_image),
+}
+
+
+# ---------- ASGI plumbing ----------
+
+class _BadRequest(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+async def _read_json(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise _BadRequest('Client disconnected', 499)
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY_BYTES:
+            raise _BadRequest('Request too large', 413)
+        if not message.get('more_body'):
+            break
+    try:
+        data = json.loads(body or b'{}')
+    except ValueError:
+        raise _BadRequest('Invalid JSON body')
+    if not isinstance(data, dict):
+        raise _BadRequest('JSON object expected')
+    return data
+
+
+async def _send_json(send, payload, status=200, headers=()):
+    body = json.dumps(payload).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())] + list(headers)
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _serve(name, handler, scope, receive, send):
+    global _inflight
+    started = time.perf_counter()
+    token = metrics.current_endpoint.set(name)
+    status = 500
+    try:
+        if _inflight >= MAX_INFLIGHT:
+            status = 429
+            await _send_json(send, {'error': 'Server is busy, please retry shortly', 'retry_after': 1},
+                             status, [(b'retry-after', b'1')])
+            return
+
+        _inflight += 1
+        try:
+            data = await _read_json(receive)
+            payload, status = await handler(data, scope)
+        except _BadRequest as e:
+            payload, status = {'error': str(e)}, e.status
+        except Exception as e:
+            print(f"❌ {name} error: {e}")
+            payload, status = {'error': str(e)}, 500
+        finally:
+            _inflight -= 1
+        if status != 499:  # nobody left to answer
+            await _send_json(send, payload, status)
+    finally:
+        labels = (name, scope['method'], str(status))
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, *labels)
+        metrics.REQUESTS_TOTAL.inc(*labels)
+        metrics.current_endpoint.reset(token)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Per worker (after the fork): start filling the caption pool
+            app_free.caption_pool.warm()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _client is not None:
+                await _client.aclose()
+            cpu_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+
+    route = ROUTES.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+    if route is None:
+        return await flask_app(scope, receive, send)
+    name, handler = route
+    await _serve(name, handler, scope, receive, send)
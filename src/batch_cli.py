@@ -0,0 +1,267 @@
+"""
+Headless batch processor - runs the web pipeline without Flask or a browser
+OCR -> text removal -> re-render -> effects for every image in a directory
+(or manifest), spread over a multiprocessing pool, with resumable runs.
+
+Usage:
+    python batch_cli.py --input ./images --output ./out
+    python batch_cli.py --manifest backfill.json --output ./out --workers 4
+"""
+
+from datetime import datetime
+import multiprocessing
+import argparse
+import json
+import time
+import sys
+import os
+
+from rendering import EFFECT_PRESETS, DEFAULT_PRESETS, apply_effect, draw_text_elements
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+RESULT_FILE = 'result.json'
+REPORT_FILE = 'report.json'
+
+# Set in each worker by _init_worker
+_pipeline = None
+
+
+def _init_worker():
+    """Load the web pipeline (and its OCR reader) once per worker process"""
+    global _pipeline
+    if _pipeline is None:
+        import app_free
+        _pipeline = app_free
+
+
+def find_images(input_dir):
+    """Walk the input directory and return image paths in a stable order"""
+    found = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                found.append(os.path.join(root, name))
+    return found
+
+
+def load_manifest(manifest_path):
+    """
+    Read a JSON manifest: a list of image paths or of
+    {"path": ..., "presets": [...]} objects (paths relative to the manifest)
+    Raises ValueError for malformed entries or unknown presets
+    """
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    if not isinstance(entries, list):
+        raise ValueError("Manifest must be a JSON list")
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    tasks = []
+    for index, entry in enumerate(entries, 1):
+        if isinstance(entry, str):
+            entry = {'path': entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get('path'), str) or not entry['path']:
+            raise ValueError(f"Manifest entry {index}: needs a path")
+        if 'presets' in entry:
+            presets = entry['presets']
+            if not isinstance(presets, list) or not presets:
+                raise ValueError(f"Manifest entry {index}: presets must be a non-empty list")
+            unknown = [p for p in presets if p not in EFFECT_PRESETS]
+            if unknown:
+                raise ValueError(f"Manifest entry {index}: unknown presets: {', '.join(map(str, unknown))}")
+        entry['path'] = os.path.join(base_dir, entry['path'])
+        tasks.append(entry)
+    return tasks
+
+
+def output_dir_for(image_path, input_root, output_root):
+    """
+    Mirror the input layout: out/<relative path without extension>/
+    Images outside the input root (absolute or ../ manifest paths) go under
+    out/_external/<absolute path>/, so nothing is written outside out/
+    """
+    image_path = os.path.abspath(image_path)
+    try:
+        rel_path = os.path.relpath(image_path, os.path.abspath(input_root))
+    except ValueError:
+        rel_path = os.pardir  # Another drive (Windows)
+    if rel_path == os.pardir or rel_path.startswith(os.pardir + os.sep):
+        rel_path = os.path.join('_external', os.path.splitdrive(image_path)[1].lstrip('\\/'))
+    return os.path.join(output_root, os.path.splitext(rel_path)[0])
+
+
+def is_done(output_dir):
+    """A task is done when its result.json exists and recorded success"""
+    result_path = os.path.join(output_dir, RESULT_FILE)
+    if not os.path.exists(result_path):
+        return False
+    try:
+        with open(result_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('status') == 'completed'
+    except (OSError, ValueError):
+        return False
+
+
+def process_image(task):
+    """
+    Run the full pipeline for one image in a worker process
+    Writes the clean image, one file per preset and result.json
+    """
+    _init_worker()
+    from PIL import Image
+
+    started = time.time()
+    output_dir = task['output_dir']
+    os.makedirs(output_dir, exist_ok=True)
+
+    result = {
+        'input': task['path'],
+        'output_dir': output_dir,
+        'started_at': datetime.now().isoformat()
+    }
+
+    try:
+        img = Image.open(task['path'])
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        detected_texts, clean_img = _pipeline.extract_text_from_image(img)
+        if clean_img is None:
+            clean_img = img
+        clean_img.save(os.path.join(output_dir, 'clean.png'))
+
+        # Re-render detected text (placeholders are UI-only)
+        texts = [t for t in detected_texts if not t.get('isPlaceholder')]
+
+        outputs = []
+        for preset in task['presets']:
+            variation_img = apply_effect(clean_img, preset)
+            draw_text_elements(variation_img, texts)
+            filename = f'{preset}.png'
+            variation_img.save(os.path.join(output_dir, filename))
+            outputs.append({'preset': preset, 'file': filename})
+
+        result.update({
+            'status': 'completed',
+            'width': img.width,
+            'height': img.height,
+            'detected_texts': texts,
+            'outputs': outputs
+        })
+
+    except Exception as e:
+        result.update({'status': 'failed', 'error': str(e)})
+
+    result['seconds'] = round(time.time() - started, 3)
+
+    with open(os.path.join(output_dir, RESULT_FILE), 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+
+    return result
+
+
+def write_report(output_root, tasks, run_info):
+    """Collect every result.json (including ones from earlier runs) into report.json"""
+    results = []
+    for task in tasks:
+        result_path = os.path.join(task['output_dir'], RESULT_FILE)
+        try:
+            with open(result_path, 'r', encoding='utf-8') as f:
+                results.append(json.load(f))
+        except (OSError, ValueError):
+            results.append({'input': task['path'], 'status': 'missing'})
+
+    report = dict(run_info, **{
+        'total': len(results),
+        'completed': sum(1 for r in results if r.get('status') == 'completed'),
+        'failed': sum(1 for r in results if r.get('status') == 'failed'),
+        'items': results
+    })
+
+    report_path = os.path.join(output_root, REPORT_FILE)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    return report_path, report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Run OCR, text removal and effect rendering over many images')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input', help='Directory to scan (recursively) for images')
+    source.add_argument('--manifest', help='JSON list of image paths or {"path", "presets"} objects')
+    parser.add_argument('--output', required=True, help='Directory for outputs and report.json')
+    parser.add_argument('--presets', default=','.join(DEFAULT_PRESETS),
+                        help=f"Comma-separated presets ({', '.join(EFFECT_PRESETS)})")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+    parser.add_argument('--no-resume', action='store_true', help='Reprocess images that already completed')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    presets = [p.strip() for p in args.presets.split(',') if p.strip()]
+    unknown = [p for p in presets if p not in EFFECT_PRESETS]
+    if unknown:
+        print(f"❌ Unknown presets: {', '.join(unknown)}")
+        return 2
+
+    if args.input:
+        input_root = args.input
+        tasks = [{'path': path} for path in find_images(args.input)]
+    else:
+        input_root = os.path.dirname(os.path.abspath(args.manifest))
+        try:
+            tasks = load_manifest(args.manifest)
+        except (OSError, ValueError) as e:
+            print(f"❌ Invalid manifest: {e}")
+            return 2
+
+    for task in tasks:
+        task.setdefault('presets', presets)
+        task['output_dir'] = output_dir_for(task['path'], input_root, args.output)
+
+    pending = tasks if args.no_resume else [t for t in tasks if not is_done(t['output_dir'])]
+
+    print("=" * 60)
+    print(f"📂 {len(tasks)} images found, {len(tasks) - len(pending)} already done, {len(pending)} to process")
+    print(f"⚙️ {args.workers} workers, presets: {', '.join(presets)}")
+    print("=" * 60)
+
+    os.makedirs(args.output, exist_ok=True)
+    started = time.time()
+    completed = failed = 0
+
+    if pending:
+        # Fork where available so workers share the parent's OCR model pages
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        if 'fork' in methods:
+            _init_worker()
+
+        with context.Pool(processes=args.workers, initializer=_init_worker) as pool:
+            for result in pool.imap_unordered(process_image, pending):
+                if result['status'] == 'completed':
+                    completed += 1
+                    print(f"✅ [{completed + failed}/{len(pending)}] {result['input']} ({result['seconds']}s)")
+                else:
+                    failed += 1
+                    print(f"❌ [{completed + failed}/{len(pending)}] {result['input']}: {result.get('error')}")
+
+    report_path, report = write_report(args.output, tasks, {
+        'finished_at': datetime.now().isoformat(),
+        'run_seconds': round(time.time() - started, 3),
+        'processed_this_run': len(pending),
+        'presets': presets
+    })
+
+    print("=" * 60)
+    print(f"📊 {report['completed']}/{report['total']} completed, {report['failed']} failed")
+    print(f"📝 Report written to {report_path}")
+    print("=" * 60)
+    return 0 if report['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
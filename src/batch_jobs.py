@@ -0,0 +1,259 @@
+"""
+Batch generation jobs - many images x many presets in one submission
+Work items are rendered on a process pool (one worker per core) and the
+finished job is packed into a ZIP archive with a per-item manifest.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from PIL import Image
+import multiprocessing
+import threading
+import zipfile
+import shutil
+import json
+import time
+import uuid
+import os
+
+from rendering import EFFECT_PRESETS, apply_effect, draw_text_elements
+
+MAX_BATCH_ITEMS = 5000
+
+# Finished jobs (status, archive and output directory) are kept this long
+BATCH_RETENTION_SECONDS = float(os.environ.get('BATCH_RETENTION', 24 * 3600))
+
+# Process pool shared by all batch jobs (created on first submission)
+_executor = None
+_executor_lock = threading.Lock()
+
+# job_id -> BatchJob
+BATCH_JOBS = {}
+_jobs_lock = threading.Lock()
+
+
+def get_executor():
+    """Create the worker pool lazily so the web app starts without it"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # BATCH_WORKERS is per process: gunicorn.conf.py splits the host's
+            # cores between its workers
+            workers = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 1))
+            # Never fork the web process itself: by now it runs torch pools and
+            # background threads whose locks a forked child could inherit held.
+            # The fork server starts clean and only imports this module (and
+            # rendering); children are forked from it. 'spawn' elsewhere.
+            # Like any such pool, children also import the launching script
+            # (gunicorn's / uvicorn's; app_free.py itself under the dev server)
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            if 'forkserver' in methods:
+                context.set_forkserver_preload([__name__])
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+            print(f"⚙️ Batch worker pool started with {workers} workers ({context.get_start_method()})")
+        return _executor
+
+
+def render_batch_item(image_path, texts, preset, output_path):
+    """
+    Render one (image, preset) work item in a worker process
+    Returns the manifest entry for the item
+    """
+    started = datetime.now()
+    img = Image.open(image_path)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    variation_img = apply_effect(img, preset)
+    draw_text_elements(variation_img, texts)
+    variation_img.save(output_path, format='PNG')
+
+    return {
+        'width': variation_img.width,
+        'height': variation_img.height,
+        'seconds': round((datetime.now() - started).total_seconds(), 3)
+    }
+
+
+class BatchJob:
+    """Progress and results of one batch submission"""
+
+    def __init__(self, job_id, items, output_dir):
+        self.id = job_id
+        self.items = items
+        self.output_dir = output_dir
+        self.status = 'queued'
+        self.completed = 0
+        self.failed = 0
+        self.created_at = datetime.now().isoformat()
+        self.finished_at = None
+        self.finished = None  # time.time() when settled, for retention
+        self.archive_path = None
+        self.lock = threading.Lock()
+
+    @property
+    def total(self):
+        return len(self.items)
+
+    def to_dict(self):
+        with self.lock:
+            done = self.completed + self.failed
+            return {
+                'job_id': self.id,
+                'status': self.status,
+                'total': self.total,
+                'completed': self.completed,
+                'failed': self.failed,
+                'progress': round(done / self.total, 3) if self.total else 1.0,
+                'created_at': self.created_at,
+                'finished_at': self.finished_at,
+                'download_url': f'/api/batch/{self.id}/download' if self.archive_path else None
+            }
+
+    def manifest(self):
+        with self.lock:
+            return [dict(item) for item in self.items]
+
+
+def _item_done(job, item, future):
+    """Future callback - record the item result and finish the job when all are done"""
+    try:
+        result = dict(future.result(), status='completed')
+    except Exception as e:
+        result = {'status': 'failed', 'error': str(e)}
+
+    with job.lock:
+        item.update(result)
+        if item['status'] == 'completed':
+            job.completed += 1
+        else:
+            job.failed += 1
+        finished = job.completed + job.failed == job.total
+
+    if finished:
+        # This callback runs on the pool's management thread: writing the
+        # archive there would hold up the results of every other batch
+        threading.Thread(target=_finish_job, args=(job,), name=f'batch-archive-{job.id}', daemon=True).start()
+
+
+def _finish_job(job):
+    """Pack rendered images and manifest.json into the job archive"""
+    manifest = job.manifest()
+    archive_path = os.path.join(job.output_dir, f'batch_{job.id}.zip')
+
+    try:
+        with zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for item in manifest:
+                if item['status'] == 'completed':
+                    archive.write(os.path.join(job.output_dir, item['output']), item['output'])
+            archive.writestr('manifest.json', json.dumps({
+                'job_id': job.id,
+                'created_at': job.created_at,
+                'items': manifest
+            }, indent=2))
+
+        with job.lock:
+            job.archive_path = archive_path
+            job.status = 'completed' if job.failed == 0 else 'completed_with_errors'
+            job.finished_at = datetime.now().isoformat()
+            job.finished = time.time()
+        print(f"✅ Batch {job.id} done: {job.completed} ok, {job.failed} failed")
+
+    except Exception as e:
+        with job.lock:
+            job.status = 'failed'
+            job.finished_at = datetime.now().isoformat()
+            job.finished = time.time()
+        print(f"❌ Batch {job.id} archive error: {e}")
+
+
+def _prune(output_folder):
+    """Forget finished jobs older than BATCH_RETENTION_SECONDS and delete their outputs"""
+    cutoff = time.time() - BATCH_RETENTION_SECONDS
+    with _jobs_lock:
+        expired = [job for job in BATCH_JOBS.values() if job.finished and job.finished < cutoff]
+        for job in expired:
+            del BATCH_JOBS[job.id]
+        live = {job.output_dir for job in BATCH_JOBS.values()}
+
+    for job in expired:
+        shutil.rmtree(job.output_dir, ignore_errors=True)
+
+    # Output directories left by an earlier run of the app
+    try:
+        names = os.listdir(output_folder)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(output_folder, name)
+        try:
+            if (name.startswith('batch_') and os.path.isdir(path) and path not in live
+                    and os.path.getmtime(path) < cutoff):
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def submit_batch(images, presets, default_texts, output_folder):
+    """
+    Schedule every (image, preset) pair of a batch on the worker pool
+
+    images: list of {'path': <file on disk>, 'name': <label>, 'texts': [...] or None}
+    presets: list of EFFECT_PRESETS keys
+    default_texts: text layout used for images without their own layout
+    """
+    unknown = [p for p in presets if p not in EFFECT_PRESETS]
+    if unknown:
+        raise ValueError(f"Unknown presets: {', '.join(unknown)}")
+    if not images or not presets:
+        raise ValueError("At least one image and one preset are required")
+    if len(images) * len(presets) > MAX_BATCH_ITEMS:
+        raise ValueError(f"Batch too large (max {MAX_BATCH_ITEMS} items)")
+
+    _prune(output_folder)
+
+    job_id = uuid.uuid4().hex[:12]
+    output_dir = os.path.join(output_folder, f'batch_{job_id}')
+    os.makedirs(output_dir, exist_ok=True)
+
+    items = []
+    for image_index, image in enumerate(images):
+        for preset in presets:
+            items.append({
+                'id': len(items) + 1,
+                'image': image['name'],
+                'image_index': image_index,
+                'preset': preset,
+                'effect': EFFECT_PRESETS[preset]['name'],
+                'output': f'{image_index + 1:04d}_{preset}.png',
+                'status': 'queued'
+            })
+
+    job = BatchJob(job_id, items, output_dir)
+    with _jobs_lock:
+        BATCH_JOBS[job_id] = job
+
+    executor = get_executor()
+    job.status = 'running'
+    for item in items:
+        image = images[item['image_index']]
+        texts = image.get('texts')
+        if texts is None:
+            texts = default_texts
+        future = executor.submit(
+            render_batch_item,
+            image['path'],
+            texts,
+            item['preset'],
+            os.path.join(output_dir, item['output'])
+        )
+        future.add_done_callback(lambda f, item=item: _item_done(job, item, f))
+
+    print(f"📦 Batch {job_id} queued: {len(images)} images x {len(presets)} presets")
+    return job
+
+
+def get_job(job_id):
+    with _jobs_lock:
+        return BATCH_JOBS.get(job_id)
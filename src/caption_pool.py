@@ -0,0 +1,171 @@
+"""
+Pre-generated meme caption pool
+A background thread keeps a pool of captions per topic topped up from the
+text API; requests sample from the pool instantly, never repeating a
+caption within a session until that session has seen the whole pool.
+"""
+
+from collections import OrderedDict
+import threading
+import random
+import time
+import os
+
+POOL_TARGET = int(os.environ.get('CAPTION_POOL_TARGET', 30))
+POOL_MAX = int(os.environ.get('CAPTION_POOL_MAX', 100))
+MAX_TOPICS = int(os.environ.get('CAPTION_POOL_TOPICS', 50))
+MAX_SESSIONS = 1000
+# Pause between upstream calls so the free API is not hammered
+REFILL_PAUSE_SECONDS = float(os.environ.get('CAPTION_POOL_REFILL_PAUSE', 2))
+# A topic whose fetches add nothing new (duplicates, upstream down) is retried
+# after an exponentially growing pause, up to this long
+REFILL_MAX_BACKOFF_SECONDS = float(os.environ.get('CAPTION_POOL_MAX_BACKOFF', 600))
+
+
+def normalize_topic(topic):
+    return ' '.join((topic or '').lower().split())[:80]
+
+
+class CaptionPool:
+    """Per-topic caption pools refreshed by a background thread"""
+
+    def __init__(self, fetch_captions, default_topic):
+        # fetch_captions(topic) -> list of captions ([] on failure)
+        self.fetch_captions = fetch_captions
+        self.default_topic = normalize_topic(default_topic)
+        self.pools = OrderedDict()  # topic -> list of captions (oldest first)
+        self.sessions = OrderedDict()  # (session, topic) -> set of captions already shown
+        self.wanted = OrderedDict()  # topics waiting for a refill
+        self.backoff = {}  # topic -> (fetches in a row that added nothing, time.monotonic() of the next try)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.worker = None
+        self.worker_pid = None
+
+    def _ensure_worker(self):
+        """Start (or restart after a fork) the refill thread"""
+        if self.worker is not None and self.worker.is_alive() and self.worker_pid == os.getpid():
+            return
+        self.worker_pid = os.getpid()
+        self.worker = threading.Thread(target=self._refill_loop, name='caption-pool', daemon=True)
+        self.worker.start()
+
+    def request_refill(self, topic):
+        topic = normalize_topic(topic)
+        with self.lock:
+            if topic not in self.pools:
+                self.pools[topic] = []
+                while len(self.pools) > MAX_TOPICS:
+                    oldest = next(t for t in self.pools if t != self.default_topic)
+                    del self.pools[oldest]
+                    self.wanted.pop(oldest, None)
+                    self.backoff.pop(oldest, None)
+            self.pools.move_to_end(topic)
+            self.wanted[topic] = True
+        self._ensure_worker()
+        self.wakeup.set()
+
+    def warm(self):
+        """Start filling the default topic so the first request is served from the pool"""
+        self.request_refill(self.default_topic)
+
+    def sample(self, topic, session_id, count=5):
+        """
+        Up to `count` captions for this topic not yet shown to this session
+        Falls back to the default topic's pool while a new topic fills up;
+        returns (captions, source_topic) - captions is empty when no pool has any
+        """
+        topic = normalize_topic(topic) or self.default_topic
+        with self.lock:
+            needs_fill = len(self.pools.get(topic, [])) < POOL_TARGET
+        if needs_fill:
+            self.request_refill(topic)
+
+        for source in (topic, self.default_topic):
+            captions = self._sample_from(source, session_id, count)
+            if captions:
+                return captions, source
+        self.request_refill(self.default_topic)
+        return [], None
+
+    def _sample_from(self, topic, session_id, count):
+        with self.lock:
+            pool = self.pools.get(topic)
+            if not pool:
+                return []
+
+            key = (session_id, topic)
+            seen = self.sessions.get(key)
+            if seen is None:
+                seen = set()
+                self.sessions[key] = seen
+                while len(self.sessions) > MAX_SESSIONS:
+                    self.sessions.popitem(last=False)
+            self.sessions.move_to_end(key)
+
+            unseen = [c for c in pool if c not in seen]
+            if len(unseen) < count:
+                # Session has seen (almost) everything: start over
+                seen.clear()
+                unseen = list(pool)
+
+            picked = random.sample(unseen, min(count, len(unseen)))
+            seen.update(picked)
+            running_low = len(pool) - len(seen) < count or len(pool) < POOL_TARGET
+
+        if running_low:
+            self.request_refill(topic)
+        return picked
+
+    def _next_topic(self):
+        """(topic to fetch now or None, seconds until one is due); the caller holds the lock"""
+        now = time.monotonic()
+        next_due = 60
+        for topic in self.wanted:
+            retry_at = self.backoff.get(topic, (0, 0))[1]
+            if retry_at <= now:
+                del self.wanted[topic]
+                return topic, 0
+            next_due = min(next_due, retry_at - now)
+        return None, next_due
+
+    def _refill_loop(self):
+        next_due = 60
+        while True:
+            self.wakeup.wait(timeout=next_due)
+            self.wakeup.clear()
+
+            while True:
+                with self.lock:
+                    topic, next_due = self._next_topic()
+                if topic is None:
+                    break
+
+                captions = self.fetch_captions(topic)
+
+                with self.lock:
+                    pool = self.pools.get(topic)
+                    if pool is None:
+                        continue  # Topic evicted meanwhile
+                    added = 0
+                    for caption in captions:
+                        if caption not in pool:
+                            pool.append(caption)
+                            added += 1
+                    del pool[:-POOL_MAX]
+                    if added:
+                        self.backoff.pop(topic, None)
+                    else:
+                        # Nothing new: wait longer before asking the upstream again
+                        fruitless = self.backoff.get(topic, (0, 0))[0] + 1
+                        delay = min(REFILL_MAX_BACKOFF_SECONDS, REFILL_PAUSE_SECONDS * 2 ** fruitless)
+                        self.backoff[topic] = (fruitless, time.monotonic() + delay)
+                    if len(pool) < POOL_TARGET:
+                        self.wanted[topic] = True
+                print(f"🎭 Caption pool '{topic[:30]}': {len(pool)} captions (+{added})")
+
+                time.sleep(REFILL_PAUSE_SECONDS)
+
+    def stats(self):
+        with self.lock:
+            return {topic: len(pool) for topic, pool in self.pools.items()}
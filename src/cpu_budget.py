@@ -0,0 +1,211 @@
+"""
+CPU thread limits for EasyOCR (torch) and OpenCV
+Both default to one thread per host core in every process; with several
+workers (or concurrent requests) that oversubscribes the CPU. These helpers
+size the native thread pools from the cores this container may actually use,
+and `budget` shares them between the OCR / inpaint sections running at once:
+all of them for a section that runs alone, max_threads // N each for N.
+
+    with cpu_budget.budget.limit('torch'):
+        results = reader.readtext(img_array)
+
+The thread counts are process-wide settings (cv2.setNumThreads applies to
+every thread; torch.set_num_threads also resets the MKL/OpenMP intra-op
+pools), so the share is one value for all running sections: it is applied
+under a short lock whenever a section starts or ends.
+"""
+
+from contextlib import contextmanager
+import threading
+import os
+
+import metrics
+
+# Read by OpenMP / BLAS runtimes when they initialize (i.e. on first import)
+NATIVE_THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+def _cgroup_cpu_limit():
+    """CPU quota of this container in cores (None when unlimited or unknown)"""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:  # cgroup v2: '<quota> <period>' or 'max <period>'
+            quota, period = f.read().split()[:2]
+        if quota != 'max':
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:  # cgroup v1
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cores():
+    """Cores this process may run on: CPU affinity, capped by the container quota"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    limit = _cgroup_cpu_limit()
+    if limit is not None:
+        cores = min(cores, max(1, int(limit + 0.5)))
+    return max(1, cores)
+
+
+def limit_native_threads(count):
+    """
+    Default the OpenMP/BLAS pools to `count` threads
+    Only effective before torch/numpy/cv2 are imported; explicit env wins
+    """
+    for name in NATIVE_THREAD_ENV_VARS:
+        os.environ.setdefault(name, str(count))
+
+
+def _set_torch_threads(count):
+    import torch
+    torch.set_num_threads(count)
+    return torch.get_num_threads()
+
+
+def _set_opencv_threads(count):
+    import cv2
+    cv2.setNumThreads(count)
+    return cv2.getNumThreads()
+
+
+THREAD_SETTERS = {'torch': _set_torch_threads, 'opencv': _set_opencv_threads}
+
+
+def set_intra_op_threads(count):
+    """
+    Set torch and OpenCV intra-op threads for this process
+    Returns {library: threads} for the libraries that are installed
+    """
+    applied = {}
+    for library, setter in THREAD_SETTERS.items():
+        try:
+            applied[library] = setter(count)
+        except ImportError:
+            pass
+    return applied
+
+
+class ThreadBudget:
+    """
+    Intra-op threads for OCR / inpaint calls: every thread while one call
+    runs, an equal share per call when several run at once (never less than
+    one), so concurrent calls do not oversubscribe the CPU. In-flight
+    requests are counted too (background work yields to them).
+    """
+
+    def __init__(self, max_threads):
+        self.max_threads = max_threads
+        self.inflight = 0
+        self.sections = {}  # library -> torch/OpenCV sections running now
+        self.applied = {}  # library -> threads currently set for it
+        self.missing = set()  # libraries not installed here (serverless: no torch)
+        self.lock = threading.Lock()
+
+    def configure(self, max_threads):
+        """Cap the budget (e.g. per gunicorn worker: cores / workers)"""
+        with self.lock:
+            self.max_threads = max(1, max_threads)
+
+    def _share(self):
+        return max(1, self.max_threads // max(1, sum(self.sections.values())))
+
+    def threads(self):
+        with self.lock:
+            return self._share()
+
+    def request_started(self):
+        with self.lock:
+            self.inflight += 1
+
+    def request_finished(self):
+        with self.lock:
+            self.inflight = max(0, self.inflight - 1)
+
+    def _apply(self):
+        """Set the current share on every library with a running section (the caller holds the lock)"""
+        count = self._share()
+        for library, running in self.sections.items():
+            if not running or library in self.missing or self.applied.get(library) == count:
+                continue
+            try:
+                self.applied[library] = THREAD_SETTERS[library](count)
+            except ImportError:
+                self.missing.add(library)
+        return count
+
+    @contextmanager
+    def limit(self, library):
+        """
+        Run the block as one of the process's torch/OpenCV sections
+        ('torch' or 'opencv'); the share is re-applied as sections start and end
+        """
+        with self.lock:
+            self.sections[library] = self.sections.get(library, 0) + 1
+            count = self._apply()
+        try:
+            yield count
+        finally:
+            with self.lock:
+                self.sections[library] -= 1
+                self._apply()  # The sections still running get the larger share
+
+    @contextmanager
+    def idle(self):
+        """A counted request that is only waiting (e.g. queued for admission) gives up its share"""
+        from flask import g, has_request_context
+        counted = has_request_context() and g.get('cpu_budget_counted', False)
+        if counted:
+            self.request_finished()
+        try:
+            yield
+        finally:
+            if counted:
+                self.request_started()
+
+    def track_app(self, app):
+        """Count the app's POST requests (the ones that do CPU work) as in flight"""
+        from flask import request, g
+
+        @app.before_request
+        def _budget_request_started():
+            if request.method == 'POST':
+                g.cpu_budget_counted = True
+                self.request_started()
+
+        @app.teardown_request
+        def _budget_request_finished(exc=None):
+            if g.pop('cpu_budget_counted', False):
+                self.request_finished()
+
+        return app
+
+    def snapshot(self):
+        """Gauge values: {(kind,): value}"""
+        with self.lock:
+            values = {
+                ('max_threads',): self.max_threads,
+                ('inflight_requests',): self.inflight,
+                ('sections',): sum(self.sections.values()),
+                ('threads',): self._share(),
+            }
+            values.update({(f'{library}_threads',): count for library, count in self.applied.items()})
+        return values
+
+
+# OCR_MAX_THREADS caps the budget below the available cores
+budget = ThreadBudget(int(os.environ.get('OCR_MAX_THREADS', 0)) or available_cores())
+
+THREAD_BUDGET = metrics.Gauge(
+    'image_editor_thread_budget', 'Intra-op thread budget for OCR / inpainting and the requests sharing it',
+    ['kind'], callback=budget.snapshot)
@@ -0,0 +1,179 @@
+"""
+Gemini image description client
+One process-wide HTTP session (connection reuse, configured once), a single
+structured generateContent call that returns both the description and a
+suggested prompt, and an LRU cache keyed by the image's content hash.
+
+GEMINI_API_ENDPOINT points the client at a local stand-in server for tests
+(see tests/fake_upstreams.py). describe_image_bytes_async makes the same call
+on an httpx.AsyncClient for the ASGI entry point (src/asgi.py).
+"""
+
+from collections import OrderedDict
+import threading
+import requests
+import hashlib
+import base64
+import json
+import os
+
+import metrics
+
+GEMINI_MODEL = os.environ.get('GEMINI_MODEL', 'gemini-1.5-flash')
+GEMINI_API_ENDPOINT = os.environ.get('GEMINI_API_ENDPOINT', 'https://generativelanguage.googleapis.com')
+GEMINI_TIMEOUT = float(os.environ.get('GEMINI_TIMEOUT', 30))
+CACHE_SIZE = int(os.environ.get('GEMINI_CACHE_SIZE', 256))
+
+DESCRIBE_PROMPT = (
+    "Analyze this image and answer in JSON with two fields. "
+    "\"description\": describe the image in detail. Include: 1) Main subject/objects, "
+    "2) Colors and lighting, 3) Background/setting, 4) Mood/atmosphere, 5) Any text visible. "
+    "Be concise but thorough. "
+    "\"suggested_prompt\": a short, descriptive prompt (max 50 words) that could be used to "
+    "generate a similar image with AI. Focus on key visual elements."
+)
+
+RESPONSE_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'description': {'type': 'STRING'},
+        'suggested_prompt': {'type': 'STRING'}
+    },
+    'required': ['description', 'suggested_prompt']
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class GeminiError(Exception):
+    """Gemini request failed or returned an unusable answer"""
+
+
+def get_session():
+    """Shared HTTP session, created once per process"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.headers.update({'Content-Type': 'application/json'})
+        return _session
+
+
+def is_configured():
+    return bool(os.environ.get('GEMINI_API_KEY', ''))
+
+
+def _sniff_mime_type(image_bytes):
+    if image_bytes.startswith(b'\x89PNG'):
+        return 'image/png'
+    if image_bytes.startswith(b'\xff\xd8'):
+        return 'image/jpeg'
+    if image_bytes[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/png'
+
+
+def _cache_get(key):
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    return None
+
+
+def _cache_put(key, value):
+    with _cache_lock:
+        _cache[key] = value
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _request(image_bytes):
+    """(url, query params, JSON body) of the structured generateContent call"""
+    body = {
+        'contents': [{
+            'role': 'user',
+            'parts': [
+                {'text': DESCRIBE_PROMPT},
+                {'inline_data': {
+                    'mime_type': _sniff_mime_type(image_bytes),
+                    'data': base64.b64encode(image_bytes).decode()
+                }}
+            ]
+        }],
+        'generationConfig': {
+            'response_mime_type': 'application/json',
+            'response_schema': RESPONSE_SCHEMA
+        }
+    }
+    url = f"{GEMINI_API_ENDPOINT.rstrip('/')}/v1beta/models/{GEMINI_MODEL}:generateContent"
+    return url, {'key': os.environ.get('GEMINI_API_KEY', '')}, json.dumps(body)
+
+
+def _parse(status_code, text):
+    """{'description', 'suggested_prompt'} from the response; raises GeminiError"""
+    if status_code != 200:
+        raise GeminiError(f'Gemini API error: {status_code} - {text[:200]}')
+
+    try:
+        parts = json.loads(text)['candidates'][0]['content']['parts']
+        answer = json.loads(''.join(part.get('text', '') for part in parts))
+        return {
+            'description': answer['description'].strip(),
+            'suggested_prompt': answer.get('suggested_prompt', '').strip()
+        }
+    except (KeyError, IndexError, ValueError, AttributeError) as e:
+        raise GeminiError(f'Unexpected Gemini response: {e}')
+
+
+def describe_image_bytes(image_bytes):
+    """
+    Describe an encoded image (PNG/JPEG/WEBP bytes)
+    Returns {'description', 'suggested_prompt', 'cached'}; raises GeminiError
+    """
+    key = hashlib.sha256(image_bytes).hexdigest()
+    cached = _cache_get(key)
+    if cached:
+        return dict(cached, cached=True)
+
+    url, params, body = _request(image_bytes)
+    try:
+        with metrics.upstream('gemini') as call:
+            response = get_session().post(url, params=params, data=body, timeout=GEMINI_TIMEOUT)
+            if response.status_code != 200:
+                call.outcome = 'error'
+    except requests.RequestException as e:
+        raise GeminiError(f'Gemini request failed: {e}')
+
+    result = _parse(response.status_code, response.text)
+    _cache_put(key, result)
+    return dict(result, cached=False)
+
+
+async def describe_image_bytes_async(client, image_bytes):
+    """describe_image_bytes on an httpx.AsyncClient (same cache, same errors)"""
+    import httpx
+
+    key = hashlib.sha256(image_bytes).hexdigest()
+    cached = _cache_get(key)
+    if cached:
+        return dict(cached, cached=True)
+
+    url, params, body = _request(image_bytes)
+    try:
+        with metrics.upstream('gemini') as call:
+            response = await client.post(url, params=params, content=body, timeout=GEMINI_TIMEOUT,
+                                         headers={'Content-Type': 'application/json'})
+            if response.status_code != 200:
+                call.outcome = 'error'
+    except httpx.HTTPError as e:
+        raise GeminiError(f'Gemini request failed: {e}')
+
+    result = _parse(response.status_code, response.text)
+    _cache_put(key, result)
+    return dict(result, cached=False)
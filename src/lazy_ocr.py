@@ -0,0 +1,270 @@
+"""
+Lazy text recognition for detection-only uploads
+An upload in lazy OCR mode only runs text detection (pipeline.detect_text)
+and returns the boxes at once. Each box is recognized later: right away
+when the editor asks for it (the user selected that text), otherwise by a
+background thread in the worker that took the upload, newest upload first
+and largest box first. The background thread steps aside while requests
+are running.
+
+Recognized boxes are published to a store shared by the workers (the
+upload folder) as <image>.ocr.json, so a progress poll is answered by any
+worker from there and never repeats detection. Only a request for specific
+boxes, in a worker without the session, detects the stored upload again
+(same boxes, same order, for the same image) and reads just those boxes.
+"""
+
+from collections import OrderedDict
+import threading
+import json
+import time
+import os
+
+import cpu_budget
+import metrics
+import pipeline
+
+MAX_SESSIONS = int(os.environ.get('LAZY_OCR_SESSIONS', 8))
+BACKGROUND_ENABLED = os.environ.get('LAZY_OCR_BACKGROUND', '1') == '1'
+# Longest the background thread defers to requests in flight before it runs anyway
+BACKGROUND_YIELD_SECONDS = 1.0
+
+BOXES_TOTAL = metrics.Counter(
+    'image_editor_lazy_ocr_boxes_total', 'Text boxes recognized after a detection-only upload',
+    ['trigger'])
+
+
+class _Session:
+    def __init__(self, detection, elements, background):
+        self.grey = detection['grey']
+        self.boxes = detection['boxes']
+        self.elements = {element['id']: element for element in elements}
+        self.results = {}  # box id -> {'id', 'text', 'confidence'}
+        self.running = set()  # box ids being recognized right now
+        self.background = background  # False: rebuilt here, only requested boxes are read
+        self.cond = threading.Condition()
+
+    def pending(self):
+        return [box_id for box_id in self.elements if box_id not in self.results]
+
+    def apply(self, result):
+        """Record a box's text (the caller holds cond)"""
+        self.results[result['id']] = result
+        element = self.elements[result['id']]
+        element.update(text=result['text'], confidence=result['confidence'])
+        element.pop('pending', None)
+        if not self.pending():
+            self.grey = None  # Everything read: drop the image
+
+
+class LazyRecognizer:
+    """Per-upload recognition of detected text boxes, on demand and in the background"""
+
+    def __init__(self, reader, load_image, store=None, max_sessions=MAX_SESSIONS, background=BACKGROUND_ENABLED):
+        # load_image(image_path) -> PIL image of a stored upload, or None
+        # store: storage shared by the workers (save_bytes / load_bytes) for the results
+        self.reader = reader
+        self.load_image = load_image
+        self.store = store
+        self.max_sessions = max_sessions
+        self.background = background
+        self.sessions = OrderedDict()  # image_path -> _Session (newest last)
+        self.lock = threading.Lock()
+        self.store_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.worker = None
+        self.worker_pid = None
+
+    def _ensure_worker(self):
+        """Start (or restart after a fork) the background thread"""
+        if self.worker is not None and self.worker.is_alive() and self.worker_pid == os.getpid():
+            return
+        self.worker_pid = os.getpid()
+        self.worker = threading.Thread(target=self._background_loop, name='lazy-ocr', daemon=True)
+        self.worker.start()
+
+    # ---------- shared results ----------
+
+    @staticmethod
+    def _state_name(image_path):
+        return f'{image_path}.ocr.json'
+
+    def _load_state(self, image_path):
+        """{'ids': [...], 'results': {box id: result}} published for the image, or None"""
+        if self.store is None:
+            return None
+        data = self.store.load_bytes(self._state_name(image_path))
+        if data is None:
+            return None
+        try:
+            state = json.loads(data)
+            return {'ids': state['ids'], 'results': {int(k): v for k, v in state['results'].items()}}
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    def _publish(self, image_path, session):
+        """Merge this session's results into the shared state"""
+        if self.store is None:
+            return
+        with session.cond:
+            ids = list(session.elements)
+            results = dict(session.results)
+        with self.store_lock:
+            state = self._load_state(image_path)
+            if state is not None:
+                results = {**state['results'], **results}
+            try:
+                self.store.save_bytes(json.dumps({'ids': ids, 'results': results}).encode(), self._state_name(image_path))
+            except OSError as e:
+                print(f"⚠️ Text recognition results not shared: {e}")
+
+    @staticmethod
+    def _answer(ids, results, wanted=None):
+        shown = wanted if wanted else list(results)
+        return {
+            'texts': [results[box_id] for box_id in shown if box_id in results],
+            'pending': [box_id for box_id in ids if box_id not in results]
+        }
+
+    # ---------- sessions ----------
+
+    def start(self, image_path, detection, elements, background=True):
+        """
+        Register an upload's detection; returns the session's text elements
+        (updated in place as boxes are recognized, e.g. for the OCR cache)
+        """
+        session = _Session(detection, [dict(element) for element in elements], background and self.background)
+        with self.lock:
+            self.sessions[image_path] = session
+            self.sessions.move_to_end(image_path)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        if background:
+            self._publish(image_path, session)
+        if session.background:
+            self._ensure_worker()
+            self.wakeup.set()
+        return list(session.elements.values())
+
+    def _rebuild(self, image_path, state):
+        """Session for an upload taken by another worker: detection again, known results reused"""
+        img = self.load_image(image_path)
+        if img is None:
+            return None
+        print(f"🔁 Rebuilding text detection for {image_path}")
+        elements, _, detection = pipeline.detect_text(self.reader, img)
+        if detection is None:
+            return None
+        self.start(image_path, detection, elements, background=False)
+        with self.lock:
+            session = self.sessions.get(image_path)
+        if session is not None and state is not None:
+            with session.cond:
+                for box_id, result in state['results'].items():
+                    if box_id in session.elements:
+                        session.apply(result)
+        return session
+
+    def _recognize(self, image_path, session, box_id, trigger):
+        """Recognize one box (the caller marked it running) and publish it"""
+        try:
+            results, _ = pipeline.recognize_boxes(self.reader, session.grey, [session.boxes[box_id - 1]])
+            text, confidence = (results[0][1].strip(), round(float(results[0][2]), 2)) if results else ('', 0.0)
+            BOXES_TOTAL.inc(trigger)
+        except Exception as e:
+            print(f"⚠️ Text recognition failed for box {box_id}: {e}")
+            text, confidence = '', 0.0
+
+        with session.cond:
+            session.apply({'id': box_id, 'text': text, 'confidence': confidence})
+            session.running.discard(box_id)
+            session.cond.notify_all()
+        self._publish(image_path, session)
+
+    def recognize(self, image_path, box_ids=None, timeout=30):
+        """
+        Text of the requested boxes (recognized now unless already done or
+        running in the background); without box_ids, whatever is done so far.
+        Returns {'texts': [...], 'pending': [box ids]} or None for an unknown image
+        """
+        with self.lock:
+            session = self.sessions.get(image_path)
+
+        if session is None:
+            state = self._load_state(image_path)
+            # A progress poll never rebuilds: it is answered from the shared results
+            if not box_ids:
+                return self._answer(state['ids'], state['results']) if state else None
+            if state is not None and all(box_id in state['results'] for box_id in box_ids):
+                return self._answer(state['ids'], state['results'], box_ids)
+            session = self._rebuild(image_path, state)
+            if session is None:
+                return None
+
+        wanted = [box_id for box_id in (box_ids or []) if box_id in session.elements]
+        for box_id in wanted:
+            with session.cond:
+                if box_id in session.results or box_id in session.running:
+                    continue
+                session.running.add(box_id)
+            self._recognize(image_path, session, box_id, 'request')
+
+        # Boxes the background thread was already working on
+        deadline = time.monotonic() + timeout
+        with session.cond:
+            while any(box_id not in session.results for box_id in wanted):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                session.cond.wait(remaining)
+            ids, results = list(session.elements), dict(session.results)
+
+        if not session.background:
+            # Rebuilt here: the worker that took the upload reads the other boxes
+            state = self._load_state(image_path)
+            if state is not None:
+                results = {**state['results'], **results}
+        return self._answer(ids, results, wanted if box_ids else None)
+
+    def _next_box(self):
+        """(image_path, session, box id) to recognize next: newest upload, largest box; marked running"""
+        with self.lock:
+            sessions = list(reversed(self.sessions.items()))
+        for image_path, session in sessions:
+            if not session.background:
+                continue
+            with session.cond:
+                for box_id in session.pending():
+                    if box_id not in session.running:
+                        session.running.add(box_id)
+                        return image_path, session, box_id
+        return None, None, None
+
+    def _background_loop(self):
+        token = metrics.current_endpoint.set('lazy_ocr')
+        try:
+            while True:
+                self.wakeup.wait(timeout=60)
+                self.wakeup.clear()
+
+                while True:
+                    # Requests in flight go first (up to BACKGROUND_YIELD_SECONDS)
+                    waited = 0.0
+                    while cpu_budget.budget.inflight and waited < BACKGROUND_YIELD_SECONDS:
+                        time.sleep(0.05)
+                        waited += 0.05
+
+                    image_path, session, box_id = self._next_box()
+                    if session is None:
+                        break
+                    self._recognize(image_path, session, box_id, 'background')
+        finally:
+            metrics.current_endpoint.reset(token)
+
+    def stats(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+        return {
+            'sessions': len(sessions),
+            'pending_boxes': sum(len(session.pending()) for session in sessions)
+        }
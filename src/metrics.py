@@ -0,0 +1,257 @@
+"""
+Latency and outcome metrics in the Prometheus text format
+Dependency-free histograms and counters: recording is one perf_counter()
+pair plus a locked bucket increment, so stages can be timed on every request.
+
+    with metrics.stage('inpaint'):
+        ...
+    with metrics.upstream('pollinations_image') as call:
+        response = requests.get(...)
+        call.outcome = 'ok' if response.status_code == 200 else 'error'
+
+The Flask endpoint serving the current request is attached to every stage
+(instrument_app); work on background threads is labelled 'background'.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+import bisect
+import os
+import time
+
+# Seconds; covers sub-millisecond encodes up to slow upstream calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+current_endpoint = ContextVar('current_endpoint', default='background')
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{_escape(v)}"' for n, v in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        _register(self)
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        for labels, value in items:
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    """Value that can go up and down (or is read from a callback at scrape time)"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        # callback() -> {label tuple: value}, evaluated on every scrape
+        self.callback = callback
+
+    def set(self, *labels, value):
+        with self.lock:
+            self.values[labels] = value
+
+    def samples(self):
+        if self.callback is not None:
+            values = self.callback()
+            with self.lock:
+                self.values = dict(values)
+        yield from super().samples()
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+        _register(self)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self.lock:
+            items = sorted((labels, list(series)) for labels, series in self.series.items())
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += count
+                yield (f'{self.name}_bucket',
+                       _format_labels(self.labelnames, labels, [('le', _format_value(bound))]),
+                       cumulative)
+            yield f'{self.name}_sum', _format_labels(self.labelnames, labels), round(series[-1], 6)
+            yield f'{self.name}_count', _format_labels(self.labelnames, labels), cumulative
+
+
+def _register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format (0.0.4)"""
+    lines = []
+    with _registry_lock:
+        metrics = list(_registry)
+    for metric in metrics:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, labels, value in metric.samples():
+            lines.append(f'{name}{labels} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+STAGE_SECONDS = Histogram(
+    'image_editor_stage_seconds', 'Time spent in one pipeline stage',
+    ['stage', 'endpoint', 'outcome'])
+UPSTREAM_SECONDS = Histogram(
+    'image_editor_upstream_seconds', 'Time spent in one call to an external service',
+    ['upstream', 'endpoint', 'outcome'])
+REQUEST_SECONDS = Histogram(
+    'image_editor_request_seconds', 'HTTP request latency',
+    ['endpoint', 'method', 'status'])
+REQUESTS_TOTAL = Counter(
+    'image_editor_requests_total', 'HTTP requests served',
+    ['endpoint', 'method', 'status'])
+
+
+def _process_memory():
+    """
+    Memory of this process from /proc/self/smaps_rollup (Linux only)
+    PSS splits pages shared with other workers between them, so
+    rss - pss shows how much the copy-on-write preload saves
+    """
+    fields = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if value.strip().endswith('kB'):
+                    fields[key] = int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        return {}
+    pid = str(os.getpid())
+    return {
+        (pid, 'rss'): fields.get('Rss', 0),
+        (pid, 'pss'): fields.get('Pss', 0),
+        (pid, 'shared'): fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0),
+        (pid, 'private'): fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+    }
+
+
+PROCESS_MEMORY = Gauge(
+    'image_editor_process_memory_bytes', 'Memory of the worker serving the scrape',
+    ['pid', 'kind'], callback=_process_memory)
+
+
+class _Call:
+    """Outcome holder for a timed block; set .outcome to override 'ok'"""
+
+    def __init__(self):
+        self.outcome = 'ok'
+
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage; an exception is recorded as outcome 'error' and re-raised"""
+    call = _Call()
+    started = time.perf_counter()
+    try:
+        yield call
+    except BaseException:
+        call.outcome = 'error'
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, name, current_endpoint.get(), call.outcome)
+
+
+@contextmanager
+def upstream(name):
+    """Time a call to an external service (same outcome rules as stage)"""
+    call = _Call()
+    started = time.perf_counter()
+    try:
+        yield call
+    except BaseException:
+        call.outcome = 'error'
+        raise
+    finally:
+        UPSTREAM_SECONDS.observe(time.perf_counter() - started, name, current_endpoint.get(), call.outcome)
+
+
+def instrument_app(app, path='/metrics'):
+    """Label stages with the serving endpoint, time every request and expose `path`"""
+    from flask import request, g, Response
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_token = current_endpoint.set(request.endpoint or 'unknown')
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            labels = (request.endpoint or 'unknown', request.method, str(response.status_code))
+            REQUEST_SECONDS.observe(time.perf_counter() - started, *labels)
+            REQUESTS_TOTAL.inc(*labels)
+        return response
+
+    @app.teardown_request
+    def _reset_endpoint(exc=None):
+        token = g.pop('metrics_token', None)
+        if token is not None:
+            current_endpoint.reset(token)
+
+    @app.route(path)
+    def metrics_endpoint():
+        return Response(render(), content_type=CONTENT_TYPE)
+
+    return app
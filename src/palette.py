@@ -0,0 +1,196 @@
+"""
+Color palette extraction with NumPy
+Dominant colors come from a quantized color histogram (np.bincount) that
+seeds a few k-means iterations on a bounded pixel sample, so any image
+size runs in bounded time and near-identical shades are merged.
+Also used for text color suggestions.
+"""
+
+from PIL import Image
+import numpy as np
+
+# Pixels considered per image (larger images are reduced first)
+MAX_SAMPLE_PIXELS = 65536
+# Bits kept per channel for the histogram (4 -> 16 levels, 4096 bins)
+HISTOGRAM_BITS = 4
+# Seeds closer than this (RGB distance) are treated as the same color
+MIN_SEED_DISTANCE = 40
+
+
+def hex_color(rgb):
+    """(r, g, b) -> '#rrggbb'"""
+    r, g, b = (int(round(c)) for c in rgb[:3])
+    return f'#{r:02x}{g:02x}{b:02x}'
+
+
+def sample_pixels(img, max_pixels=MAX_SAMPLE_PIXELS):
+    """
+    Return an (N, 3) uint8 array of at most ~max_pixels RGB pixels
+    Big images are subsampled with a NEAREST resize (fast, in C, and unlike
+    averaging it keeps real colors); fully transparent pixels are dropped.
+    """
+    width, height = img.size
+    factor = int(np.ceil(np.sqrt(width * height / max_pixels)))
+    if factor > 1:
+        if img.format == 'JPEG':
+            # Let the JPEG decoder scale down while decoding (must precede load)
+            img.draft('RGB', (width // factor, height // factor))
+            width, height = img.size
+            factor = max(1, int(np.ceil(np.sqrt(width * height / max_pixels))))
+        img = img.resize((max(1, width // factor), max(1, height // factor)), Image.NEAREST)
+
+    if img.mode == 'RGBA' or (img.mode == 'P' and 'transparency' in img.info):
+        arr = np.asarray(img.convert('RGBA')).reshape(-1, 4)
+        arr = arr[arr[:, 3] >= 128]
+        return arr[:, :3]
+
+    return np.asarray(img.convert('RGB')).reshape(-1, 3)
+
+
+def _histogram_seeds(pixels, k, bits=HISTOGRAM_BITS):
+    """Mean color of the most populated histogram bins, skipping near-duplicates"""
+    shift = 8 - bits
+    q = (pixels >> shift).astype(np.int64)
+    bins = (q[:, 0] << (2 * bits)) | (q[:, 1] << bits) | q[:, 2]
+
+    n_bins = 1 << (3 * bits)
+    counts = np.bincount(bins, minlength=n_bins)
+    sums = np.stack([np.bincount(bins, weights=pixels[:, c], minlength=n_bins) for c in range(3)], axis=1)
+
+    order = np.argsort(counts)[::-1]
+    order = order[counts[order] > 0][:k * 8]
+    means = sums[order] / counts[order][:, None]
+
+    seeds = []
+    for color in means:
+        if all(np.linalg.norm(color - s) >= MIN_SEED_DISTANCE for s in seeds):
+            seeds.append(color)
+            if len(seeds) == k:
+                break
+    return np.array(seeds, dtype=np.float64)
+
+
+def _kmeans(pixels, centers, iterations):
+    """A few Lloyd iterations; returns (centers, labels)"""
+    data = pixels.astype(np.float64)
+    labels = np.zeros(len(data), dtype=np.int64)
+    for _ in range(iterations):
+        distances = ((data[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        labels = distances.argmin(axis=1)
+        counts = np.bincount(labels, minlength=len(centers))
+        for c in range(3):
+            sums = np.bincount(labels, weights=data[:, c], minlength=len(centers))
+            centers[:, c] = np.where(counts > 0, sums / np.maximum(counts, 1), centers[:, c])
+    return centers, labels
+
+
+def dominant_colors(img, k=5, iterations=3, max_pixels=MAX_SAMPLE_PIXELS):
+    """
+    Extract up to k dominant colors from a PIL image
+    Returns [{'hex', 'rgb', 'proportion'}] sorted by proportion (largest first)
+    """
+    pixels = sample_pixels(img, max_pixels)
+    if len(pixels) == 0:
+        return []
+
+    centers = _histogram_seeds(pixels, k)
+    if iterations > 0:
+        centers, labels = _kmeans(pixels, centers, iterations)
+    else:
+        distances = ((pixels[:, None, :].astype(np.float64) - centers[None, :, :]) ** 2).sum(axis=2)
+        labels = distances.argmin(axis=1)
+
+    counts = np.bincount(labels, minlength=len(centers))
+    palette = []
+    for idx in np.argsort(counts)[::-1]:
+        if counts[idx] == 0:
+            continue
+        rgb = tuple(int(round(c)) for c in centers[idx])
+        palette.append({
+            'hex': hex_color(rgb),
+            'rgb': list(rgb),
+            'proportion': round(float(counts[idx]) / len(pixels), 4)
+        })
+    return palette
+
+
+def relative_luminance(rgb):
+    """WCAG relative luminance of an sRGB color (0 = black, 1 = white)"""
+    channels = np.asarray(rgb[:3], dtype=np.float64) / 255.0
+    linear = np.where(channels <= 0.03928, channels / 12.92, ((channels + 0.055) / 1.055) ** 2.4)
+    return float(0.2126 * linear[0] + 0.7152 * linear[1] + 0.0722 * linear[2])
+
+
+def suggest_text_color(background_rgb):
+    """Black or white, whichever contrasts more with the background"""
+    return '#000000' if relative_luminance(background_rgb) > 0.179 else '#ffffff'
+
+
+def box_extents(boxes):
+    """
+    Bounding rectangles of OCR quadrilaterals, all at once
+    boxes: (N, 4, 2) array-like of corner points -> (x_min, y_min, x_max, y_max) arrays
+    """
+    points = np.asarray(boxes, dtype=np.float64).reshape(-1, 4, 2)
+    mins = points.min(axis=1)
+    maxs = points.max(axis=1)
+    return mins[:, 0], mins[:, 1], maxs[:, 0], maxs[:, 1]
+
+
+def estimate_box_colors(img_array, boxes, grid=16, iterations=4):
+    """
+    Estimate (text color, background color) for every OCR box in one vectorized pass
+
+    Each box is sampled on a grid x grid lattice (one fancy-indexing gather for
+    all boxes), then split into two luminance clusters per box; the larger
+    cluster is the background, the smaller one the text strokes.
+    Returns a list of (text_hex, background_hex) in box order.
+    """
+    arr = np.asarray(img_array)
+    if arr.ndim == 2:
+        arr = np.stack([arr] * 3, axis=-1)
+    arr = arr[..., :3]
+    if len(boxes) == 0:
+        return []
+
+    height, width = arr.shape[:2]
+    x_min, y_min, x_max, y_max = box_extents(boxes)
+
+    # Sample points at cell centers: (N, grid) coordinates per axis
+    steps = (np.arange(grid) + 0.5) / grid
+    xs = np.clip(x_min[:, None] + steps[None, :] * (x_max - x_min)[:, None], 0, width - 1).astype(np.int64)
+    ys = np.clip(y_min[:, None] + steps[None, :] * (y_max - y_min)[:, None], 0, height - 1).astype(np.int64)
+
+    samples = arr[ys[:, :, None], xs[:, None, :]].reshape(len(xs), grid * grid, 3).astype(np.float64)
+    luminance = samples @ np.array([0.299, 0.587, 0.114])
+
+    # Two-cluster split on luminance (iterative mid-point threshold)
+    threshold = luminance.mean(axis=1, keepdims=True)
+    for _ in range(iterations):
+        bright = luminance > threshold
+        n_bright = bright.sum(axis=1, keepdims=True)
+        n_dark = bright.shape[1] - n_bright
+        mean_bright = np.where(n_bright > 0, (luminance * bright).sum(axis=1, keepdims=True) / np.maximum(n_bright, 1), threshold)
+        mean_dark = np.where(n_dark > 0, (luminance * ~bright).sum(axis=1, keepdims=True) / np.maximum(n_dark, 1), threshold)
+        threshold = (mean_bright + mean_dark) / 2
+
+    bright = luminance > threshold
+    n_bright = bright.sum(axis=1)
+    n_dark = bright.shape[1] - n_bright
+    color_bright = (samples * bright[:, :, None]).sum(axis=1) / np.maximum(n_bright, 1)[:, None]
+    color_dark = (samples * ~bright[:, :, None]).sum(axis=1) / np.maximum(n_dark, 1)[:, None]
+
+    # Background = majority cluster
+    bright_is_background = n_bright >= n_dark
+    background = np.where(bright_is_background[:, None], color_bright, color_dark)
+    text = np.where(bright_is_background[:, None], color_dark, color_bright)
+
+    # Flat boxes (no real second cluster): pick a readable color instead
+    flat = (n_bright == 0) | (n_dark == 0) | (np.abs(color_bright - color_dark).max(axis=1) < 24)
+
+    results = []
+    for i in range(len(xs)):
+        bg_hex = hex_color(background[i])
+        text_hex = suggest_text_color(background[i]) if flat[i] else hex_color(text[i])
+        results.append((text_hex, bg_hex))
+    return results
@@ -0,0 +1,570 @@
+"""
+Image processing pipeline shared by app_free.py and api/index.py
+Stages: OCR results -> editable text elements, text removal (inpainting),
+AI background (Pollinations.ai) or effect preset, text overlay.
+Heavy dependencies (numpy, OpenCV, requests) are imported by the stages
+that need them so the serverless entry point keeps a light cold start.
+"""
+
+from PIL import Image, ImageEnhance
+from datetime import datetime
+import urllib.parse
+import time
+import io
+import os
+
+from rendering import EFFECT_PRESETS, DEFAULT_PRESETS, apply_effect, draw_text_elements, encode_png_base64
+import single_flight
+import rate_limit
+import cpu_budget
+import metrics
+
+# OCR boxes below this confidence are dropped (server and serverless alike)
+OCR_MIN_CONFIDENCE = 0.2
+# Seconds an upload may spend on OCR, a soft ceiling (0, the default: no
+# limit, the image is read in one batched readtext call). Once spent, the
+# text boxes not yet recognized are left out and the result is flagged partial
+OCR_TIME_BUDGET = float(os.environ.get('OCR_TIME_BUDGET', 0))
+
+OCR_RESULTS_TOTAL = metrics.Counter(
+    'image_editor_ocr_results_total', 'OCR runs with a time budget, complete or partial',
+    ['outcome'])
+
+# Overridable to point at a local stand-in (tests/fake_upstreams.py)
+POLLINATIONS_API = os.environ.get('POLLINATIONS_API', "https://image.pollinations.ai/prompt/")
+POLLINATIONS_TIMEOUT = 120
+# Identical prompts requested at the same time are downloaded once
+background_downloads = single_flight.group('pollinations_image')
+
+# Style variants generated for an AI background prompt (order = variation order)
+AI_BACKGROUND_STYLES = [
+    ('Modern', 'Modern professional style', ', modern professional design, high quality, 4k, detailed'),
+    ('Vibrant', 'Vibrant colorful style', ', vibrant colorful artistic design, beautiful, high quality'),
+    ('Minimalist', 'Minimalist clean style', ', minimalist clean elegant design, simple, high quality'),
+]
+
+
+def timestamped_name(prefix, index=None):
+    """'<prefix>_<timestamp>[_<index>].png' - the naming used for uploads and variations"""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    suffix = f'_{index}' if index is not None else ''
+    return f'{prefix}_{timestamp}{suffix}.png'
+
+
+def placeholder_text(img):
+    """ONE editable placeholder in the middle of the image (no text found)"""
+    width, height = img.size if img else (800, 600)
+    return [{
+        'id': 1,
+        'text': 'Click to Add Text',
+        'position': {'x': int(width * 0.5), 'y': int(height * 0.5)},
+        'font': 'Arial',
+        'size': 60,
+        'color': '#ffffff',
+        'weight': 'bold',
+        'isPlaceholder': True
+    }]
+
+
+@metrics.stage('ocr_postprocess')
+def ocr_text_elements(img_array, results, min_confidence=OCR_MIN_CONFIDENCE, pending=False):
+    """
+    Turn EasyOCR results [(bbox, text, confidence)] into editable text elements
+    All boxes are processed as arrays at once; returns (text_elements, kept_boxes).
+    pending: detection only - elements keep empty text until recognized
+    """
+    import numpy as np
+    import palette
+
+    confidences = np.array([result[2] for result in results], dtype=np.float64)
+    keep = np.flatnonzero(confidences >= min_confidence)
+    for idx in np.flatnonzero(confidences < min_confidence):
+        print(f"⏭️ Skipping low confidence text: '{results[idx][1]}' ({confidences[idx]:.2f})")
+
+    boxes = np.array([results[idx][0] for idx in keep], dtype=np.float64).reshape(-1, 4, 2)
+    x_min, y_min, x_max, y_max = palette.box_extents(boxes)
+    xs = x_min.astype(int)
+    ys = y_min.astype(int)
+    widths = (x_max - x_min).astype(int)
+    heights = (y_max - y_min).astype(int)
+    # Estimate font size based on height
+    font_sizes = np.clip((heights * 0.9).astype(int), 20, 72)
+    # Text and background color per box from pixel statistics
+    box_colors = palette.estimate_box_colors(img_array, boxes)
+
+    detected_texts = []
+    for i, idx in enumerate(keep):
+        text = results[idx][1]
+        if not text.strip() and not pending:
+            continue
+        x, y, width, height = int(xs[i]), int(ys[i]), int(widths[i]), int(heights[i])
+        font_size = int(font_sizes[i])
+        text_color, background_color = box_colors[i]
+
+        detected_texts.append({
+            'id': int(idx) + 1,
+            'text': text.strip(),
+            'position': {'x': x, 'y': y + height},  # y + height for baseline position
+            'font': 'Arial',
+            'size': font_size,
+            'color': text_color,
+            'background_color': background_color,
+            'weight': 'bold' if font_size > 40 else 'normal',
+            'confidence': None if pending else round(float(confidences[idx]), 2),
+            'bbox': {'x': x, 'y': y, 'width': width, 'height': height}
+        })
+        if pending:
+            detected_texts[-1]['pending'] = True
+            continue
+
+        print(f"✅ Detected: '{text}' at ({x},{y}) size:{font_size}px conf:{confidences[idx]:.2f} color:{text_color}")
+
+    return detected_texts, boxes
+
+
+@metrics.stage('inpaint')
+def remove_text_from_image(img, text_bboxes):
+    """
+    Remove detected text from image by filling with surrounding colors (inpainting)
+    Returns clean image with text areas filled (the original if OpenCV is unavailable)
+    """
+    try:
+        import numpy as np
+        import cv2
+        import palette
+
+        # Convert PIL to OpenCV format
+        img_cv = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
+
+        # Create mask for text areas
+        mask = np.zeros(img_cv.shape[:2], dtype=np.uint8)
+
+        # bbox is [[x1,y1], [x2,y2], [x3,y3], [x4,y4]] - bounding rectangles of all boxes at once,
+        # expanded slightly to ensure all text is covered
+        if len(text_bboxes) > 0:
+            x_min, y_min, x_max, y_max = palette.box_extents(text_bboxes)
+            x_min = np.maximum(0, x_min.astype(np.int32) - 3)
+            y_min = np.maximum(0, y_min.astype(np.int32) - 3)
+            x_max = np.minimum(img_cv.shape[1], x_max.astype(np.int32) + 3)
+            y_max = np.minimum(img_cv.shape[0], y_max.astype(np.int32) + 3)
+
+            for x0, y0, x1, y1 in zip(x_min, y_min, x_max, y_max):
+                # Fill this area in the mask
+                mask[y0:y1 + 1, x0:x1 + 1] = 255
+
+        # Use inpainting to fill the text areas
+        with cpu_budget.budget.limit('opencv'):
+            inpainted = cv2.inpaint(img_cv, mask, inpaintRadius=7, flags=cv2.INPAINT_TELEA)
+
+        # Convert back to PIL
+        clean_img = Image.fromarray(cv2.cvtColor(inpainted, cv2.COLOR_BGR2RGB))
+
+        print(f"✅ Removed {len(text_bboxes)} text areas from image")
+        return clean_img
+
+    except Exception as e:
+        print(f"⚠️ Text removal failed: {e}, returning original image")
+        return img
+
+
+def box_area(kind, box):
+    """Area of a detected box: 'horizontal' [x_min, x_max, y_min, y_max] or 'free' (4 corner points)"""
+    if kind == 'horizontal':
+        x_min, x_max, y_min, y_max = box
+        return (x_max - x_min) * (y_max - y_min)
+    xs = [point[0] for point in box]
+    ys = [point[1] for point in box]
+    return (max(xs) - min(xs)) * (max(ys) - min(ys))
+
+
+def detect_text_boxes(reader, img_array):
+    """
+    EasyOCR text detection only
+    Returns (grayscale image for recognition, [(kind, box)] largest first)
+    """
+    from easyocr.utils import reformat_input
+
+    img_cv, img_cv_grey = reformat_input(img_array)
+    with metrics.stage('ocr_detect'), cpu_budget.budget.limit('torch'):
+        horizontal_list, free_list = reader.detect(img_cv, reformat=False)
+    boxes = [('horizontal', box) for box in horizontal_list[0]] + [('free', box) for box in free_list[0]]
+    boxes.sort(key=lambda item: box_area(*item), reverse=True)
+    return img_cv_grey, boxes
+
+
+def box_polygon(kind, box):
+    """Four corner points of a detected box (EasyOCR's result bbox format)"""
+    if kind == 'horizontal':
+        x_min, x_max, y_min, y_max = box
+        return [[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]]
+    return [list(point) for point in box]
+
+
+def recognize_boxes(reader, img_cv_grey, boxes, deadline=None):
+    """
+    Recognize `boxes` in order until `deadline` (time.monotonic())
+    No box is started after the deadline, and the next box only when the
+    time per box so far says it will finish in time (a box already running
+    is not interrupted). Returns (EasyOCR results [(bbox, text, confidence)],
+    number of boxes recognized)
+    """
+    results = []
+    started = time.monotonic()
+    with metrics.stage('ocr_recognize'), cpu_budget.budget.limit('torch'):
+        for done, (kind, box) in enumerate(boxes):
+            if deadline is not None:
+                per_box = (time.monotonic() - started) / done if done else 0
+                if time.monotonic() + per_box >= deadline:
+                    return results, done
+            results += reader.recognize(
+                img_cv_grey,
+                horizontal_list=[box] if kind == 'horizontal' else [],
+                free_list=[box] if kind == 'free' else [],
+                detail=1, paragraph=False, reformat=False)
+    return results, len(boxes)
+
+
+def read_text(reader, img_array, time_budget=None):
+    """
+    EasyOCR results [(bbox, text, confidence)] plus an OCR report
+    With a time_budget (seconds), detection runs first and boxes are
+    recognized largest first until the budget is spent (report['partial']).
+    The budget is a soft ceiling: detection is not bounded, and a box being
+    recognized when it runs out finishes. A budget already spent (e.g. by
+    time queued) skips OCR altogether
+    """
+    if time_budget is None or not hasattr(reader, 'detect'):
+        with metrics.stage('ocr'), cpu_budget.budget.limit('torch'):
+            results = reader.readtext(img_array, paragraph=False)
+        return results, {'partial': False, 'boxes_detected': len(results), 'boxes_recognized': len(results)}
+
+    if time_budget <= 0:
+        OCR_RESULTS_TOTAL.inc('partial')
+        print("⏱️ OCR budget spent before OCR started: no text read")
+        return [], {'partial': True, 'boxes_detected': 0, 'boxes_recognized': 0}
+
+    deadline = time.monotonic() + time_budget
+    img_cv_grey, boxes = detect_text_boxes(reader, img_array)
+    results, recognized = recognize_boxes(reader, img_cv_grey, boxes, deadline)
+    partial = recognized < len(boxes)
+    OCR_RESULTS_TOTAL.inc('partial' if partial else 'complete')
+    if partial:
+        print(f"⏱️ OCR budget of {time_budget:.1f}s spent: recognized {recognized} of {len(boxes)} text boxes")
+    # Back to reading order (top to bottom, left to right) like readtext
+    results.sort(key=lambda result: (min(p[1] for p in result[0]), min(p[0] for p in result[0])))
+    return results, {'partial': partial, 'boxes_detected': len(boxes), 'boxes_recognized': recognized}
+
+
+def ocr_budget_left(request_started=None):
+    """
+    Seconds of OCR_TIME_BUDGET left for a request that started at
+    `request_started` (time.perf_counter(); time spent queued counts),
+    None when OCR time is not limited
+    """
+    if OCR_TIME_BUDGET <= 0:
+        return None
+    if request_started is None:
+        return OCR_TIME_BUDGET
+    return OCR_TIME_BUDGET - (time.perf_counter() - request_started)
+
+
+def extract_text(reader, img, time_budget=None):
+    """
+    Full OCR stage: detect text, build text elements, remove the text from the image
+    Returns (text_elements, clean_image); see run_ocr for time_budget
+    """
+    detected_texts, clean_img, _ = run_ocr(reader, img, time_budget)
+    return detected_texts, clean_img
+
+
+def run_ocr(reader, img, time_budget=None):
+    """
+    extract_text plus the OCR report {'partial', 'boxes_detected', 'boxes_recognized'}
+    Returns (text_elements, clean_image, report); a placeholder and the
+    original image when nothing usable is found or OCR fails. With a
+    time_budget only the recognized boxes are returned and removed
+    """
+    report = {'partial': False, 'boxes_detected': 0, 'boxes_recognized': 0}
+    try:
+        import numpy as np
+
+        print("🔍 Running OCR on image...")
+        img_array = np.array(img)
+
+        try:
+            results, report = read_text(reader, img_array, time_budget)
+            print(f"🔍 OCR found {len(results)} text elements")
+        except Exception as ocr_error:
+            print(f"⚠️ OCR processing error: {ocr_error}")
+            results = []
+
+        if not results:
+            print("ℹ️ No text detected - returning editable placeholder")
+            return placeholder_text(img), img, report
+
+        detected_texts, boxes = ocr_text_elements(img_array, results)
+        if not detected_texts:
+            print("ℹ️ No high-confidence text - returning editable placeholder")
+            return placeholder_text(img), img, report
+
+        print(f"✅ Returning {len(detected_texts)} detected text elements")
+        # Remove only the boxes that passed the confidence check, so the
+        # edited text is not drawn over the old one
+        return detected_texts, remove_text_from_image(img, boxes), report
+
+    except Exception as e:
+        print(f"❌ OCR Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return placeholder_text(img), img, report
+
+
+def detect_text(reader, img):
+    """
+    Detection-only OCR stage (text is recognized later, see lazy_ocr.py)
+    Returns (text_elements, clean_image, detection): elements have position,
+    size and colors but empty text ('pending'), ids follow the boxes
+    largest first, every detected box is removed from the clean image, and
+    detection = {'grey', 'boxes'} is what recognize_boxes needs later.
+    A placeholder, the original image and None when nothing is found
+    """
+    try:
+        import numpy as np
+
+        print("🔍 Detecting text regions...")
+        img_array = np.array(img)
+        img_cv_grey, boxes = detect_text_boxes(reader, img_array)
+        print(f"🔍 Found {len(boxes)} text regions")
+        if not boxes:
+            return placeholder_text(img), img, None
+
+        results = [(box_polygon(kind, box), '', 1.0) for kind, box in boxes]
+        detected_texts, polygons = ocr_text_elements(img_array, results, pending=True)
+        return detected_texts, remove_text_from_image(img, polygons), {'grey': img_cv_grey, 'boxes': boxes}
+
+    except Exception as e:
+        print(f"❌ Text detection error: {e}")
+        return placeholder_text(img), img, None
+
+
+def variation_specs(style_prompt):
+    """
+    The three variations to render: AI backgrounds when a style prompt is
+    given, the effect presets otherwise
+    """
+    if style_prompt and len(style_prompt) > 3:
+        return [
+            {
+                'name': f'{style_prompt} - {style}',
+                'description': f'{description} with {style_prompt} background',
+                'prompt_suffix': suffix,
+                'preset': None
+            }
+            for style, description, suffix in AI_BACKGROUND_STYLES
+        ]
+
+    return [
+        {
+            'name': EFFECT_PRESETS[preset]['name'],
+            'description': EFFECT_PRESETS[preset]['description'],
+            'prompt_suffix': None,
+            'preset': preset
+        }
+        for preset in DEFAULT_PRESETS
+    ]
+
+
+def background_prompt(style_prompt, prompt_suffix, texts):
+    """Pollinations prompt for one AI background variation"""
+    text_content = ', '.join([t['text'] for t in texts if t.get('text')]) if texts else ''
+    full_prompt = style_prompt + prompt_suffix
+    if text_content:
+        full_prompt += f", with text overlay: {text_content}"
+    return full_prompt
+
+
+def pollinations_url(prompt):
+    encoded_prompt = urllib.parse.quote(prompt)
+    return f"{POLLINATIONS_API}{encoded_prompt}?width=1024&height=1024&model=flux&nologo=true&enhance=true"
+
+
+def is_image_response(status_code, headers):
+    return status_code == 200 and headers.get('content-type', '').startswith('image')
+
+
+def background_from_bytes(content, size):
+    """Decode a downloaded background and fit it to `size`"""
+    with metrics.stage('decode'):
+        ai_img = Image.open(io.BytesIO(content))
+        ai_img.load()
+    if ai_img.mode != 'RGB':
+        with metrics.stage('rgb_convert'):
+            ai_img = ai_img.convert('RGB')
+    with metrics.stage('resize'):
+        return ai_img.resize(size, Image.Resampling.LANCZOS)
+
+
+def effect_fallback(base_img):
+    """Stand-in background when the AI service fails"""
+    return ImageEnhance.Color(base_img.copy()).enhance(1.3)
+
+
+def throttled(bucket, status_code, headers):
+    """Pause `bucket` when the upstream answered 429/503 (True if it did)"""
+    if status_code not in (429, 503):
+        return False
+    bucket.pause(rate_limit.retry_after(headers, 10))
+    return True
+
+
+def download_background(url):
+    """Encoded image from Pollinations.ai, or None when the service fails"""
+    import requests
+
+    bucket = rate_limit.bucket('pollinations_image')
+    if not bucket.acquire():
+        print("   ⏳ Pollinations rate limit reached")
+        return None
+    try:
+        with metrics.upstream('pollinations_image') as call:
+            response = requests.get(url, timeout=POLLINATIONS_TIMEOUT)
+            if not is_image_response(response.status_code, response.headers):
+                call.outcome = 'error'
+    except requests.RequestException as e:
+        print(f"   ⚠️ AI request failed: {e}")
+        return None
+
+    throttled(bucket, response.status_code, response.headers)
+    return response.content if call.outcome == 'ok' else None
+
+
+async def download_background_async(client, url):
+    """download_background awaited on `client` (httpx.AsyncClient)"""
+    import httpx
+
+    bucket = rate_limit.bucket('pollinations_image')
+    if not await bucket.acquire_async():
+        print("   ⏳ Pollinations rate limit reached")
+        return None
+    try:
+        with metrics.upstream('pollinations_image') as call:
+            response = await client.get(url, timeout=POLLINATIONS_TIMEOUT)
+            if not is_image_response(response.status_code, response.headers):
+                call.outcome = 'error'
+    except httpx.HTTPError as e:
+        print(f"   ⚠️ AI request failed: {e}")
+        return None
+
+    throttled(bucket, response.status_code, response.headers)
+    return response.content if call.outcome == 'ok' else None
+
+
+def fetch_ai_background(prompt, size):
+    """
+    Generate a background with Pollinations.ai (free, no key), resized to `size`
+    Returns None when the service fails. Concurrent requests for the same
+    prompt share one download
+    """
+    print(f"   🌐 AI Request: {prompt[:80]}...")
+    url = pollinations_url(prompt)
+    content = background_downloads.do(url, download_background, url)
+    if content is None:
+        return None
+    return background_from_bytes(content, size)
+
+
+async def fetch_ai_background_async(client, prompt, size, run_cpu):
+    """
+    fetch_ai_background for the ASGI app: the download is awaited on
+    `client` (httpx.AsyncClient), decoding runs through `run_cpu`
+    """
+    print(f"   🌐 AI Request: {prompt[:80]}...")
+    url = pollinations_url(prompt)
+    content = await background_downloads.do_async(url, download_background_async, client, url)
+    if content is None:
+        return None
+    return await run_cpu(background_from_bytes, content, size)
+
+
+def render_variation(base_img, spec, texts, style_prompt=''):
+    """Styled background (AI or effect preset) with the edited text drawn on top"""
+    if spec['prompt_suffix']:
+        variation_img = fetch_ai_background(background_prompt(style_prompt, spec['prompt_suffix'], texts), base_img.size)
+        if variation_img is not None:
+            print(f"   ✅ AI background generated successfully")
+        else:
+            print(f"   ⚠️ AI failed, using effect fallback")
+            variation_img = effect_fallback(base_img)
+    else:
+        variation_img = apply_effect(base_img, spec['preset'])
+
+    return draw_text_elements(variation_img, texts)
+
+
+def variation_result(index, spec, variation_img, storage=None):
+    """Response entry for one finished variation (saved to `storage` when given)"""
+    variation = {
+        'id': index + 1,
+        'image_data': encode_png_base64(variation_img),
+        'description': spec['description'],
+        'effect': spec['name']
+    }
+    if storage is not None:
+        variation['filename'] = storage.save_image(variation_img, timestamped_name('variation', index + 1))
+    print(f"✅ Variation {index+1} '{spec['name']}' created!")
+    return variation
+
+
+def variation_error(index, spec, error):
+    print(f"❌ Error creating variation {index+1}: {error}")
+    return {
+        'id': index + 1,
+        'error': f'Error: {str(error)}',
+        'effect': spec['name']
+    }
+
+
+def generate_variations(base_img, texts, style_prompt='', storage=None):
+    """
+    Render all variations for the editor
+    Each result is saved to `storage` when given (its name returned as
+    'filename'); a failed variation is reported in place instead of raising
+    """
+    variations = []
+    for i, spec in enumerate(variation_specs(style_prompt)):
+        try:
+            print(f"🎨 Creating variation {i+1}: {spec['name']}...")
+            variation_img = render_variation(base_img, spec, texts, style_prompt)
+            variations.append(variation_result(i, spec, variation_img, storage))
+        except Exception as e:
+            variations.append(variation_error(i, spec, e))
+
+    return variations
+
+
+async def generate_variations_async(client, base_img, texts, style_prompt='', storage=None, run_cpu=None):
+    """
+    generate_variations for the ASGI app: all AI backgrounds are requested
+    at once on `client` and awaited together; decoding, effects, text and
+    encoding run through `run_cpu(fn, *args)` (an executor) so the event
+    loop only ever waits
+    """
+    import asyncio
+
+    async def render(i, spec):
+        print(f"🎨 Creating variation {i+1}: {spec['name']}...")
+        if spec['prompt_suffix']:
+            prompt = background_prompt(style_prompt, spec['prompt_suffix'], texts)
+            variation_img = await fetch_ai_background_async(client, prompt, base_img.size, run_cpu)
+            if variation_img is None:
+                print(f"   ⚠️ AI failed, using effect fallback")
+                variation_img = await run_cpu(effect_fallback, base_img)
+        else:
+            variation_img = await run_cpu(apply_effect, base_img, spec['preset'])
+        variation_img = await run_cpu(draw_text_elements, variation_img, texts)
+        return await run_cpu(variation_result, i, spec, variation_img, storage)
+
+    specs = variation_specs(style_prompt)
+    results = await asyncio.gather(*(render(i, spec) for i, spec in enumerate(specs)), return_exceptions=True)
+    return [variation_error(i, spec, result) if isinstance(result, Exception) else result
+            for i, (spec, result) in enumerate(zip(specs, results))]
@@ -0,0 +1,222 @@
+"""
+On-demand request profiling
+A request is profiled when it carries the admin header
+(X-Profile: <PROFILE_ADMIN_TOKEN>) or is picked by PROFILE_SAMPLE_RATE.
+A sampler thread records the request thread's Python stack every few
+milliseconds; the result is written to PROFILE_DIR as collapsed stacks
+(flamegraph.pl / speedscope) and speedscope JSON, and listed at
+GET /api/admin/profiles (same admin header).
+
+With no token and a zero sample rate the wrapped routes are called directly.
+"""
+
+from datetime import datetime
+from functools import wraps
+import threading
+import random
+import hmac
+import json
+import time
+import uuid
+import sys
+import os
+
+
+def _default_profile_dir():
+    """<project>/profiles, or the temp dir where the project is read-only (Vercel)"""
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = os.path.join(project_dir, 'profiles')
+    if os.access(path if os.path.isdir(path) else project_dir, os.W_OK):
+        return path
+    import tempfile
+    return os.path.join(tempfile.gettempdir(), 'image_editor_profiles')
+
+
+PROFILE_ADMIN_TOKEN = os.environ.get('PROFILE_ADMIN_TOKEN', '')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', 5)) / 1000
+PROFILE_DIR = os.environ.get('PROFILE_DIR') or _default_profile_dir()
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 200))
+PROFILE_HEADER = 'X-Profile'
+
+
+def enabled():
+    return bool(PROFILE_ADMIN_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+
+def is_admin(headers):
+    token = headers.get(PROFILE_HEADER, '')
+    return bool(PROFILE_ADMIN_TOKEN) and hmac.compare_digest(token.encode(), PROFILE_ADMIN_TOKEN.encode())
+
+
+def should_profile(headers):
+    return is_admin(headers) or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE)
+
+
+class StackSampler:
+    """Samples one thread's stack on a timer thread (the profiled code is not traced)"""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}  # tuple of frames (root first) -> sample count
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.duration = time.perf_counter() - self.started
+        return self
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                key = tuple(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def collapsed(self):
+        """Brendan Gregg's collapsed-stack format: 'root;...;leaf count' per line"""
+        lines = []
+        for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1]):
+            names = [f"{name} ({os.path.basename(filename)}:{line})" for name, filename, line in stack]
+            lines.append(';'.join(names) + f' {count}')
+        return '\n'.join(lines) + '\n'
+
+    def speedscope(self, name):
+        """speedscope 'sampled' profile (https://www.speedscope.app/file-format-schema.json)"""
+        frames, index = [], {}
+        samples, weights = [], []
+        interval_ms = self.interval * 1000
+        for stack, count in self.stacks.items():
+            sample = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]})
+                sample.append(index[frame])
+            samples.append(sample)
+            weights.append(round(count * interval_ms, 3))
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'image_editor profiling',
+            'activeProfileIndex': 0,
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'milliseconds',
+                'startValue': 0,
+                'endValue': round(self.duration * 1000, 3),
+                'samples': samples,
+                'weights': weights
+            }]
+        }
+
+
+def write_profile(sampler, endpoint):
+    """Write both artifacts; returns the profile id"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{endpoint}_{uuid.uuid4().hex[:6]}"
+    base = os.path.join(PROFILE_DIR, profile_id)
+
+    with open(base + '.collapsed', 'w') as f:
+        f.write(sampler.collapsed())
+    with open(base + '.speedscope.json', 'w') as f:
+        json.dump(sampler.speedscope(f'{endpoint} {profile_id}'), f)
+
+    _prune()
+    return profile_id
+
+
+def _prune():
+    """Keep only the newest PROFILE_KEEP profiles"""
+    ids = sorted({name.split('.')[0] for name in os.listdir(PROFILE_DIR)})
+    for old in ids[:max(0, len(ids) - PROFILE_KEEP)]:
+        for suffix in ('.collapsed', '.speedscope.json'):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, old + suffix))
+            except OSError:
+                pass
+
+
+def list_profiles():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = {}
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        profile_id, _, kind = name.partition('.')
+        entry = profiles.setdefault(profile_id, {'id': profile_id, 'files': {}})
+        path = os.path.join(PROFILE_DIR, name)
+        entry['files'][kind] = {'name': name, 'bytes': os.path.getsize(path)}
+        entry['created_at'] = datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
+    return list(profiles.values())
+
+
+def profiled(view):
+    """Route decorator: profile this request when asked to (see module docstring)"""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not enabled():
+            return view(*args, **kwargs)
+
+        from flask import request, make_response
+        if not should_profile(request.headers):
+            return view(*args, **kwargs)
+
+        sampler = StackSampler(threading.get_ident()).start()
+        try:
+            result = view(*args, **kwargs)
+        finally:
+            sampler.stop()
+            # A profile that cannot be written must not replace the view's result or error
+            try:
+                profile_id = write_profile(sampler, request.endpoint or view.__name__)
+                print(f"🔬 Profiled {request.endpoint} in {sampler.duration * 1000:.0f} ms -> {profile_id}")
+            except OSError as e:
+                profile_id = None
+                print(f"⚠️ Profile of {request.endpoint} not written to {PROFILE_DIR}: {e}")
+
+        response = make_response(result)
+        if profile_id:
+            response.headers['X-Profile-Id'] = profile_id
+        return response
+
+    return wrapper
+
+
+def register_admin_routes(app):
+    """GET /api/admin/profiles (list) and /api/admin/profiles/<file> (download), admin header required"""
+    from flask import request, jsonify, send_from_directory
+
+    @app.route('/api/admin/profiles')
+    def list_request_profiles():
+        if not is_admin(request.headers):
+            return jsonify({'error': 'Not found'}), 404
+        return jsonify({
+            'success': True,
+            'sample_rate': PROFILE_SAMPLE_RATE,
+            'interval_ms': PROFILE_INTERVAL * 1000,
+            'profiles': list_profiles()
+        })
+
+    @app.route('/api/admin/profiles/<path:filename>')
+    def download_request_profile(filename):
+        if not is_admin(request.headers):
+            return jsonify({'error': 'Not found'}), 404
+        return send_from_directory(PROFILE_DIR, os.path.basename(filename), as_attachment=True)
+
+    return app
@@ -0,0 +1,169 @@
+"""
+Provider routing for AI image editing backends
+Tracks rolling latency / error rate per provider, opens a circuit breaker
+on failing providers and computes hedge delays (launch the next provider
+when the current one is slower than its usual p95).
+"""
+
+from collections import deque
+import threading
+import time
+import os
+
+WINDOW_SIZE = int(os.environ.get('PROVIDER_WINDOW_SIZE', 50))
+WINDOW_SECONDS = float(os.environ.get('PROVIDER_WINDOW_SECONDS', 600))
+
+# Circuit breaker: open after N consecutive failures or a high error rate
+CIRCUIT_CONSECUTIVE_FAILURES = int(os.environ.get('CIRCUIT_CONSECUTIVE_FAILURES', 3))
+CIRCUIT_ERROR_RATE = float(os.environ.get('CIRCUIT_ERROR_RATE', 0.5))
+CIRCUIT_MIN_SAMPLES = int(os.environ.get('CIRCUIT_MIN_SAMPLES', 5))
+CIRCUIT_COOLDOWN_SECONDS = float(os.environ.get('CIRCUIT_COOLDOWN_SECONDS', 60))
+
+# Hedging is opt-in: it can double spend on paid providers
+HEDGE_ENABLED = os.environ.get('AI_EDIT_HEDGE', '').lower() in ('1', 'true', 'yes')
+HEDGE_PERCENTILE = float(os.environ.get('AI_EDIT_HEDGE_PERCENTILE', 95))
+HEDGE_MIN_SAMPLES = int(os.environ.get('AI_EDIT_HEDGE_MIN_SAMPLES', 5))
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None when empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def _round(value):
+    return round(value, 3) if value is not None else None
+
+
+class ProviderHealth:
+    """Rolling outcome window plus circuit breaker state for one provider"""
+
+    def __init__(self):
+        self.samples = deque(maxlen=WINDOW_SIZE)  # (timestamp, latency, ok)
+        self.consecutive_failures = 0
+        self.state = 'closed'  # closed -> open -> half_open -> closed
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.trial_started = 0
+
+    def _recent(self):
+        cutoff = time.time() - WINDOW_SECONDS
+        return [s for s in self.samples if s[0] >= cutoff]
+
+    def error_rate(self):
+        recent = self._recent()
+        if not recent:
+            return 0.0
+        return sum(1 for s in recent if not s[2]) / len(recent)
+
+    def latency_percentile(self, pct):
+        """Latency percentile over successful calls only"""
+        return percentile([s[1] for s in self._recent() if s[2]], pct)
+
+
+class ProviderRouter:
+    """Shared health registry used to order, skip and hedge providers"""
+
+    def __init__(self):
+        self.health = {}
+        self.lock = threading.Lock()
+
+    def _get(self, name):
+        if name not in self.health:
+            self.health[name] = ProviderHealth()
+        return self.health[name]
+
+    def record(self, name, latency, ok):
+        """Record the outcome of one provider call and update its breaker"""
+        with self.lock:
+            health = self._get(name)
+            health.samples.append((time.time(), latency, ok))
+
+            if ok:
+                health.consecutive_failures = 0
+                if health.state != 'closed':
+                    print(f"🟢 Circuit closed for {name}")
+                health.state = 'closed'
+                health.trial_in_flight = False
+                return
+
+            health.consecutive_failures += 1
+            recent = health._recent()
+            too_many_errors = len(recent) >= CIRCUIT_MIN_SAMPLES and health.error_rate() >= CIRCUIT_ERROR_RATE
+
+            if health.state == 'half_open' or health.consecutive_failures >= CIRCUIT_CONSECUTIVE_FAILURES or too_many_errors:
+                if health.state != 'open':
+                    print(f"🔴 Circuit opened for {name} (error rate {health.error_rate():.0%})")
+                health.state = 'open'
+                health.opened_at = time.time()
+                health.trial_in_flight = False
+
+    def allow(self, name):
+        """
+        Whether a call to this provider may start now
+        An open circuit lets one trial call through after the cooldown (half-open)
+        """
+        with self.lock:
+            health = self._get(name)
+            if health.state == 'closed':
+                return True
+            if health.state == 'open' and time.time() - health.opened_at >= CIRCUIT_COOLDOWN_SECONDS:
+                health.state = 'half_open'
+            # A trial that never reported back (e.g. its job was already won) expires
+            trial_expired = time.time() - health.trial_started >= CIRCUIT_COOLDOWN_SECONDS
+            if health.state == 'half_open' and (not health.trial_in_flight or trial_expired):
+                health.trial_in_flight = True
+                health.trial_started = time.time()
+                return True
+            return False
+
+    def order(self, providers):
+        """
+        Healthiest providers first: closed circuits before open ones, then by
+        p50 latency weighted by error rate. Providers without data yet are
+        tried optimistically (in configured priority) so they get measured.
+        """
+        with self.lock:
+            def score(item):
+                index, provider = item
+                health = self._get(provider.name)
+                p50 = health.latency_percentile(50)
+                if p50 is None:
+                    # Never measured -> optimistic; only failures -> last
+                    return (health.state == 'open', float('inf') if health._recent() else 0, index)
+                return (health.state == 'open', p50 * (1 + 4 * health.error_rate()), index)
+
+            return [p for _, p in sorted(enumerate(providers), key=score)]
+
+    def hedge_delay(self, name):
+        """
+        Seconds to wait before hedging with the next provider, or None to not hedge
+        (hedging disabled or not enough latency samples yet)
+        """
+        if not HEDGE_ENABLED:
+            return None
+        with self.lock:
+            health = self._get(name)
+            latencies = [s[1] for s in health._recent() if s[2]]
+            if len(latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            return percentile(latencies, HEDGE_PERCENTILE)
+
+    def snapshot(self):
+        """Health summary per provider for the status endpoint"""
+        with self.lock:
+            summary = {}
+            for name, health in self.health.items():
+                recent = health._recent()
+                summary[name] = {
+                    'state': health.state,
+                    'samples': len(recent),
+                    'error_rate': round(health.error_rate(), 3),
+                    'p50_seconds': _round(health.latency_percentile(50)),
+                    'p95_seconds': _round(health.latency_percentile(95)),
+                    'consecutive_failures': health.consecutive_failures
+                }
+            return summary
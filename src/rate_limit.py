@@ -0,0 +1,187 @@
+"""
+Token-bucket pacing of outbound calls to the free upstream APIs
+Each provider has a bucket refilled at RATE_LIMIT_<NAME>_RATE tokens per
+second up to RATE_LIMIT_<NAME>_BURST. A caller reserves a token and is
+told how long to wait for it; when that wait is longer than the caller's
+deadline it gets None and fails fast (effect fallback, next provider, ...)
+without using a token. An upstream 429/503 pauses the bucket for its
+Retry-After, so other requests stop hitting a service that is throttling.
+
+    if not rate_limit.bucket('pollinations_image').acquire(max_wait=5):
+        return None  # would wait too long
+
+With RATE_LIMIT_DIR set, the buckets are shared by all worker processes
+(state file per provider under a POSIX file lock).
+"""
+
+import threading
+import time
+import os
+
+import cpu_budget
+import metrics
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+RATE_LIMIT_DIR = os.environ.get('RATE_LIMIT_DIR', '')
+# Longest an interactive request waits for a token before giving up
+RATE_LIMIT_MAX_WAIT = float(os.environ.get('RATE_LIMIT_MAX_WAIT', 5))
+
+# provider -> (tokens per second, burst); RATE_LIMIT_<NAME>_RATE / _BURST override
+DEFAULT_LIMITS = {
+    'pollinations_image': (0.5, 3),
+    'pollinations_text': (0.5, 2),
+    'huggingface': (0.2, 2),
+    'fal': (2.0, 5),
+    'replicate': (1.0, 3),
+}
+FALLBACK_LIMIT = (1.0, 3)
+
+WAIT_SECONDS = metrics.Histogram(
+    'image_editor_rate_limit_wait_seconds', 'Time an outbound call was paced by its token bucket',
+    ['provider', 'outcome'])
+PAUSES_TOTAL = metrics.Counter(
+    'image_editor_rate_limit_pauses_total', 'Buckets paused by an upstream 429/503',
+    ['provider'])
+
+
+def retry_after(headers, default):
+    """Seconds from a Retry-After header (falls back to `default`)"""
+    try:
+        return max(1.0, float(headers.get('Retry-After', default)))
+    except (TypeError, ValueError):
+        return default
+
+
+class TokenBucket:
+    """Token bucket shared by the threads of this process"""
+
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.rate = max(rate, 1e-6)
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def _update(self, change):
+        """Apply change(tokens) -> (new tokens, result) to the refilled bucket"""
+        with self.lock:
+            now = time.time()
+            tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.tokens, result = change(tokens)
+            self.updated = now
+            return result
+
+    def available(self):
+        return self._update(lambda tokens: (tokens, tokens))
+
+    def reserve(self, max_wait=RATE_LIMIT_MAX_WAIT):
+        """
+        Take a token. Returns the seconds to wait before making the call, or
+        None (no token taken) when that would be longer than max_wait
+        """
+        if not RATE_LIMIT_ENABLED:
+            return 0.0
+
+        def take(tokens):
+            # Tokens go negative: each reservation queues behind the earlier ones
+            delay = max(0.0, (1 - tokens) / self.rate)
+            if delay > max_wait:
+                return tokens, None
+            return tokens - 1, delay
+
+        delay = self._update(take)
+        WAIT_SECONDS.observe(delay or 0.0, self.name, 'rejected' if delay is None else 'admitted')
+        return delay
+
+    def pause(self, seconds):
+        """The upstream asked us to back off: hand out no token for `seconds`"""
+        PAUSES_TOTAL.inc(self.name)
+        self._update(lambda tokens: (min(tokens, 1 - seconds * self.rate), None))
+
+    def acquire(self, max_wait=RATE_LIMIT_MAX_WAIT):
+        """Wait for a token (the thread gives up its CPU share meanwhile); False when too far off"""
+        delay = self.reserve(max_wait)
+        if delay is None:
+            return False
+        if delay > 0:
+            with cpu_budget.budget.idle():
+                time.sleep(delay)
+        return True
+
+    async def acquire_async(self, max_wait=RATE_LIMIT_MAX_WAIT):
+        """acquire() for coroutines"""
+        import asyncio
+
+        delay = self.reserve(max_wait)
+        if delay is None:
+            return False
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return True
+
+
+class FileTokenBucket(TokenBucket):
+    """TokenBucket whose state lives in a file, shared by every process using `directory`"""
+
+    def __init__(self, name, rate, burst, directory):
+        super().__init__(name, rate, burst)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f'{name}.bucket')
+
+    def _update(self, change):
+        import fcntl
+
+        with self.lock, open(self.path, 'a+') as state:
+            fcntl.flock(state, fcntl.LOCK_EX)
+            try:
+                state.seek(0)
+                try:
+                    self.tokens, self.updated = (float(v) for v in state.read().split())
+                except ValueError:
+                    pass  # New file: start full
+                result = super()._update(change)
+                state.seek(0)
+                state.truncate()
+                state.write(f'{self.tokens} {self.updated}')
+                state.flush()
+                return result
+            finally:
+                fcntl.flock(state, fcntl.LOCK_UN)
+
+
+def _make_bucket(name, rate, burst):
+    if RATE_LIMIT_DIR:
+        try:
+            import fcntl  # noqa: F401 (POSIX only)
+            return FileTokenBucket(name, rate, burst, RATE_LIMIT_DIR)
+        except ImportError:
+            print("⚠️ RATE_LIMIT_DIR needs POSIX file locks - rate limits are per process")
+    return TokenBucket(name, rate, burst)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def bucket(name):
+    """The bucket of provider `name` (created from the environment on first use)"""
+    with _buckets_lock:
+        if name not in _buckets:
+            rate, burst = DEFAULT_LIMITS.get(name, FALLBACK_LIMIT)
+            key = name.upper()
+            rate = float(os.environ.get(f'RATE_LIMIT_{key}_RATE', rate))
+            burst = float(os.environ.get(f'RATE_LIMIT_{key}_BURST', burst))
+            _buckets[name] = _make_bucket(name, rate, burst)
+        return _buckets[name]
+
+
+def _snapshot():
+    with _buckets_lock:
+        buckets = list(_buckets.values())
+    return {(b.name,): round(b.available(), 3) for b in buckets}
+
+
+metrics.Gauge(
+    'image_editor_rate_limit_tokens', 'Tokens left per upstream bucket (negative: calls queued)',
+    ['provider'], callback=_snapshot)
@@ -0,0 +1,265 @@
+"""
+Single-flight coalescing of identical concurrent work
+When several callers ask for the same key at once (same upload bytes, same
+preview payload, same Pollinations prompt), the first one computes and the
+others wait for its result - or its exception - instead of repeating it.
+
+    uploads = single_flight.group('upload')
+    result = uploads.do(key, compute, *args)
+
+    @app.route('/api/render-preview', methods=['POST'])
+    @single_flight.coalesced(previews, preview_key)
+    def render_preview(): ...
+
+With SINGLE_FLIGHT_DIR set, groups also coalesce across worker processes:
+the leader holds a lock file for the key and leaves its result there (as
+JSON) for SINGLE_FLIGHT_TTL seconds, so workers that were waiting on the
+lock read it instead of computing again. Shared results are bytes, strings,
+numbers, None and lists/tuples of them. The directory must be private to
+this user (created 0700; refused when another user owns it or others can
+access it), since every worker trusts what it finds there.
+"""
+
+from functools import wraps
+import threading
+import hashlib
+import base64
+import stat
+import json
+import time
+import os
+
+import cpu_budget
+import metrics
+
+SINGLE_FLIGHT_ENABLED = os.environ.get('SINGLE_FLIGHT_ENABLED', '1') == '1'
+SINGLE_FLIGHT_DIR = os.environ.get('SINGLE_FLIGHT_DIR', '')
+SINGLE_FLIGHT_TTL = float(os.environ.get('SINGLE_FLIGHT_TTL', 10))
+
+CALLS_TOTAL = metrics.Counter(
+    'image_editor_single_flight_total', 'Coalesced calls by role (leader computed, follower shared)',
+    ['group', 'role'])
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Per-key coalescing of concurrent calls within this process"""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = {}  # key -> _Call being computed
+        self.async_calls = {}  # key -> asyncio.Future (ASGI event loop)
+        self.lock = threading.Lock()
+
+    def pending(self):
+        with self.lock:
+            return len(self.calls) + len(self.async_calls)
+
+    def do(self, key, fn, *args, **kwargs):
+        """fn(*args, **kwargs), shared with concurrent callers of the same key"""
+        if not SINGLE_FLIGHT_ENABLED or key is None:
+            return fn(*args, **kwargs)
+
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            CALLS_TOTAL.inc(self.name, 'follower')
+            # Waiting callers use no CPU: they give up their thread share
+            with cpu_budget.budget.idle():
+                call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result, role = self._compute(key, fn, args, kwargs)
+            CALLS_TOTAL.inc(self.name, role)
+            return call.result
+        except Exception as e:
+            CALLS_TOTAL.inc(self.name, 'leader')
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+            if call.waiters:
+                print(f"🔗 {self.name}: {call.waiters} identical request(s) shared one result")
+
+    def _compute(self, key, fn, args, kwargs):
+        """(result, role) for the in-process leader of `key`"""
+        return fn(*args, **kwargs), 'leader'
+
+    async def do_async(self, key, fn, *args):
+        """await fn(*args), shared with concurrent coroutines of the same key (one event loop)"""
+        import asyncio
+
+        if not SINGLE_FLIGHT_ENABLED or key is None:
+            return await fn(*args)
+
+        future = self.async_calls.get(key)
+        if future is not None:
+            CALLS_TOTAL.inc(self.name, 'follower')
+            # shield: a cancelled follower must not cancel the leader's work
+            return await asyncio.shield(future)
+
+        CALLS_TOTAL.inc(self.name, 'leader')
+        future = asyncio.get_running_loop().create_future()
+        with self.lock:
+            self.async_calls[key] = future
+        try:
+            result = await fn(*args)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # retrieved: no warning when nobody else was waiting
+            raise
+        finally:
+            with self.lock:
+                del self.async_calls[key]
+
+
+def _encode(value):
+    """JSON-ready form of a result (bytes and tuples tagged so they come back as such)"""
+    if isinstance(value, bytes):
+        return {'bytes': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, tuple):
+        return {'tuple': [_encode(item) for item in value]}
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    raise TypeError(f'{type(value).__name__} results cannot be shared')
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if 'bytes' in value:
+            return base64.b64decode(value['bytes'])
+        return tuple(_decode(item) for item in value['tuple'])
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    return value
+
+
+def _private_directory(path):
+    """Create `path` (0700) if needed; OSError unless it is ours and closed to other users"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.stat(path)
+    if info.st_uid != os.getuid():
+        raise PermissionError(f'{path} belongs to another user')
+    if stat.S_IMODE(info.st_mode) & 0o077:
+        raise PermissionError(f'{path} is accessible to other users (needs mode 0700)')
+
+
+class FileSingleFlight(SingleFlight):
+    """SingleFlight that also coalesces across processes through lock files in `directory`"""
+
+    def __init__(self, name, directory, ttl=SINGLE_FLIGHT_TTL):
+        super().__init__(name)
+        self.directory = os.path.join(directory, name)
+        self.ttl = ttl
+        _private_directory(directory)
+        _private_directory(self.directory)
+
+    def _paths(self, key):
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        base = os.path.join(self.directory, digest)
+        return base + '.lock', base + '.result'
+
+    def _fresh_result(self, result_path):
+        try:
+            if time.time() - os.path.getmtime(result_path) > self.ttl:
+                return None
+            with open(result_path, 'rb') as f:
+                return _decode(json.load(f))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _remove_stale(self):
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > 2 * self.ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _compute(self, key, fn, args, kwargs):
+        import fcntl
+
+        lock_path, result_path = self._paths(key)
+        with open(lock_path, 'a') as lock_file:
+            # Another worker computing the same key holds the lock
+            with cpu_budget.budget.idle():
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                shared = self._fresh_result(result_path)
+                if shared is not None:
+                    return shared, 'follower'
+
+                result = fn(*args, **kwargs)
+                tmp_path = f'{result_path}.{os.getpid()}.tmp'
+                try:
+                    with open(tmp_path, 'w') as f:
+                        json.dump(_encode(result), f)
+                    os.replace(tmp_path, result_path)
+                except (OSError, TypeError) as e:
+                    print(f"⚠️ {self.name}: result not shared across workers: {e}")
+                return result, 'leader'
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                self._remove_stale()
+
+
+def group(name):
+    """Coalescing group for `name`: cross-process with SINGLE_FLIGHT_DIR, in-process otherwise"""
+    if SINGLE_FLIGHT_DIR:
+        try:
+            import fcntl  # noqa: F401 (POSIX only)
+            return FileSingleFlight(name, SINGLE_FLIGHT_DIR)
+        except ImportError:
+            print("⚠️ SINGLE_FLIGHT_DIR needs POSIX file locks - coalescing within each process only")
+        except OSError as e:
+            print(f"⚠️ SINGLE_FLIGHT_DIR not used ({e}) - coalescing within each process only")
+    return SingleFlight(name)
+
+
+def coalesced(flight, key_fn):
+    """
+    Route decorator: concurrent requests with the same key_fn() share one
+    response (body, status and headers); key_fn returns None to opt out
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            from flask import current_app, Response
+
+            def respond():
+                response = current_app.make_response(view(*args, **kwargs))
+                return response.get_data(), response.status_code, list(response.headers.items())
+
+            body, status, headers = flight.do(key_fn(), respond)
+            return Response(body, status=status, headers=headers)
+
+        return wrapper
+
+    return decorator
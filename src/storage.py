@@ -0,0 +1,150 @@
+"""
+Image storage backends shared by the server and the serverless entry point
+FileStorage keeps images in a folder (uploads/, generated/); MemoryStorage
+keeps encoded PNGs in a bounded in-process LRU for serverless instances
+that have no persistent disk. Content-addressed names (content_key) let
+clients upload an image once and reference it afterwards.
+"""
+
+from collections import OrderedDict
+from PIL import Image
+import threading
+import hashlib
+import io
+import os
+
+import metrics
+
+
+def content_key(data):
+    """Content hash used as the name of an uploaded image (upload-once references)"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_content_key(name):
+    return isinstance(name, str) and len(name) == 64 and all(c in '0123456789abcdef' for c in name)
+
+
+class FileStorage:
+    """Images stored as files in one folder"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.folder, os.path.basename(name))
+
+    def exists(self, name):
+        return bool(name) and os.path.exists(self.path(name))
+
+    def save_image(self, img, name):
+        with metrics.stage('png_save'):
+            img.save(self.path(name))
+        return name
+
+    def save_bytes(self, data, name):
+        # Written aside and renamed: readers in other workers never see a partial file
+        path = self.path(name)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return name
+
+    def load_bytes(self, name):
+        """Stored bytes, or None when missing"""
+        if not self.exists(name):
+            return None
+        with open(self.path(name), 'rb') as f:
+            return f.read()
+
+    def load_image(self, name):
+        """Stored image, or None when missing"""
+        if not self.exists(name):
+            return None
+        return Image.open(self.path(name))
+
+
+class MemoryStorage:
+    """Encoded images kept in memory, least recently used evicted first"""
+
+    def __init__(self, max_items=64, max_bytes=256 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()  # name -> encoded bytes
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def exists(self, name):
+        with self.lock:
+            return name in self.items
+
+    def save_image(self, img, name):
+        buffer = io.BytesIO()
+        with metrics.stage('png_save'):
+            img.save(buffer, format='PNG')
+        return self.save_bytes(buffer.getvalue(), name)
+
+    def save_bytes(self, data, name):
+        with self.lock:
+            if name in self.items:
+                self.total_bytes -= len(self.items.pop(name))
+            self.items[name] = data
+            self.total_bytes += len(data)
+            while len(self.items) > 1 and (len(self.items) > self.max_items or self.total_bytes > self.max_bytes):
+                _, evicted = self.items.popitem(last=False)
+                self.total_bytes -= len(evicted)
+        return name
+
+    def load_bytes(self, name):
+        with self.lock:
+            data = self.items.get(name)
+            if data is not None:
+                self.items.move_to_end(name)
+            return data
+
+    def load_image(self, name):
+        data = self.load_bytes(name)
+        if data is None:
+            return None
+        return Image.open(io.BytesIO(data))
+
+
+class DecodedImageCache:
+    """
+    Recently used decoded images by name, so repeated generations from the
+    same stored image skip reading and decoding it again
+    Only for immutable names (content keys, timestamped uploads).
+    """
+
+    def __init__(self, max_items=4):
+        self.max_items = max_items
+        self.images = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, storage, name):
+        """Decoded RGB image for `name` from `storage`, or None when it is not stored"""
+        with self.lock:
+            img = self.images.get(name)
+            if img is not None:
+                self.images.move_to_end(name)
+                return img
+
+        img = storage.load_image(name)
+        if img is None:
+            return None
+        with metrics.stage('decode'):
+            img.load()
+        with metrics.stage('rgb_convert'):
+            img = img.convert('RGB')
+        self.put(name, img)
+        return img
+
+    def put(self, name, img):
+        """Remember an image that was just decoded anyway (e.g. at upload)"""
+        with self.lock:
+            self.images[name] = img
+            self.images.move_to_end(name)
+            while len(self.images) > self.max_items:
+                self.images.popitem(last=False)
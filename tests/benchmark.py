@@ -0,0 +1,351 @@
+"""
+Micro-benchmarks for the image pipeline stages
+Synthetic images (512 px to 8K, sparse to dense text, fixed seed) are run
+through OCR, inpainting, text rendering, every effect preset and PNG/base64
+encoding. Reports latency percentiles, throughput and peak memory, and
+writes JSON that can be compared between commits.
+
+Usage:
+    python tests/benchmark.py --quick
+    python tests/benchmark.py --output bench_before.json
+    python tests/benchmark.py --output bench_after.json --compare bench_before.json
+    python tests/benchmark.py --stages effect,encode --sizes 4k,8k --repeat 3
+
+OCR runs only when EasyOCR is installed (or with --no-ocr to skip it);
+it is the same pipeline.extract_text() that app_free.extract_text_from_image
+calls.
+"""
+
+from contextlib import redirect_stdout
+from datetime import datetime
+import subprocess
+import statistics
+import tracemalloc
+import threading
+import platform
+import argparse
+import random
+import base64
+import json
+import time
+import sys
+import io
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from PIL import Image, ImageDraw
+import numpy as np
+
+import pipeline
+from rendering import DEFAULT_PRESETS, apply_effect, draw_text_elements, load_font
+
+SIZES = {
+    '512': (512, 512),
+    '1k': (1024, 1024),
+    'hd': (1920, 1080),
+    '4k': (3840, 2160),
+    '8k': (7680, 4320),
+}
+# Lines of text per image
+DENSITIES = {'sparse': 3, 'medium': 12, 'dense': 40}
+STAGES = ['ocr', 'inpaint', 'render', 'effect', 'encode']
+QUICK = {'sizes': ['512', 'hd'], 'densities': ['sparse', 'dense'], 'repeat': 3}
+
+WORDS = ['SALE', 'today', 'only', 'new', 'collection', 'limited', 'offer', 'free', 'shipping',
+         'summer', 'launch', 'best', 'price', 'hello', 'world', 'meme', 'when', 'you', 'see', 'it']
+
+
+# ============================================================
+# SYNTHETIC IMAGES
+# ============================================================
+
+def make_image(size_name, density, seed=42):
+    """
+    RGB image with a gradient background, a few shapes and `density` lines of text
+    Returns (image, boxes, text_elements); boxes are the drawn text quadrilaterals
+    """
+    rng = random.Random(f'{seed}-{size_name}-{density}')
+    width, height = SIZES[size_name]
+
+    # Smooth two-color gradient plus mild noise, like a photo background
+    ys = np.linspace(0, 1, height, dtype=np.float32)[:, None, None]
+    xs = np.linspace(0, 1, width, dtype=np.float32)[None, :, None]
+    top = np.array([rng.randrange(256) for _ in range(3)], dtype=np.float32)
+    bottom = np.array([rng.randrange(256) for _ in range(3)], dtype=np.float32)
+    pixels = top * (1 - ys) + bottom * ys + 20 * (xs - 0.5)
+    noise = np.random.default_rng(seed).integers(-8, 9, size=(height, width, 1), dtype=np.int16)
+    pixels = np.clip(pixels + noise, 0, 255).astype(np.uint8)
+    img = Image.fromarray(pixels, 'RGB')
+
+    draw = ImageDraw.Draw(img)
+    for _ in range(6):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = x0 + rng.randrange(width // 4 + 1), y0 + rng.randrange(height // 4 + 1)
+        draw.ellipse((x0, y0, x1, y1), fill=tuple(rng.randrange(256) for _ in range(3)))
+
+    lines = DENSITIES[density]
+    font_size = max(12, min(96, height // (lines + 4)))
+    font = load_font(font_size)
+    boxes, texts = [], []
+    for i in range(lines):
+        text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 5)))
+        x = rng.randrange(max(1, width // 2))
+        y = int((i + 1) * height / (lines + 2))
+        color = '#ffffff' if rng.random() < 0.5 else '#000000'
+        draw.text((x, y), text, font=font, fill=color)
+
+        left, top_, right, bottom_ = draw.textbbox((x, y), text, font=font)
+        boxes.append([[left, top_], [right, top_], [right, bottom_], [left, bottom_]])
+        texts.append({'text': text, 'position': {'x': x, 'y': y}, 'size': font_size, 'color': color})
+
+    return img, np.array(boxes, dtype=np.float64), texts
+
+
+# ============================================================
+# MEASUREMENT
+# ============================================================
+
+class PeakRSS:
+    """Peak resident memory growth while running (Linux /proc; None elsewhere)"""
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+        self.available = os.path.exists('/proc/self/statm')
+
+    def _rss(self):
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * self.page_size
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, self._rss())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        if self.available:
+            self.baseline = self.peak = self._rss()
+            self.stopped = threading.Event()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.available:
+            self.stopped.set()
+            self.thread.join()
+            self.peak = max(self.peak, self._rss())
+
+    @property
+    def growth_mb(self):
+        if not self.available:
+            return None
+        return round((self.peak - self.baseline) / 1024 / 1024, 2)
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def measure(fn, repeat, warmup):
+    """Latency samples (seconds) plus peak memory from one extra untimed run"""
+    # The pipeline's progress prints would dominate small cases
+    with redirect_stdout(io.StringIO()):
+        return _measure(fn, repeat, warmup)
+
+
+def _measure(fn, repeat, warmup):
+    for _ in range(warmup):
+        fn()
+
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+
+    # Memory pass kept separate so tracing never skews the timings.
+    # tracemalloc sees Python/NumPy allocations, not Pillow's pixel buffers,
+    # hence the RSS growth as well
+    tracemalloc.start()
+    with PeakRSS() as rss:
+        fn()
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return samples, {
+        'python_mb': round(python_peak / 1024 / 1024, 2),
+        'rss_growth_mb': rss.growth_mb
+    }
+
+
+def summarize(name, size_name, density, samples, memory, pixels):
+    mean = statistics.fmean(samples)
+    return {
+        'name': name,
+        'size': size_name,
+        'density': density,
+        'pixels': pixels,
+        'runs': len(samples),
+        'latency_ms': {
+            'mean': round(mean * 1000, 3),
+            'p50': round(percentile(samples, 50) * 1000, 3),
+            'p90': round(percentile(samples, 90) * 1000, 3),
+            'p99': round(percentile(samples, 99) * 1000, 3),
+            'min': round(min(samples) * 1000, 3),
+            'max': round(max(samples) * 1000, 3),
+            'stdev': round(statistics.pstdev(samples) * 1000, 3)
+        },
+        'throughput': {
+            'ops_per_s': round(1 / mean, 3) if mean > 0 else None,
+            'mpix_per_s': round(pixels / 1e6 / mean, 2) if mean > 0 else None
+        },
+        'peak_memory': memory
+    }
+
+
+# ============================================================
+# CASES
+# ============================================================
+
+def load_ocr_reader():
+    try:
+        import easyocr
+    except ImportError:
+        return None
+    return easyocr.Reader(['en'], gpu=False, verbose=False)
+
+
+def cases_for(stage, img, boxes, texts, reader):
+    """(name, fn) pairs for one stage on one image"""
+    if stage == 'ocr':
+        if reader is not None:
+            yield 'extract_text', lambda: pipeline.extract_text(reader, img)
+            # Detection alone: the fixed part of a time-budgeted OCR run
+            yield 'detect_text', lambda: pipeline.detect_text_boxes(reader, np.array(img))
+    elif stage == 'inpaint':
+        yield 'remove_text', lambda: pipeline.remove_text_from_image(img, boxes)
+    elif stage == 'render':
+        yield 'draw_text', lambda: draw_text_elements(img.copy(), texts)
+    elif stage == 'effect':
+        for preset in DEFAULT_PRESETS:
+            yield f'effect:{preset}', lambda preset=preset: apply_effect(img, preset)
+    elif stage == 'encode':
+        png = io.BytesIO()
+        img.save(png, format='PNG')
+        png_bytes = png.getvalue()
+        yield 'png_encode', lambda: img.save(io.BytesIO(), format='PNG')
+        yield 'base64_encode', lambda: base64.b64encode(png_bytes).decode()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(args):
+    stages = args.stages.split(',')
+    reader = None
+    if 'ocr' in stages and not args.no_ocr:
+        print("🔍 Loading EasyOCR reader...")
+        reader = load_ocr_reader()
+        if reader is None:
+            print("⚠️ EasyOCR not installed - skipping OCR cases")
+
+    results = []
+    for size_name in args.sizes.split(','):
+        for density in args.densities.split(','):
+            img, boxes, texts = make_image(size_name, density, args.seed)
+            pixels = img.width * img.height
+            for stage in stages:
+                for name, fn in cases_for(stage, img, boxes, texts, reader):
+                    # OCR is seconds per call: fewer runs keep the suite usable
+                    repeat = max(1, args.repeat // 3) if stage == 'ocr' else args.repeat
+                    samples, memory = measure(fn, repeat, args.warmup)
+                    result = summarize(name, size_name, density, samples, memory, pixels)
+                    results.append(result)
+                    print(f"⏱️  {name:<22} {size_name:>4} {density:<7} "
+                          f"p50 {result['latency_ms']['p50']:>10.2f} ms  "
+                          f"p99 {result['latency_ms']['p99']:>10.2f} ms  "
+                          f"{result['throughput']['mpix_per_s'] or 0:>8.1f} MPix/s  "
+                          f"mem {memory['python_mb']:.1f} MB py / {memory['rss_growth_mb'] or 0:.1f} MB rss")
+
+    import PIL
+    return {
+        'meta': {
+            'created_at': datetime.now().isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'pillow': PIL.__version__,
+            'numpy': np.__version__,
+            'ocr': reader is not None,
+            'args': vars(args)
+        },
+        'results': results
+    }
+
+
+def compare(current, baseline_path):
+    """Print p50 change per case against an earlier JSON report"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {(r['name'], r['size'], r['density']): r for r in baseline['results']}
+
+    print(f"\n📊 Compared with {baseline_path} (commit {baseline['meta'].get('commit')})")
+    for result in current['results']:
+        old = before.get((result['name'], result['size'], result['density']))
+        if not old:
+            continue
+        old_p50, new_p50 = old['latency_ms']['p50'], result['latency_ms']['p50']
+        change = (new_p50 - old_p50) / old_p50 * 100 if old_p50 else 0.0
+        marker = '🟢' if change < -5 else '🔴' if change > 5 else '⚪'
+        print(f"{marker} {result['name']:<22} {result['size']:>4} {result['density']:<7} "
+              f"{old_p50:>10.2f} -> {new_p50:>10.2f} ms ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the image pipeline stages')
+    parser.add_argument('--sizes', default=','.join(SIZES), help=f'Comma-separated, from {list(SIZES)}')
+    parser.add_argument('--densities', default=','.join(DENSITIES), help=f'Comma-separated, from {list(DENSITIES)}')
+    parser.add_argument('--stages', default=','.join(STAGES), help=f'Comma-separated, from {STAGES}')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per case')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed runs per case')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-ocr', action='store_true', help='Skip OCR even if EasyOCR is installed')
+    parser.add_argument('--quick', action='store_true', help='Small sizes, two densities, 3 runs')
+    parser.add_argument('--output', help='Write the JSON report here')
+    parser.add_argument('--compare', help='Earlier JSON report to compare against')
+    args = parser.parse_args()
+
+    if args.quick:
+        args.sizes = ','.join(QUICK['sizes'])
+        args.densities = ','.join(QUICK['densities'])
+        args.repeat = QUICK['repeat']
+
+    for name, allowed in (('sizes', SIZES), ('densities', DENSITIES), ('stages', STAGES)):
+        unknown = [v for v in getattr(args, name).split(',') if v not in allowed]
+        if unknown:
+            parser.error(f"unknown {name}: {', '.join(unknown)}")
+
+    report = run(args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,2 @@
+# test_ocr.py is a standalone EasyOCR check script (runs on import), not a pytest module
+collect_ignore = ['test_ocr.py']
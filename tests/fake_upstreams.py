@@ -0,0 +1,320 @@
+"""
+Local stand-ins for every upstream service the app calls
+One server answers like Pollinations (image + text), Hugging Face
+Instruct-Pix2Pix, Fal.ai (REST), Replicate and Gemini, with configurable
+latency, error rate and 503 (model loading) / 429 (rate limited) behavior
+per service, so load tests and retry logic run offline.
+
+Usage:
+    python tests/fake_upstreams.py --port 8765 --latency 0.5 --set huggingface.rate_503=0.3
+    python tests/fake_upstreams.py --set pollinations_image.max_rps=1   # throttled like the free tier
+    # then start the app with the environment printed at startup, e.g.
+    POLLINATIONS_API=http://127.0.0.1:8765/prompt/ ... python src/app_free.py
+
+Runtime control:
+    GET  /_stats    request counts per service and status
+    POST /_config   {"huggingface": {"rate_429": 0.5}, "*": {"latency": 0.1}}
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+from collections import deque
+import threading
+import argparse
+import hashlib
+import random
+import json
+import time
+import uuid
+import io
+
+from PIL import Image
+
+SERVICES = ['pollinations_image', 'pollinations_text', 'huggingface', 'fal', 'replicate', 'gemini']
+
+# Per service: mean latency (s), jitter (s, stdev), probabilities of a 500
+# error, a 503 "model loading" and a 429 "rate limited" answer, and a
+# throttle like the real free tiers: requests beyond max_rps in any one
+# second get a 429 (0 = unlimited)
+DEFAULT_CONFIG = {'latency': 0.0, 'jitter': 0.0, 'error_rate': 0.0, 'rate_503': 0.0, 'rate_429': 0.0,
+                  'max_rps': 0.0}
+CONFIG = {service: dict(DEFAULT_CONFIG) for service in SERVICES}
+STATS = {}
+RECENT = {service: deque() for service in SERVICES}  # arrival times within the last second
+FILES = {}  # name -> PNG bytes served at /files/<name>
+_lock = threading.Lock()
+
+CAPTIONS = [
+    "When you finally understand the assignment",
+    "Me pretending to be productive",
+    "Nobody: ... Me:",
+    "That face you make when the build passes",
+    "POV: You just realized it's Monday",
+    "When the coffee kicks in",
+    "This is fine",
+    "Me explaining my code to the rubber duck",
+]
+
+
+def env_for(base_url):
+    """Environment variables that point the app at a fake server on base_url"""
+    return {
+        'POLLINATIONS_API': f'{base_url}/prompt/',
+        'POLLINATIONS_TEXT_API': f'{base_url}/text/',
+        'HF_API_BASE': base_url,
+        'FAL_API_BASE': f'{base_url}/fal',
+        'REPLICATE_BASE_URL': base_url,
+        'GEMINI_API_ENDPOINT': base_url,
+        'HUGGING_FACE_API_KEY': 'fake',
+        'FAL_KEY': 'fake',
+        'REPLICATE_API_TOKEN': 'fake',
+        'GEMINI_API_KEY': 'fake',
+    }
+
+
+def configure(updates):
+    """Apply {service or '*': {key: value}} to the fault configuration"""
+    with _lock:
+        for service, values in updates.items():
+            targets = SERVICES if service == '*' else [service]
+            for target in targets:
+                if target not in CONFIG:
+                    raise ValueError(f'Unknown service: {target}')
+                for key, value in values.items():
+                    if key not in DEFAULT_CONFIG:
+                        raise ValueError(f'Unknown setting: {key}')
+                    CONFIG[target][key] = float(value)
+
+
+def _count(service, status):
+    with _lock:
+        per_service = STATS.setdefault(service, {})
+        per_service[str(status)] = per_service.get(str(status), 0) + 1
+
+
+def _over_limit(service, max_rps):
+    """Record an arrival; True when it exceeds max_rps in the last second"""
+    if not max_rps:
+        return False
+    now = time.monotonic()
+    with _lock:
+        recent = RECENT[service]
+        while recent and now - recent[0] > 1.0:
+            recent.popleft()
+        if len(recent) >= max_rps:
+            return True
+        recent.append(now)
+        return False
+
+
+def make_png(seed, width=512, height=512):
+    """Solid-color PNG derived from the seed (cheap, deterministic)"""
+    digest = hashlib.sha256(seed.encode()).digest()
+    img = Image.new('RGB', (min(width, 1024), min(height, 1024)), tuple(digest[:3]))
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # ---------- routing ----------
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/_stats':
+            with _lock:
+                self._send_json(200, {'stats': STATS, 'config': CONFIG})
+        elif path.startswith('/files/'):
+            data = FILES.get(path[len('/files/'):])
+            if data is None:
+                self._send_json(404, {'error': 'Not found'})
+            else:
+                self._send(200, data, 'image/png')
+        elif path.startswith('/prompt/'):
+            self._serve('pollinations_image', self._pollinations_image)
+        elif path.startswith('/text/'):
+            self._serve('pollinations_text', self._pollinations_text)
+        elif path.startswith('/v1/predictions/'):
+            self._serve('replicate', self._replicate_get)
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        self.body = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+
+        if path == '/_config':
+            try:
+                configure(json.loads(self.body or b'{}'))
+                self._send_json(200, {'config': CONFIG})
+            except ValueError as e:
+                self._send_json(400, {'error': str(e)})
+        elif path.startswith('/text'):
+            self._serve('pollinations_text', self._pollinations_text)
+        elif path.startswith('/models/'):
+            self._serve('huggingface', self._huggingface)
+        elif path.startswith('/fal/'):
+            self._serve('fal', self._fal)
+        elif path == '/v1/predictions' or path.endswith('/predictions'):
+            self._serve('replicate', self._replicate_create)
+        elif path == '/v1/files':
+            self._serve('replicate', self._replicate_file)
+        elif ':generateContent' in path:
+            self._serve('gemini', self._gemini)
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    # ---------- fault injection ----------
+
+    def _serve(self, service, handler):
+        with _lock:
+            config = dict(CONFIG[service])
+
+        delay = random.gauss(config['latency'], config['jitter']) if config['jitter'] else config['latency']
+        if delay > 0:
+            time.sleep(max(0.0, delay))
+
+        roll = random.random()
+        if _over_limit(service, config['max_rps']) or roll < config['rate_429']:
+            _count(service, 429)
+            self._send_json(429, {'error': 'Rate limit exceeded'}, headers={'Retry-After': '1'})
+        elif roll < config['rate_429'] + config['rate_503']:
+            _count(service, 503)
+            self._send_json(503, {'error': 'Model is currently loading', 'estimated_time': 20.0})
+        elif roll < config['rate_429'] + config['rate_503'] + config['error_rate']:
+            _count(service, 500)
+            self._send_json(500, {'error': 'Internal server error'})
+        else:
+            _count(service, 200)
+            handler()
+
+    # ---------- services ----------
+
+    def _pollinations_image(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        width = int(query.get('width', ['1024'])[0])
+        height = int(query.get('height', ['1024'])[0])
+        self._send(200, make_png(unquote(url.path), width, height), 'image/jpeg')
+
+    def _pollinations_text(self):
+        count = random.randint(5, len(CAPTIONS))
+        self._send(200, '\n'.join(random.sample(CAPTIONS, count)).encode(), 'text/plain; charset=utf-8')
+
+    def _huggingface(self):
+        self._send(200, make_png(f'hf-{len(self.body)}'), 'image/png')
+
+    def _store_file(self, seed):
+        name = f'{uuid.uuid4().hex}.png'
+        with _lock:
+            FILES[name] = make_png(seed)
+            while len(FILES) > 1000:
+                FILES.pop(next(iter(FILES)))
+        return f'http://{self.headers.get("Host")}/files/{name}'
+
+    def _fal(self):
+        url = self._store_file(f'fal-{len(self.body)}')
+        self._send_json(200, {'images': [{'url': url, 'width': 512, 'height': 512, 'content_type': 'image/png'}]})
+
+    def _prediction(self, prediction_id):
+        return {
+            'id': prediction_id,
+            'status': 'succeeded',
+            'output': [self._store_file(f'replicate-{prediction_id}')],
+            'error': None,
+            'logs': '',
+            'urls': {'get': f'http://{self.headers.get("Host")}/v1/predictions/{prediction_id}'}
+        }
+
+    def _replicate_create(self):
+        self._send_json(201, self._prediction(uuid.uuid4().hex[:12]))
+
+    def _replicate_get(self):
+        self._send_json(200, self._prediction(urlparse(self.path).path.rsplit('/', 1)[-1]))
+
+    def _replicate_file(self):
+        url = self._store_file(f'upload-{len(self.body)}')
+        self._send_json(201, {'id': uuid.uuid4().hex[:12], 'urls': {'get': url}})
+
+    def _gemini(self):
+        body = json.loads(self.body or b'{}')
+        parts = body.get('contents', [{}])[0].get('parts', [])
+        if not any('inline_data' in part for part in parts):
+            self._send_json(400, {'error': {'code': 400, 'message': 'Image part missing'}})
+            return
+
+        answer = {
+            'description': 'A test image with bold text on a plain background.',
+            'suggested_prompt': 'bold text on a plain colored background, clean design'
+        }
+        self._send_json(200, {
+            'candidates': [{
+                'content': {'role': 'model', 'parts': [{'text': json.dumps(answer)}]},
+                'finishReason': 'STOP',
+                'index': 0
+            }]
+        })
+
+    # ---------- helpers ----------
+
+    def _send_json(self, status, payload, headers=None):
+        self._send(status, json.dumps(payload).encode(), 'application/json', headers)
+
+    def _send(self, status, data, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Keep test output quiet
+
+
+def start_in_background(port=0):
+    """Start the fake server on a daemon thread; returns (server, base_url)"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeUpstreamHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def parse_settings(settings):
+    """['huggingface.rate_503=0.3', '*.latency=1'] -> configure() updates"""
+    updates = {}
+    for item in settings:
+        key, _, value = item.partition('=')
+        service, _, setting = key.partition('.')
+        updates.setdefault(service, {})[setting] = value
+    return updates
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake upstream services (Pollinations, HF, Fal, Replicate, Gemini)')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds per request (all services)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Latency standard deviation (all services)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Probability of a 500 (all services)')
+    parser.add_argument('--rate-503', type=float, default=0.0, help='Probability of a 503 model loading (all services)')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='Probability of a 429 rate limit (all services)')
+    parser.add_argument('--max-rps', type=float, default=0.0, help='Requests per second before 429s (all services)')
+    parser.add_argument('--set', action='append', default=[], metavar='SERVICE.KEY=VALUE',
+                        help=f'Per-service override, services: {", ".join(SERVICES)}')
+    args = parser.parse_args()
+
+    configure({'*': {'latency': args.latency, 'jitter': args.jitter, 'error_rate': args.error_rate,
+                     'rate_503': args.rate_503, 'rate_429': args.rate_429, 'max_rps': args.max_rps}})
+    configure(parse_settings(args.set))
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), FakeUpstreamHandler)
+    server.daemon_threads = True
+    base_url = f'http://127.0.0.1:{args.port}'
+    print(f"🧪 Fake upstreams listening on {base_url}")
+    print("   Start the app with:")
+    for key, value in env_for(base_url).items():
+        print(f"   export {key}={value}")
+    server.serve_forever()
@@ -0,0 +1,314 @@
+"""
+End-to-end load test for the web app
+Virtual users upload an image, then replay a weighted mix of preview,
+generate, meme, describe and AI edit calls; the report gives throughput,
+error counts and tail latency per action.
+
+Fully offline run (fake upstreams + the app served in this process):
+    python tests/load_test.py --with-fakes --in-process server --users 8 --duration 30
+
+Against a running app (start it with the environment printed by
+tests/fake_upstreams.py to keep upstream calls local):
+    python tests/load_test.py --base-url http://127.0.0.1:5000 --users 16 --mix preview=6,generate=2
+
+In-process runs share one interpreter between the driver and the app, so
+use them for relative comparisons; run the app separately for absolute numbers.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import threading
+import argparse
+import random
+import base64
+import json
+import time
+import sys
+import io
+import os
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, TESTS_DIR)
+
+import requests
+from PIL import Image, ImageDraw
+
+# Weighted action mixes; 'serverless' skips routes api/index.py does not have
+MIXES = {
+    'server': {'upload': 1, 'preview': 6, 'generate': 2, 'generate_ai': 1, 'memes': 2, 'describe': 1, 'ai_edit': 1},
+    'serverless': {'upload': 1, 'generate': 3, 'generate_ai': 1, 'memes': 2, 'describe': 1},
+}
+STYLE_PROMPTS = ['sunset beach', 'neon city at night', 'snowy mountains', 'minimal pastel studio']
+AI_EDIT_PROMPTS = ['make it look like a watercolor painting', 'add dramatic lighting', 'turn it into winter']
+AI_EDIT_TIMEOUT = 120
+
+
+def make_test_image(size, seed):
+    """PNG bytes of a simple poster-like image with a few lines of text"""
+    rng = random.Random(seed)
+    img = Image.new('RGB', (size, size * 3 // 4), tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for i in range(3):
+        draw.text((size // 10, (i + 1) * size // 5), f'SALE {rng.randint(10, 90)}% OFF', fill='white')
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+class Recorder:
+    """Latency samples and status codes per action, shared by all virtual users"""
+
+    def __init__(self):
+        self.samples = {}
+        self.statuses = {}
+        self.lock = threading.Lock()
+
+    def record(self, action, seconds, status):
+        with self.lock:
+            self.samples.setdefault(action, []).append(seconds)
+            per_action = self.statuses.setdefault(action, {})
+            per_action[status] = per_action.get(status, 0) + 1
+
+    def report(self, elapsed):
+        actions = {}
+        with self.lock:
+            for action, samples in sorted(self.samples.items()):
+                statuses = self.statuses[action]
+                ok = sum(count for status, count in statuses.items() if str(status).startswith('2'))
+                actions[action] = {
+                    'requests': len(samples),
+                    'ok': ok,
+                    'errors': len(samples) - ok,
+                    'statuses': {str(k): v for k, v in statuses.items()},
+                    'throughput_rps': round(len(samples) / elapsed, 2),
+                    'latency_ms': {
+                        'p50': round(percentile(samples, 50) * 1000, 1),
+                        'p90': round(percentile(samples, 90) * 1000, 1),
+                        'p99': round(percentile(samples, 99) * 1000, 1),
+                        'max': round(max(samples) * 1000, 1)
+                    }
+                }
+        # ai_edit_e2e spans the submit and its polls, it is not a request of its own
+        total = sum(stats['requests'] for action, stats in actions.items() if action != 'ai_edit_e2e')
+        return {'elapsed_s': round(elapsed, 2), 'total_requests': total,
+                'throughput_rps': round(total / elapsed, 2), 'actions': actions}
+
+
+class VirtualUser:
+    """One simulated editor session"""
+
+    def __init__(self, base_url, image_bytes, recorder, mix, rng, think_time):
+        self.base_url = base_url.rstrip('/')
+        self.image_bytes = image_bytes
+        self.image_b64 = 'data:image/png;base64,' + base64.b64encode(image_bytes).decode()
+        self.recorder = recorder
+        self.mix = mix
+        self.rng = rng
+        self.think_time = think_time
+        self.session = requests.Session()
+        self.image_path = None
+        self.texts = []
+        self.session_id = f'load-{rng.random():.8f}'
+
+    def call(self, action, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=300, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 'connection_error'
+        self.recorder.record(action, time.perf_counter() - started, status)
+        if status == 429:
+            # Back off like the web page does (admission control asked us to)
+            time.sleep(min(float(response.headers.get('Retry-After', 1)), 10))
+        return response
+
+    def upload(self):
+        response = self.call('upload', 'POST', '/api/upload',
+                             files={'image': ('load.png', self.image_bytes, 'image/png')})
+        if response is not None and response.ok:
+            data = response.json()
+            self.image_path = data.get('image_path')
+            self.texts = data.get('detected_texts', [])
+
+    def preview(self):
+        self.call('preview', 'POST', '/api/render-preview',
+                  json={'image_path': self.image_path, 'texts': self.texts})
+
+    def generate(self, style_prompt='', action='generate'):
+        self.call(action, 'POST', '/api/generate',
+                  json={'image_path': self.image_path, 'texts': self.texts, 'style_prompt': style_prompt})
+
+    def memes(self):
+        self.call('memes', 'POST', '/api/generate-memes',
+                  json={'image_path': self.image_path, 'session_id': self.session_id})
+
+    def describe(self):
+        self.call('describe', 'POST', '/api/describe',
+                  json={'image': self.image_b64, 'image_path': self.image_path, 'texts': self.texts})
+
+    def ai_edit(self):
+        started = time.perf_counter()
+        response = self.call('ai_edit', 'POST', '/api/ai-edit',
+                             json={'image': self.image_b64, 'prompt': self.rng.choice(AI_EDIT_PROMPTS)})
+        if response is None or not response.ok:
+            return
+
+        job = response.json()
+        # Follow the job to the end: the user-visible latency of an AI edit
+        while job.get('status') not in ('completed', 'failed'):
+            if time.perf_counter() - started > AI_EDIT_TIMEOUT:
+                self.recorder.record('ai_edit_e2e', time.perf_counter() - started, 'timeout')
+                return
+            time.sleep(0.25)
+            poll = self.session.get(f"{self.base_url}/api/ai-edit/{job['job_id']}", timeout=30)
+            job = poll.json()
+        self.recorder.record('ai_edit_e2e', time.perf_counter() - started, 200 if job['status'] == 'completed' else 'failed')
+
+    def run(self, deadline):
+        self.upload()
+        actions, weights = zip(*self.mix.items())
+        while time.time() < deadline:
+            action = self.rng.choices(actions, weights)[0]
+            if action == 'upload' or self.image_path is None:
+                self.upload()
+            elif action == 'generate_ai':
+                self.generate(self.rng.choice(STYLE_PROMPTS), action='generate_ai')
+            else:
+                getattr(self, action)()
+            if self.think_time:
+                time.sleep(self.rng.uniform(0, 2 * self.think_time))
+
+
+def parse_mix(spec):
+    if spec in MIXES:
+        return dict(MIXES[spec])
+    mix = {}
+    for item in spec.split(','):
+        action, _, weight = item.partition('=')
+        if action not in MIXES['server']:
+            raise ValueError(f'Unknown action: {action}')
+        mix[action] = float(weight or 1)
+    return mix
+
+
+def serve_in_process(target):
+    """Import the app (after the environment is set) and serve it on a free port"""
+    from werkzeug.serving import make_server
+
+    if target == 'asgi':
+        return serve_asgi_in_process()
+    if target == 'server':
+        sys.path.insert(0, os.path.join(PROJECT_ROOT, 'src'))
+        import app_free as module
+    else:
+        sys.path.insert(0, os.path.join(PROJECT_ROOT, 'api'))
+        import index as module
+
+    server = make_server('127.0.0.1', 0, module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def serve_asgi_in_process():
+    """src/asgi.py on uvicorn, on a free port"""
+    import socket
+    import uvicorn
+
+    sys.path.insert(0, os.path.join(PROJECT_ROOT, 'src'))
+    import asgi
+
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    server = uvicorn.Server(uvicorn.Config(asgi.app, log_level='warning'))
+    threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f'http://127.0.0.1:{sock.getsockname()[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the image editor')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--in-process', choices=['server', 'asgi', 'serverless'],
+                        help='Serve src/app_free.py, src/asgi.py or api/index.py from this process instead of --base-url')
+    parser.add_argument('--with-fakes', action='store_true',
+                        help='Start tests/fake_upstreams.py in this process (point --in-process apps at it)')
+    parser.add_argument('--fake-latency', type=float, default=0.2, help='Upstream latency with --with-fakes')
+    parser.add_argument('--fake-set', action='append', default=[], metavar='SERVICE.KEY=VALUE',
+                        help='Fake upstream override with --with-fakes, e.g. pollinations_image.max_rps=1')
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30, help='Seconds')
+    parser.add_argument('--mix', default=None, help="'server', 'serverless' or action=weight,... "
+                                                    f"(actions: {', '.join(MIXES['server'])})")
+    parser.add_argument('--think-time', type=float, default=0.0, help='Mean pause between actions (s)')
+    parser.add_argument('--image-size', type=int, default=1024)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write the JSON report here')
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix or ('serverless' if args.in_process == 'serverless' else 'server'))
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.with_fakes:
+        import fake_upstreams
+        fake_server, fake_url = fake_upstreams.start_in_background()
+        fake_upstreams.configure({'*': {'latency': args.fake_latency, 'jitter': args.fake_latency / 4}})
+        fake_upstreams.configure(fake_upstreams.parse_settings(args.fake_set))
+        os.environ.update(fake_upstreams.env_for(fake_url))
+        print(f"🧪 Fake upstreams on {fake_url} (latency {args.fake_latency}s)")
+
+    base_url = args.base_url
+    if args.in_process:
+        _, base_url = serve_in_process(args.in_process)
+    print(f"🚀 Load testing {base_url} with {args.users} users for {args.duration}s, mix {mix}")
+
+    image_bytes = make_test_image(args.image_size, args.seed)
+    recorder = Recorder()
+    deadline = time.time() + args.duration
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        users = [VirtualUser(base_url, image_bytes, recorder, mix, random.Random(args.seed + i), args.think_time)
+                 for i in range(args.users)]
+        for future in [pool.submit(user.run, deadline) for user in users]:
+            future.result()
+    report = recorder.report(time.perf_counter() - started)
+
+    print(f"\n📊 {report['total_requests']} requests in {report['elapsed_s']}s ({report['throughput_rps']} req/s)")
+    print(f"{'action':<14}{'reqs':>7}{'errors':>8}{'rps':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for action, stats in report['actions'].items():
+        latency = stats['latency_ms']
+        print(f"{action:<14}{stats['requests']:>7}{stats['errors']:>8}{stats['throughput_rps']:>8}"
+              f"{latency['p50']:>10}{latency['p90']:>10}{latency['p99']:>10}{latency['max']:>10}")
+
+    if args.with_fakes:
+        # What the upstreams saw: 429/503 answers are calls the app should not have made
+        with fake_upstreams._lock:
+            report['upstreams'] = {service: dict(counts) for service, counts in fake_upstreams.STATS.items()}
+        print("\n🧪 Upstream answers: " + ', '.join(
+            f"{service} {counts}" for service, counts in sorted(report['upstreams'].items())))
+
+    if args.output:
+        report['meta'] = {'created_at': datetime.now().isoformat(), 'base_url': base_url,
+                          'users': args.users, 'duration': args.duration, 'mix': mix,
+                          'in_process': args.in_process, 'with_fakes': args.with_fakes}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
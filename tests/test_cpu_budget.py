@@ -0,0 +1,64 @@
+"""
+Unit tests for the thread budget shared by concurrent OCR / inpaint calls
+
+    python -m pytest tests/test_cpu_budget.py
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import cpu_budget
+from cpu_budget import ThreadBudget
+
+
+@pytest.fixture
+def applied(monkeypatch):
+    """Thread counts set on torch, in order"""
+    calls = []
+
+    def set_threads(count):
+        calls.append(count)
+        return count
+
+    monkeypatch.setitem(cpu_budget.THREAD_SETTERS, 'torch', set_threads)
+    return calls
+
+
+def test_single_section_gets_every_thread(applied):
+    budget = ThreadBudget(8)
+    with budget.limit('torch') as threads:
+        assert threads == 8
+    assert applied == [8]
+
+
+def test_concurrent_sections_share_the_threads(applied):
+    budget = ThreadBudget(8)
+    with budget.limit('torch') as first:
+        with budget.limit('torch') as second:
+            assert (first, second) == (8, 4)
+            assert budget.snapshot()[('sections',)] == 2
+            assert budget.threads() == 4
+        # The remaining section gets the threads back
+        assert budget.threads() == 8
+    assert applied == [8, 4, 8]
+
+
+def test_share_never_drops_below_one_thread(applied):
+    budget = ThreadBudget(2)
+    with budget.limit('torch'), budget.limit('torch'), budget.limit('torch') as threads:
+        assert threads == 1
+
+
+def test_missing_library_is_skipped(monkeypatch):
+    def missing(count):
+        raise ImportError('no torch here')
+
+    monkeypatch.setitem(cpu_budget.THREAD_SETTERS, 'torch', missing)
+    budget = ThreadBudget(4)
+    with budget.limit('torch') as threads:
+        assert threads == 4
+    assert budget.missing == {'torch'}
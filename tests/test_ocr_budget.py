@@ -0,0 +1,67 @@
+"""
+Unit tests for the upload OCR time budget (pipeline.read_text / recognize_boxes)
+
+    python -m pytest tests/test_ocr_budget.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import pipeline
+
+BOXES = [('horizontal', [0, 40, 0, 10]), ('horizontal', [0, 20, 20, 30])]
+
+
+class FakeReader:
+    """Counts EasyOCR calls; every call takes no time"""
+
+    def __init__(self):
+        self.calls = []
+
+    def readtext(self, img_array, paragraph=False):
+        self.calls.append('readtext')
+        return [(pipeline.box_polygon(*box), 'text', 0.9) for box in BOXES]
+
+    def detect(self, img_cv, reformat=False):
+        self.calls.append('detect')
+        return [[box for _, box in BOXES]], [[]]
+
+    def recognize(self, grey, horizontal_list, free_list, **kwargs):
+        self.calls.append('recognize')
+        return [(pipeline.box_polygon('horizontal', box), 'text', 0.9) for box in horizontal_list]
+
+
+def test_no_budget_reads_in_one_batched_call():
+    reader = FakeReader()
+    results, report = pipeline.read_text(reader, None, None)
+    assert reader.calls == ['readtext']
+    assert len(results) == 2 and not report['partial']
+
+
+def test_budget_recognizes_box_by_box(monkeypatch):
+    def detect_text_boxes(reader, img_array):
+        # Without easyocr's image reformatting (not needed by the fake reader)
+        reader.detect(img_array)
+        return None, list(BOXES)
+
+    monkeypatch.setattr(pipeline, 'detect_text_boxes', detect_text_boxes)
+    reader = FakeReader()
+    results, report = pipeline.read_text(reader, None, 60)
+    assert reader.calls == ['detect', 'recognize', 'recognize']
+    assert report == {'partial': False, 'boxes_detected': 2, 'boxes_recognized': 2}
+
+
+def test_spent_budget_skips_ocr():
+    reader = FakeReader()
+    results, report = pipeline.read_text(reader, None, -1)
+    assert reader.calls == []
+    assert results == [] and report['partial']
+
+
+def test_no_box_started_after_the_deadline():
+    reader = FakeReader()
+    results, recognized = pipeline.recognize_boxes(reader, None, BOXES, deadline=0)
+    assert reader.calls == []
+    assert results == [] and recognized == 0
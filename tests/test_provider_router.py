@@ -0,0 +1,238 @@
+"""
+Unit tests for the AI edit provider router (circuit breaker, ordering,
+hedge delay) and for how AI edit attempts are reported to it
+
+    python -m pytest tests/test_provider_router.py
+"""
+
+from collections import namedtuple
+from PIL import Image
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import provider_router
+from provider_router import ProviderRouter
+from ai_providers import Provider, RetryLater, ProviderError
+from ai_jobs import AIEditQueue, AIEditJob
+
+Named = namedtuple('Named', ['name'])
+
+
+class FakeClock:
+    """Stands in for the time module inside provider_router"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(provider_router, 'time', clock)
+    monkeypatch.setattr(provider_router, 'CIRCUIT_CONSECUTIVE_FAILURES', 3)
+    monkeypatch.setattr(provider_router, 'CIRCUIT_MIN_SAMPLES', 5)
+    monkeypatch.setattr(provider_router, 'CIRCUIT_ERROR_RATE', 0.5)
+    monkeypatch.setattr(provider_router, 'CIRCUIT_COOLDOWN_SECONDS', 60)
+    return clock
+
+
+# ---------- circuit breaker ----------
+
+def test_circuit_opens_after_consecutive_failures(clock):
+    router = ProviderRouter()
+    for _ in range(2):
+        router.record('fal', 1.0, False)
+    assert router.allow('fal')
+    router.record('fal', 1.0, False)
+    assert router.snapshot()['fal']['state'] == 'open'
+    assert not router.allow('fal')
+
+
+def test_success_resets_consecutive_failures(clock):
+    router = ProviderRouter()
+    router.record('fal', 1.0, False)
+    router.record('fal', 1.0, False)
+    router.record('fal', 1.0, True)
+    router.record('fal', 1.0, False)
+    assert router.snapshot()['fal']['state'] == 'closed'
+    assert router.snapshot()['fal']['consecutive_failures'] == 1
+
+
+def test_circuit_opens_on_error_rate(clock, monkeypatch):
+    monkeypatch.setattr(provider_router, 'CIRCUIT_CONSECUTIVE_FAILURES', 100)
+    router = ProviderRouter()
+    for ok in (True, False, True, False, False):
+        router.record('fal', 1.0, ok)
+    assert router.snapshot()['fal']['state'] == 'open'
+
+
+def test_half_open_after_cooldown_allows_one_trial(clock):
+    router = ProviderRouter()
+    for _ in range(3):
+        router.record('fal', 1.0, False)
+    clock.now += 59
+    assert not router.allow('fal')
+
+    clock.now += 1
+    assert router.allow('fal')
+    assert router.snapshot()['fal']['state'] == 'half_open'
+    assert not router.allow('fal')  # Only one trial in flight
+
+
+def test_half_open_trial_success_closes(clock):
+    router = ProviderRouter()
+    for _ in range(3):
+        router.record('fal', 1.0, False)
+    clock.now += 60
+    assert router.allow('fal')
+    router.record('fal', 1.0, True)
+    assert router.snapshot()['fal']['state'] == 'closed'
+    assert router.allow('fal')
+
+
+def test_half_open_trial_failure_reopens(clock):
+    router = ProviderRouter()
+    for _ in range(3):
+        router.record('fal', 1.0, False)
+    clock.now += 60
+    assert router.allow('fal')
+    router.record('fal', 1.0, False)
+    assert router.snapshot()['fal']['state'] == 'open'
+    assert not router.allow('fal')
+
+
+def test_unreported_trial_expires(clock):
+    router = ProviderRouter()
+    for _ in range(3):
+        router.record('fal', 1.0, False)
+    clock.now += 60
+    assert router.allow('fal')
+    clock.now += 60
+    assert router.allow('fal')
+
+
+# ---------- ordering and hedging ----------
+
+def test_order_prefers_fast_healthy_providers(clock):
+    router = ProviderRouter()
+    providers = [Named('slow'), Named('fast'), Named('new')]
+    for _ in range(3):
+        router.record('slow', 10.0, True)
+        router.record('fast', 1.0, True)
+    # Unmeasured providers are tried first (optimistically), then by latency
+    assert [p.name for p in router.order(providers)] == ['new', 'fast', 'slow']
+
+
+def test_order_puts_open_circuits_last(clock):
+    router = ProviderRouter()
+    providers = [Named('broken'), Named('ok')]
+    router.record('ok', 5.0, True)
+    for _ in range(3):
+        router.record('broken', 1.0, False)
+    assert [p.name for p in router.order(providers)] == ['ok', 'broken']
+
+
+def test_hedge_delay_needs_samples(clock, monkeypatch):
+    monkeypatch.setattr(provider_router, 'HEDGE_ENABLED', True)
+    monkeypatch.setattr(provider_router, 'HEDGE_MIN_SAMPLES', 5)
+    monkeypatch.setattr(provider_router, 'HEDGE_PERCENTILE', 95)
+    router = ProviderRouter()
+    for latency in (1, 2, 3, 4):
+        router.record('fal', latency, True)
+    assert router.hedge_delay('fal') is None
+    router.record('fal', 5, True)
+    router.record('fal', 60, False)  # Failures do not count towards latency
+    assert router.hedge_delay('fal') == 5
+
+
+def test_hedge_disabled(clock, monkeypatch):
+    monkeypatch.setattr(provider_router, 'HEDGE_ENABLED', False)
+    router = ProviderRouter()
+    for _ in range(10):
+        router.record('fal', 1.0, True)
+    assert router.hedge_delay('fal') is None
+
+
+# ---------- attempts reported by the AI edit queue ----------
+
+class ImmediateScheduler:
+    """Runs retries right away instead of after their delay"""
+
+    def call_later(self, delay, fn, *args):
+        fn(*args)
+
+
+class ImmediateExecutor:
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+def png_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), 'red').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def run_job(tmp_path, monkeypatch, edit, max_attempts=3):
+    monkeypatch.setattr('rate_limit.RATE_LIMIT_ENABLED', False)
+    router = ProviderRouter()
+    queue = AIEditQueue(str(tmp_path), router, max_workers=1)
+    queue.scheduler = ImmediateScheduler()
+    queue.executor = ImmediateExecutor()
+    provider = Provider('huggingface', 'HF_TOKEN', edit, max_attempts, {})
+    job = AIEditJob(Image.new('RGB', (8, 8)), 'prompt', [provider])
+    job.launched.add(0)
+    queue._attempt(job, 0, 0)
+    return router.snapshot()['huggingface'], job
+
+
+def test_retry_later_is_not_a_failure(clock, tmp_path, monkeypatch):
+    answers = [RetryLater(0, 'model loading'), RetryLater(0, 'model loading'), png_bytes()]
+
+    def edit(image, prompt, attempt):
+        answer = answers[attempt]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    health, job = run_job(tmp_path, monkeypatch, edit)
+    assert job.status == 'completed'
+    assert health['consecutive_failures'] == 0
+    assert health['samples'] == 1 and health['error_rate'] == 0
+
+
+def test_exhausted_retries_count_one_failure(clock, tmp_path, monkeypatch):
+    def edit(image, prompt, attempt):
+        raise RetryLater(0, 'busy')
+
+    health, job = run_job(tmp_path, monkeypatch, edit)
+    assert job.status == 'failed'
+    assert health['consecutive_failures'] == 1
+    assert health['samples'] == 1
+
+
+def test_non_image_answer_is_only_an_error(clock, tmp_path, monkeypatch):
+    def edit(image, prompt, attempt):
+        return b'<html>not an image</html>'
+
+    health, job = run_job(tmp_path, monkeypatch, edit)
+    assert job.status == 'failed'
+    assert health['samples'] == 1
+    assert health['error_rate'] == 1.0
+
+
+def test_provider_error_is_a_failure(clock, tmp_path, monkeypatch):
+    def edit(image, prompt, attempt):
+        raise ProviderError('boom')
+
+    health, job = run_job(tmp_path, monkeypatch, edit)
+    assert job.status == 'failed'
+    assert health['consecutive_failures'] == 1
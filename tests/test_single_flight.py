@@ -0,0 +1,58 @@
+"""
+Unit tests for cross-process single-flight results (SINGLE_FLIGHT_DIR)
+
+    python -m pytest tests/test_single_flight.py
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import single_flight
+from single_flight import FileSingleFlight
+
+pytest.importorskip('fcntl')
+
+
+def test_result_round_trips_as_json(tmp_path):
+    response = (b'\x89PNG body', 200, [('Content-Type', 'image/png')])
+    leader = FileSingleFlight('upload', str(tmp_path / 'flight'))
+    assert leader.do('key', lambda: response) == response
+
+    # Another worker waiting on the same key reads the leader's result
+    follower = FileSingleFlight('upload', str(tmp_path / 'flight'))
+    assert follower.do('key', lambda: pytest.fail('computed twice')) == response
+    _, result_path = follower._paths('key')
+    assert open(result_path, 'rb').read().startswith(b'{')  # JSON, never unpickled
+
+
+def test_directory_is_created_private(tmp_path):
+    FileSingleFlight('upload', str(tmp_path / 'flight'))
+    assert os.stat(tmp_path / 'flight').st_mode & 0o777 == 0o700
+
+
+def test_directory_open_to_others_is_refused(tmp_path, monkeypatch):
+    directory = tmp_path / 'shared'
+    directory.mkdir(mode=0o777)
+    os.chmod(directory, 0o777)
+    with pytest.raises(PermissionError):
+        FileSingleFlight('upload', str(directory))
+
+    monkeypatch.setattr(single_flight, 'SINGLE_FLIGHT_DIR', str(directory))
+    flight = single_flight.group('upload')
+    assert not isinstance(flight, FileSingleFlight)  # Coalescing within the process only
+
+
+def test_directory_of_another_user_is_refused(tmp_path, monkeypatch):
+    monkeypatch.setattr(single_flight.os, 'getuid', lambda: os.stat(tmp_path).st_uid + 1)
+    with pytest.raises(PermissionError):
+        FileSingleFlight('upload', str(tmp_path / 'flight'))
+
+
+def test_unshareable_result_is_still_returned(tmp_path):
+    flight = FileSingleFlight('upload', str(tmp_path / 'flight'))
+    result = {'not': 'shareable'}
+    assert flight.do('key', lambda: result) is result